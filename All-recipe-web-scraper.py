@@ -4,18 +4,31 @@ various data points. The parameters we are collecting are Recipe Title, Ingredie
 Cook Time, etc.), Number of Reviews, Recipe Rating, Nutrition Facts, Date published, and
 Recipe Category (e.g. Main Dish, Breakfast).
 """
-from bs4 import BeautifulSoup
 import re
 import logging
 import datetime
 import json
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import concurrency as cc
+import bulk_load as bl
+import frontier as fr
+import http_client as http
+import json_ld as ld
+import log_setup
+import metrics as mt
+import parsers as ps
 import scrape_links as s
+import url_filter as uf
 import command_line as ar
-import dump_data as dd
-import ChatGPT_API as gpt
+import normalizer as nz
 import database_creation as db
 import sql_connection as sq
+import storage_sinks as sk
 import openai
+import requests
 
 with open('constants.json') as f:
     constants = json.load(f)
@@ -23,16 +36,17 @@ with open('constants.json') as f:
 
 def make_soup(link):
     """
-    This function will provide the BeautifulSoup object for the scraping functions called on each recipe link.
+    This function will provide the BeautifulSoup object (or the equivalent document of the configured parser backend)
+    for the scraping functions called on each recipe link.
     :param: str: link str
     :return: BeautifulSoup object
     """
     try:
         response = s.check_request_exception(link, make_soup)
-        soup = BeautifulSoup(response, features="html.parser")
+        soup = ps.make_document(response)
         return soup
     except Exception as e:
-        logging.error(f'Error getting response from link {link}: {e}')
+        logging.error('Error getting response from link %s: %s', link, e)
         return None
 
 
@@ -42,12 +56,22 @@ def get_title(soup):
     :param: BeautifulSoup object
     :return: str: recipe title
     """
+    return parse_title(soup.title)
+
+
+def parse_title(title_elem):
+    """
+    Returns the text of the page's title tag as a plain str, so the result does not keep the parsed tree alive and
+    can be pickled.
+    :param: title_elem: the title tag or None
+    :return: str: recipe title
+    """
     try:
-        title = soup.title.string
+        title = title_elem.string
     except Exception as e:
-        logging.error(f'Error getting title: {e}')
+        logging.error('Error getting title: %s', e)
         return None
-    return title
+    return str(title) if title is not None else None
 
 
 def get_ingredients(soup):
@@ -57,12 +81,21 @@ def get_ingredients(soup):
     :param: BeautifulSoup object
     :return: list: ingredients
     """
-    ingredients = []
     try:
         p_tags = soup.find_all("ul", class_=constants['INGREDIENTS_CLASS'])
     except Exception as e:
-        logging.error(f'Error getting ingredients: {e}')
+        logging.error('Error getting ingredients: %s', e)
         return None
+    return parse_ingredients(p_tags)
+
+
+def parse_ingredients(p_tags):
+    """
+    Turns the ingredient list elements into a list of strings with each ingredient and its quantity.
+    :param: p_tags: list of the ingredient list elements
+    :return: list: ingredients
+    """
+    ingredients = []
     for p in p_tags:
         ingredients.append(p.text.strip())
     if not len(ingredients):
@@ -71,18 +104,17 @@ def get_ingredients(soup):
     return ingredients
 
 
-def fetch_grid_elements_for_recipe_details(soup):
+def fetch_grid_elements_for_recipe_details(details_content):
     """
     This function gets the grid elements in the recipe details section from the web page
-    :param soup: BeautifulSoup object
+    :param details_content: the recipe details content element or None
     :return: html grid elements
     """
     try:
-        grid_elements = soup.find('div', class_=constants['DETAILS_CONTENT']) \
-            .find_all('div', class_=constants['DETAILS_LABEL'])
+        grid_elements = details_content.find_all('div', class_=constants['DETAILS_LABEL'])
         return grid_elements
     except Exception as e:
-        logging.error(f'Error getting recipe details label: {e}')
+        logging.error('Error getting recipe details label: %s', e)
         return None
 
 
@@ -97,7 +129,7 @@ def extract_label_recipe_details(element):
         value = element.find_next_sibling(class_=constants['DETAILS_VALUE']).text.strip()
         return label, value
     except Exception as e:
-        logging.error(f'Error recipe details value: {e}')
+        logging.error('Error recipe details value: %s', e)
         return None, None
 
 
@@ -114,7 +146,7 @@ def process_recipe_details(intermediate_details):
             elif key == constants['SERVINGS'] and value.isdigit():
                 intermediate_details[key] = int(value)
         except Exception as e:
-            logging.error(f'Error processing recipe details: {e}')
+            logging.error('Error processing recipe details: %s', e)
             return None
     return intermediate_details
 
@@ -127,7 +159,16 @@ def get_recipe_details(soup):
     :param: BeautifulSoup object
     :return: dict: recipe_details
     """
-    grid_elements = fetch_grid_elements_for_recipe_details(soup)
+    return parse_recipe_details(soup.find('div', class_=constants['DETAILS_CONTENT']))
+
+
+def parse_recipe_details(details_content):
+    """
+    Builds the standardized recipe details dictionary from the recipe details content element.
+    :param: details_content: the recipe details content element or None
+    :return: dict: recipe_details
+    """
+    grid_elements = fetch_grid_elements_for_recipe_details(details_content)
     if grid_elements is None:
         return None
 
@@ -164,7 +205,7 @@ def convert_to_minutes(value_str):
             else:
                 raise ValueError(f'Invalid time unit: {unit}')
     except Exception as e:
-        logging.error(f'Error converting recipe details to minutes: {e}')
+        logging.error('Error converting recipe details to minutes: %s', e)
         return None
     return total_minutes
 
@@ -175,14 +216,23 @@ def get_num_reviews(soup):
     :param: BeautifulSoup object
     :return: str: number of reviews
     """
+    return parse_num_reviews(soup.find('div', {'id': constants['REVIEWS_CLASS']}))
+
+
+def parse_num_reviews(reviews_elem):
+    """
+    Extracts the digits of the number of reviews from the review count element.
+    :param: reviews_elem: the review count element or None
+    :return: str: number of reviews
+    """
     try:
-        num_reviews_elem = soup.find('div', {'id': constants['REVIEWS_CLASS']}).text
+        num_reviews_elem = reviews_elem.text
         if any(char.isdigit() for char in num_reviews_elem):
             num_reviews = "".join([i for i in num_reviews_elem if i.isnumeric()])
         else:
             num_reviews = constants['NO_REVIEWS']
     except Exception as e:
-        logging.error(f'Error scraping number of reviews: {e}')
+        logging.error('Error scraping number of reviews: %s', e)
         return None
     return num_reviews
 
@@ -194,7 +244,15 @@ def get_rating(soup):
     :param: BeautifulSoup object
     :return: float: recipe rating or None
     """
-    rating_elem = soup.find('div', {'id': constants['RATING_CLASS']})
+    return parse_rating(soup.find('div', {'id': constants['RATING_CLASS']}))
+
+
+def parse_rating(rating_elem):
+    """
+    Extracts the rating from the rating element.
+    :param: rating_elem: the rating element or None
+    :return: float: recipe rating or None
+    """
     if rating_elem:
         rating_elem_text = rating_elem.text.strip()
         rating = float(re.search(r'\d+.\d+', rating_elem_text).group())
@@ -209,7 +267,15 @@ def get_nutrition_facts(soup):
     :param: BeautifulSoup object
     :return: dict: nutrition facts
     """
-    nutrition_table = soup.find('table', class_=constants['NUTRITION_CLASS'])
+    return parse_nutrition_facts(soup.find('table', class_=constants['NUTRITION_CLASS']))
+
+
+def parse_nutrition_facts(nutrition_table):
+    """
+    Reads the rows of the nutrition facts table into a dictionary.
+    :param: nutrition_table: the nutrition facts table or None
+    :return: dict: nutrition facts
+    """
     nutrition_facts = {}
 
     if nutrition_table is not None:
@@ -222,7 +288,7 @@ def get_nutrition_facts(soup):
                     amount = amount[:constants['GRAMS_INDEX']]
                 nutrition_facts[label] = int(amount)
         except Exception as e:
-            logging.error(f'Error scraping nutrition facts: {e}')
+            logging.error('Error scraping nutrition facts: %s', e)
             return None
     return nutrition_facts
 
@@ -233,12 +299,21 @@ def get_date_published(soup):
     :param: BeautifulSoup object
     :return: datetime object: date_published
     """
+    return parse_date_published(soup.find('div', class_=constants['DATE_CLASS']))
+
+
+def parse_date_published(date_elem):
+    """
+    Parses the publish date out of the attribution date element.
+    :param: date_elem: the attribution date element or None
+    :return: datetime object: date_published
+    """
     try:
-        date_elem = soup.find('div', class_=constants['DATE_CLASS']).text.strip().split()
-        date_published_str = " ".join(date_elem[constants['PUBLISHED_ON']:])
+        date_words = date_elem.text.strip().split()
+        date_published_str = " ".join(date_words[constants['PUBLISHED_ON']:])
         date_published = datetime.datetime.strptime(date_published_str, '%B %d, %Y')
     except Exception as e:
-        logging.error(f'Error scraping date published: {e}')
+        logging.error('Error scraping date published: %s', e)
         return None
     return date_published
 
@@ -249,11 +324,19 @@ def get_categories(soup):
     :param: BeautifulSoup object
     :return: list: categories
     """
+    return parse_categories(soup.find('ul', class_=constants['CATEGORY_CLASS']))
+
+
+def parse_categories(breadcrumb):
+    """
+    Reads the category names from the breadcrumb list.
+    :param: breadcrumb: the breadcrumb list element or None
+    :return: list: categories
+    """
     try:
-        breadcrumb = soup.find('ul', class_=constants['CATEGORY_CLASS'])
         categories = [elem.text.strip() for elem in breadcrumb.find_all('li')]
     except Exception as e:
-        logging.error(f'Error scraping recipe categories: {e}')
+        logging.error('Error scraping recipe categories: %s', e)
         return None
     return categories
 
@@ -264,8 +347,16 @@ def get_recipe_instructions(soup):
     :param: soup: BeautifulSoup object
     :return: dict: recipe instructions with numbered keys
     """
+    return parse_recipe_instructions(soup.find('ol', class_=constants['INSTRUCTIONS_CLASS']))
+
+
+def parse_recipe_instructions(instructions_elem):
+    """
+    Reads the numbered steps from the instructions list, dropping the photo captions.
+    :param: instructions_elem: the instructions list element or None
+    :return: dict: recipe instructions with numbered keys
+    """
     instructions = {}
-    instructions_elem = soup.find('ol', class_=constants['INSTRUCTIONS_CLASS'])
     try:
         for idx, tag in enumerate(instructions_elem.find_all('li')):
             # Remove the undesired text
@@ -274,74 +365,397 @@ def get_recipe_instructions(soup):
                 nested_elem.extract()
             instructions[idx + 1] = tag.text.strip()
     except Exception as e:
-        logging.error(f"Error getting instructions: {e}")
+        logging.error("Error getting instructions: %s", e)
 
     return instructions
 
 
+def build_selector_plan():
+    """
+    Compiles the selectors from constants.json into a lookup table keyed by tag name, so that every field's element
+    can be located in a single traversal of the tree instead of one find per field.
+    :return: dict: tag name -> list of (field, attribute, value, find_all) tuples
+    """
+    selectors = [
+        ('title', 'title', None, None, False),
+        ('ingredients', 'ul', 'class', constants['INGREDIENTS_CLASS'], True),
+        ('details', 'div', 'class', constants['DETAILS_CONTENT'], False),
+        ('reviews', 'div', 'id', constants['REVIEWS_CLASS'], False),
+        ('rating', 'div', 'id', constants['RATING_CLASS'], False),
+        ('nutrition', 'table', 'class', constants['NUTRITION_CLASS'], False),
+        ('published', 'div', 'class', constants['DATE_CLASS'], False),
+        ('category', 'ul', 'class', constants['CATEGORY_CLASS'], False),
+        ('instructions', 'ol', 'class', constants['INSTRUCTIONS_CLASS'], False),
+    ]
+    plan = {}
+    for field, tag_name, attribute, value, find_all in selectors:
+        plan.setdefault(tag_name, []).append((field, attribute, value, find_all))
+    return plan
+
+
+SELECTOR_PLAN = build_selector_plan()
+
+
+def locate_elements(soup):
+    """
+    Walks the tree once and collects the element of every field in SELECTOR_PLAN: the first match for single
+    element fields and all matches for the ingredient lists.
+    :param soup: BeautifulSoup object
+    :return: dict: field -> element (or list of elements for ingredients), missing fields map to None
+    """
+    elements = {'ingredients': []}
+    for tag in soup.descendants:
+        selectors = SELECTOR_PLAN.get(tag.name)
+        if not selectors:
+            continue
+        for field, attribute, value, find_all in selectors:
+            if find_all:
+                if ps.matches_selector(tag, attribute, value):
+                    elements[field].append(tag)
+            elif field not in elements and ps.matches_selector(tag, attribute, value):
+                elements[field] = tag
+    return elements
+
+
+FIELD_PARSERS = {
+    'title': parse_title,
+    'ingredients': parse_ingredients,
+    'details': parse_recipe_details,
+    'reviews': parse_num_reviews,
+    'rating': parse_rating,
+    'nutrition': parse_nutrition_facts,
+    'published': parse_date_published,
+    'category': parse_categories,
+    'instructions': parse_recipe_instructions
+}
+
+
 def scrape_data(soup, args, link):
     """
     This function takes in a link and the command line argument, and scrapes the specified data. If a link does not
-    have an ingredients section, the function returns None as it is not a recipe link.
+    have an ingredients section, the function returns None as it is not a recipe link. The elements of all fields are
+    located in a single pass over the tree before each one is parsed.
     :param soup: beautifulsoup object
     :param args: the arguments called from the command line
     :param link: website link from all_links
     :return: scraped_data or None
     """
-    ingredients = get_ingredients(soup)
+    with mt.timer('locate_seconds'):
+        elements = locate_elements(soup)
+    ingredients = parse_ingredients(elements['ingredients'])
     if not len(ingredients):
         return None
-    function_map = {
-        'title': get_title,
-        'ingredients': get_ingredients,
-        'details': get_recipe_details,
-        'reviews': get_num_reviews,
-        'rating': get_rating,
-        'nutrition': get_nutrition_facts,
-        'published': get_date_published,
-        'category': get_categories,
-        'link': lambda _: str(link),
-        'instructions': get_recipe_instructions
-    }
-    scraped_data_with_nulls = {key: func(soup) for key, func in function_map.items() if getattr(args, key)}
+    function_map = dict(FIELD_PARSERS, ingredients=lambda _: ingredients, link=lambda _: str(link))
+    if mt.is_enabled():
+        function_map = {key: mt.timed('extract_seconds', field=key)(func) for key, func in function_map.items()}
+    scraped_data_with_nulls = {key: func(elements.get(key)) for key, func in function_map.items()
+                               if getattr(args, key)}
     scraped_data = {k: v for k, v in scraped_data_with_nulls.items() if v is not None}
 
     return scraped_data
 
 
-def scrape_and_dump_data(all_links, args):
+def scrape_structured_data(html, args, link):
     """
-    This function calls the scraping and database dumping functions for each website link. It skips over any non-recipe
-    website links.
-    :param all_links: list of all the links to be scraped
+    Scrapes the requested fields from the page's JSON-LD Recipe block without building a DOM. The page is parsed
+    into a soup only if some requested fields are missing from the structured data, and only those fields are then
+    scraped with the regular parsers. Pages without a Recipe block go through scrape_data.
+    :param html: str: the raw page
     :param args: the arguments called from the command line
+    :param link: website link from all_links
+    :return: scraped_data or None
     """
-    for link in all_links:
-        try:
-            soup = make_soup(link)
-            scraped_data = scrape_data(soup, args, link)
-            if scraped_data is None:
-                logging.info(f'Not a recipe: {link}. Skipping...')
-                continue
-            dd.write_to_database(scraped_data)
-            logging.info(f'Recipe: {scraped_data["title"]} was Inserted to the Recipes database.')
-        except Exception as e:
-            logging.error(f'Error scraping recipe details from link {link}: {e}')
+    structured = ld.extract_recipe(html, link)
+    if structured is None:
+        return scrape_data(ps.make_document(html), args, link)
+    requested = [key for key in list(FIELD_PARSERS) + ['link'] if getattr(args, key)]
+    scraped_data = {key: structured[key] for key in requested if key in structured}
+    missing = [key for key in requested if key not in scraped_data]
+    if missing:
+        elements = locate_elements(ps.make_document(html))
+        fallback = {key: FIELD_PARSERS[key](elements.get(key)) for key in missing}
+        scraped_data.update({k: v for k, v in fallback.items() if v is not None})
+    return scraped_data
+
+
+def scrape_html(html, args, link):
+    """
+    Scrapes a downloaded page with the extraction mode chosen on the command line.
+    :param html: str: the raw page
+    :param args: the arguments called from the command line
+    :param link: website link from all_links
+    :return: scraped_data or None
+    """
+    if args.extract_mode == 'json-ld':
+        return scrape_structured_data(html, args, link)
+    return scrape_data(ps.make_document(html), args, link)
+
+
+def fetch_page(link):
+    """
+    Downloads a single recipe link.
+    :param link: website link from all_links
+    :return: str: the raw page
+    :raise: requests.exceptions.RequestException: If the request failed after all retries, http.NotRetryableError if
+    the server answered with a status that is not worth retrying (e.g. 404).
+    """
+    try:
+        with mt.timer('fetch_seconds'):
+            return http.fetch(link)
+    except requests.exceptions.RequestException:
+        mt.inc('fetch_errors_total')
+        raise
+
+
+def fetch_and_scrape(link, args):
+    """
+    Fetches a single recipe link and runs the scraping functions on it. This is the unit of work handed to the
+    fetch worker threads, so it must not touch the database.
+    :param link: website link from all_links
+    :param args: the arguments called from the command line
+    :return: scraped_data or None
+    :raise: requests.exceptions.RequestException: If the page could not be downloaded, see fetch_page.
+    """
+    return scrape_html(fetch_page(link), args, link)
+
+
+def init_parse_worker(backend, log_queue):
+    """
+    Initializer of the parse worker processes, applies the parser backend chosen in the parent process and sends the
+    worker's log records to the parent.
+    :param backend: str: parser backend name
+    :param log_queue: the queue of log_setup.start_worker_listener
+    """
+    log_setup.configure_worker(log_queue)
+    ps.configure_backend(backend)
+
+
+def scrape_page(page, args):
+    """
+    Runs the scraping functions on a downloaded page. This is the unit of work handed to the parse worker
+    processes, so it only gets and returns plain picklable values.
+    :param page: tuple: (link, raw page or None, error message of a status that is not worth retrying or None)
+    :param args: the arguments called from the command line
+    :return: scraped_data or None
+    :raise: ConnectionError: If the page could not be downloaded, http.NotRetryableError if it is not worth retrying.
+    """
+    link, html, not_retryable = page
+    if not_retryable is not None:
+        raise http.NotRetryableError(not_retryable)
+    if html is None:
+        raise ConnectionError(f'Could not download {link}')
+    return scrape_html(html, args, link)
+
+
+def fetch_stage(all_links, args, pages_queue):
+    """
+    Fetches the links with a pool of args.workers threads and puts the page tuples of scrape_page on the bounded
+    queue, followed by None once every link was fetched. put() blocks while the queue is full, so fetching never runs more
+    than the queue size ahead of the parse stage.
+    :param all_links: iterable of all the links to be scraped
+    :param args: the arguments called from the command line
+    :param pages_queue: queue.Queue shared with the parse stage
+    """
+    max_in_flight = args.workers * constants['IN_FLIGHT_PER_WORKER']
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for link, future in cc.bounded_imap_unordered(executor, fetch_page, all_links, max_in_flight):
+                html, not_retryable = None, None
+                try:
+                    html = future.result()
+                except http.NotRetryableError as e:
+                    not_retryable = str(e)
+                except Exception as e:
+                    logging.error('Error fetching link %s: %s', link, e)
+                pages_queue.put((link, html, not_retryable))
+    finally:
+        pages_queue.put(None)
+
+
+def scrape_in_processes(all_links, args):
+    """
+    Producer/consumer pipeline for CPU-bound parsing: a background thread fetches pages onto a bounded queue and a
+    pool of args.parse_processes processes scrapes them, with a bounded number of pages submitted at a time.
+    :param all_links: iterable of all the links to be scraped
+    :param args: the arguments called from the command line
+    :return: generator of (link, future) tuples, the future holding scraped_data or None
+    """
+    max_in_flight = args.parse_processes * constants['IN_FLIGHT_PER_WORKER']
+    pages_queue = queue.Queue(maxsize=max_in_flight)
+    fetcher = threading.Thread(target=fetch_stage, args=(all_links, args, pages_queue), daemon=True)
+    fetcher.start()
+    log_queue, log_listener = log_setup.start_worker_listener()
+    try:
+        with ProcessPoolExecutor(max_workers=args.parse_processes, initializer=init_parse_worker,
+                                 initargs=(args.parser, log_queue)) as pool:
+            pages = iter(pages_queue.get, None)
+            for (link, _, _), future in cc.bounded_imap_unordered(pool, scrape_page, pages, max_in_flight, args):
+                yield link, future
+    finally:
+        log_listener.stop()
+    fetcher.join()
+
+
+def scrape_results(all_links, args):
+    """
+    Fetches and scrapes the links, in the fetch threads or, with --parse-processes, in a separate process pool.
+    :param all_links: iterable of all the links to be scraped
+    :param args: the arguments called from the command line
+    :return: generator of (link, future) tuples in completion order, the future holding scraped_data or None
+    """
+    if args.parse_processes:
+        yield from scrape_in_processes(all_links, args)
+        return
+    max_in_flight = args.workers * constants['IN_FLIGHT_PER_WORKER']
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        yield from cc.bounded_imap_unordered(executor, fetch_and_scrape, all_links, max_in_flight, args)
+
+
+def log_throughput(pages, start_time, final=False):
+    """
+    Logs how many pages were processed so far and the pages per second rate.
+    :param pages: number of pages processed
+    :param start_time: time.perf_counter() value taken when scraping started
+    :param final: True for the summary line at the end of the run
+    """
+    elapsed = time.perf_counter() - start_time
+    rate = pages / elapsed if elapsed else 0.0
+    prefix = 'Finished scraping' if final else 'Scraped'
+    logging.info('%s %s pages in %.1fs (%.2f pages/sec)', prefix, pages, elapsed, rate)
+
+
+def settle_links(unwritten, failed, frontier):
+    """
+    Records the outcome of the recipe links once the writer flushed their recipes: the links of the recipes it could
+    not write are failed, so they are scraped again, the others are completed.
+    :param unwritten: list of (scraped_data, link) tuples of the recipes flushed since the last call, emptied here
+    :param failed: list of the scraped_data dictionaries the writer could not write
+    :param frontier: fr.Frontier object
+    """
+    failed_ids = {id(scraped_data) for scraped_data in failed}
+    for scraped_data, link in unwritten:
+        if id(scraped_data) in failed_ids:
+            frontier.fail(link, 'The recipe could not be written')
+        else:
+            frontier.complete(link)
+    unwritten.clear()
+
+
+def scrape_and_dump_data(all_links, args, frontier):
+    """
+    This function calls the scraping and database dumping functions for each website link. It skips over any non-recipe
+    website links. Links are fetched by a pool of args.workers threads that keeps a bounded number of requests in
+    flight and scraped in those threads or in a process pool (see scrape_results), while the calling thread writes
+    the recipes to the storage sink chosen with --sink in batches of args.batch_size.
+    The links come from the crawl frontier, which records the outcome of every link. The link of a recipe is only
+    completed once the writer flushed the recipe, and failed if the writer could not write it, so a restarted crawl
+    never skips an unwritten recipe. Links that failed are retried in further rounds, once their backoff has passed,
+    until they succeed or are dead. The run waits at most FRONTIER_RETRY_WAIT_MAX_SECS for the next retry; links with
+    a longer backoff stay failed in the frontier and are retried by the next run.
+    :param all_links: iterable of the new links to seed the frontier with, or None to resume the recorded crawl
+    :param args: the arguments called from the command line
+    :param frontier: fr.Frontier object
+    """
+    start_time = time.perf_counter()
+    pages = 0
+    unwritten = []
+    with sk.open_sink(args.sink, batch_size=args.batch_size, path=args.sink_path) as writer:
+        while True:
+            for link, future in scrape_results(frontier.stream(all_links), args):
+                pages += 1
+                if not pages % constants['PROGRESS_INTERVAL']:
+                    log_throughput(pages, start_time)
+                failed = []
+                try:
+                    scraped_data = future.result()
+                    if scraped_data is None:
+                        mt.inc('pages_total', outcome='not_recipe')
+                        logging.info('Not a recipe: %s. Skipping...', link)
+                        frontier.complete(link)
+                        failed = writer.flush_if_due()
+                    else:
+                        mt.inc('pages_total', outcome='recipe')
+                        failed = writer.add(scraped_data)
+                        unwritten.append((scraped_data, link))
+                except Exception as e:
+                    mt.inc('pages_total', outcome='error')
+                    logging.error('Error scraping recipe details from link %s: %s', link, e)
+                    frontier.fail(link, e, retry=not isinstance(e, http.NotRetryableError))
+                if not writer.buffer:
+                    settle_links(unwritten, failed, frontier)
+                if frontier.checkpoint_due():
+                    frontier.checkpoint()
+            settle_links(unwritten, writer.flush(), frontier)
+            frontier.checkpoint()
+            all_links = None
+            retry_at = frontier.next_retry_at()
+            if retry_at is None:
+                break
+            wait = max(retry_at - time.time(), 0)
+            if wait > constants['FRONTIER_RETRY_WAIT_MAX_SECS']:
+                logging.info('Leaving the failed links for the next run, the next retry is due in %.0fs', wait)
+                break
+            logging.info('Retrying failed links in %.0fs', wait)
+            time.sleep(wait)
+    log_throughput(pages, start_time, final=True)
+    logging.info('Frontier: %s', frontier.counts())
 
 
 def main():
     API = input("Please enter API key")
     ar.logging_setter()
     args = ar.argparse_setter()
-    db.create_db_if_nonexist()
-    connection = sq.sql_connector(constants["DATABASE_NAME"])
-    cursor = connection.cursor()
-    db.build_database()
-    index_links = s.get_index_links(constants['SOURCE'])
-    all_links = s.get_all_links(index_links)
-    scrape_and_dump_data(all_links, args)
-    gpt.apply_api(connection, cursor, API)
-    connection.close()
+    if args.metrics_port is not None:
+        mt.serve(args.metrics_port)
+    if args.metrics_file:
+        stop_snapshots = mt.start_snapshots(args.metrics_file)
+    http.configure_cache(not args.no_cache)
+    http.configure_archive(not args.no_archive)
+    ps.configure_backend(args.parser)
+    use_mysql = args.sink == 'mysql'
+    use_database = use_mysql or args.backfill
+    if use_database:
+        db.create_db_if_nonexist()
+        db.build_database(args.delete_duplicate_recipes)
+    frontier = fr.Frontier()
+    if args.new_crawl or frontier.is_finished():
+        frontier.reset()
+    if frontier.is_seeded():
+        logging.info('Resuming the recorded crawl: %s', frontier.counts())
+        all_links = None
+    else:
+        known_links = None if args.refresh or not use_database else uf.load_known_links()
+        index_links = s.get_index_links(constants['SOURCE'])
+        all_links = s.get_all_links(index_links, workers=args.workers, sample_size=args.sample,
+                                    known_links=known_links)
+    # the ingredients are normalized in the background while the crawl goes on, once they are in MySQL
+    normalizer = None
+    if use_mysql:
+        normalizer = nz.Normalizer(API, workers=args.normalize_workers, rate=args.api_rate,
+                                   batch_size=args.gpt_batch_size)
+        normalizer.start()
+    try:
+        scrape_and_dump_data(all_links, args, frontier)
+        if args.backfill:
+            # the staged recipes are bulk loaded first, then their ingredients are normalized
+            bl.load_staging(args.sink_path or constants['SINK_PATHS']['tsv'])
+            normalizer = nz.Normalizer(API, workers=args.normalize_workers, rate=args.api_rate,
+                                       batch_size=args.gpt_batch_size)
+            normalizer.start()
+    except BaseException:
+        # after a crash or Ctrl-C the normalizer only finishes its current chunk, the rest is left for the next run
+        if normalizer is not None:
+            normalizer.stop()
+        raise
+    else:
+        if normalizer is not None:
+            normalizer.finish()
+    finally:
+        frontier.close()
+        if args.metrics_file:
+            stop_snapshots.set()
+            mt.write_snapshot(args.metrics_file)
+    sq.close_pools()
 
 
 if __name__ == '__main__':
@@ -2,108 +2,388 @@ import logging
 import openai
 import json
 import ast
-import sys
+import concurrency as cc
+import dump_data as dd
+import ingredient_cache as ic
+import ingredient_parser as ip
+import metrics as mt
 
 with open('constants.json') as f:
     constants = json.load(f)
 
 
+_settings = {'rate_limiter': None}
+
+
+def configure_rate_limit(rate):
+    """
+    Limits the API requests sent by query_batch and api_query, from all threads together.
+    :param rate: float: maximum number of requests per second, 0 for no limit
+    """
+    _settings['rate_limiter'] = cc.RateLimiter(rate) if rate else None
+
+
+def configure_api(API):
+    """
+    Sets the API key, and the API base url if OPENAI_API_BASE is set (e.g. to the local stub_completion_server.py).
+    :param API: str: the OpenAI API key
+    """
+    openai.api_key = API
+    if constants['OPENAI_API_BASE']:
+        openai.api_base = constants['OPENAI_API_BASE']
+
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens of a text with the rule of thumb of about 4 characters per token.
+    :param text: str
+    :return: int: estimated number of tokens
+    """
+    return len(text) // 4 + 1
+
+
+def pack_batches(rows, batch_size, token_budget=constants['GPT_BATCH_TOKEN_BUDGET']):
+    """
+    Packs ingredient rows into batches of at most batch_size rows, and of no more rows than the answer can hold in
+    MAX_TOKENS at GPT_TOKENS_PER_RESULT per row. A batch is also closed before its prompt plus the expected answer
+    would exceed token_budget.
+    :param rows: list of (ingredient, recipe_id, id) tuples
+    :param batch_size: int: maximum number of rows per batch
+    :param token_budget: int: maximum estimated tokens of a request and its answer
+    :return: list: lists of rows
+    """
+    batch_size = max(1, min(batch_size, constants['MAX_TOKENS'] // constants['GPT_TOKENS_PER_RESULT']))
+    batches = []
+    batch = []
+    used = estimate_tokens(constants['BATCH_PROMPT'])
+    for row in rows:
+        cost = estimate_tokens(f'{row[2]}: {row[0].strip()}') + constants['GPT_TOKENS_PER_RESULT']
+        if batch and (len(batch) >= batch_size or used + cost > token_budget):
+            batches.append(batch)
+            batch = []
+            used = estimate_tokens(constants['BATCH_PROMPT'])
+        batch.append(row)
+        used += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def batch_prompt(batch):
+    """
+    Builds the prompt of a batch: the instructions once, then one 'id: ingredient' line per row.
+    :param batch: list of (ingredient, recipe_id, id) tuples
+    :return: str: the prompt
+    """
+    lines = '\n'.join(f'{row_id}: {" ".join(ingredient.split())}' for ingredient, _, row_id in batch)
+    return f"{constants['BATCH_PROMPT']}\n{lines}\n"
+
+
+def clean_result(item):
+    """
+    Validates one answer item: a dict with a 'quantity' (a number or null) and a non-empty 'ingredient'.
+    :param item: the decoded item
+    :return: tuple: (ingredient, quantity), or None if the item is invalid
+    """
+    if not isinstance(item, dict):
+        return None
+    quantity = item.get('quantity')
+    ingredient = item.get('ingredient')
+    if isinstance(quantity, bool) or not isinstance(quantity, (int, float, type(None))):
+        return None
+    if not isinstance(ingredient, str) or not ingredient.strip():
+        return None
+    return ingredient.strip(), quantity
+
+
+def parse_batch_response(text, row_ids):
+    """
+    Validates the answer to a batch prompt: a JSON array of objects with the keys 'id', 'quantity' (a number or
+    null) and 'ingredient'. Items with an unknown id or invalid values are dropped, so only valid rows are kept.
+    :param text: str: the completion text
+    :param row_ids: set of the row ids of the batch
+    :return: dict: row id -> list of (ingredient, quantity) tuples
+    :raise: ValueError: If the answer does not contain a JSON array.
+    """
+    items = json.loads(text[text.index('['):text.rindex(']') + 1])
+    if not isinstance(items, list):
+        raise ValueError('The answer is not a JSON array')
+    results = {}
+    for item in items:
+        result = clean_result(item)
+        if result is None or item.get('id') not in row_ids:
+            continue
+        results.setdefault(item['id'], []).append(result)
+    return results
+
+
+def query_batch(batch):
+    """
+    Sends one batch prompt to the API and maps the answer back to the rows.
+    :param batch: list of (ingredient, recipe_id, id) tuples
+    :return: dict: row id -> list of (ingredient, quantity) tuples, for the rows with a valid answer
+    :raise: openai.error.AuthenticationError: If the API key is rejected.
+    """
+    prompt = batch_prompt(batch)
+    if _settings['rate_limiter'] is not None:
+        _settings['rate_limiter'].acquire()
+    try:
+        with mt.timer('api_request_seconds', mode='batch'):
+            response = openai.Completion.create(
+                engine=constants['GPT_MODEL'],
+                prompt=prompt,
+                max_tokens=constants["MAX_TOKENS"],
+                n=constants["N_GPT_COMPLETIONS"],
+                stop=None,
+                temperature=constants["GPT_TEMP"]
+            )
+    except openai.error.AuthenticationError as e:
+        logging.error("An authentication error occurred while querying the API: %s", e)
+        raise
+    text = response.choices[constants["FIRST_RESPONSE"]].text
+    return parse_batch_response(text, {row_id for _, _, row_id in batch})
+
+
+def normalize_batch(batch):
+    """
+    Normalizes a batch of ingredient rows. Rows left without a valid answer, because the request failed or the
+    answer was malformed or incomplete, are split in two halves that are queried again, down to single rows.
+    :param batch: list of (ingredient, recipe_id, id) tuples
+    :return: dict: row id -> list of (ingredient, quantity) tuples; rows that failed on their own are left out
+    :raise: openai.error.AuthenticationError: If the API key is rejected, since no retry can succeed then.
+    """
+    try:
+        results = query_batch(batch)
+    except openai.error.AuthenticationError:
+        raise
+    except Exception as e:
+        logging.error("An error occurred while querying the API for %s ingredients: %s", len(batch), e)
+        results = {}
+    missing = [row for row in batch if row[2] not in results]
+    if not missing:
+        return results
+    if len(batch) == 1:
+        logging.error("Could not process '%s'", batch[0][0])
+        return results
+    if len(missing) == len(batch):
+        halves = [missing[:len(missing) // 2], missing[len(missing) // 2:]]
+    else:
+        halves = [missing]
+    for half in halves:
+        results.update(normalize_batch(half))
+    return results
+
+
+def write_results(connection, cursor, rows, results, cache_entries=None, cache=ic.INGREDIENT_CACHE):
+    """
+    Inserts the normalized ingredients of a chunk of rows into the ingredients_clean table, stores the new API results
+    in the ingredient cache and marks the rows as processed with one UPDATE, all in one transaction.
+    :param connection: connects to sql
+    :param cursor: executes sql queries
+    :param rows: list of (ingredient, recipe_id, id) tuples
+    :param results: dict: row id -> list of (ingredient, quantity) tuples
+    :param cache_entries: dict: raw ingredient line -> list of (ingredient, quantity) tuples, new API results
+    :param cache: ic.IngredientCache object
+    """
+    values = [(recipe_id, ingredient, quantity) for _, recipe_id, row_id in rows
+              for ingredient, quantity in results.get(row_id, [])]
+    processed = [row_id for _, _, row_id in rows if row_id in results]
+    if not processed:
+        return
+    try:
+        cache.put_many(cursor, cache_entries)
+        cursor.executemany("INSERT INTO ingredients_clean (recipe_id, ingredient, quantity) VALUES (%s, %s, %s)",
+                           values)
+        cursor.execute(f"UPDATE ingredients SET processed = 1 WHERE id IN ({dd.in_placeholders(processed)})",
+                       processed)
+        connection.commit()
+        logging.info("Clean data inserted for %s of %s ingredients", len(processed), len(rows))
+    except Exception as ex:
+        connection.rollback()
+        logging.error("An error occurred while inserting a chunk of %s ingredients: %s", len(rows), ex)
+
+
+def parse_locally(rows):
+    """
+    Runs the rule-based ingredient parser on the rows.
+    :param rows: list of (ingredient, recipe_id, id) tuples
+    :return: tuple: dict row id -> list of (ingredient, quantity) tuples for the rows the parser is confident about,
+             list of the other rows, left for the API
+    """
+    parsed = ip.parse_many(row[0] for row in rows)
+    confident = {row[2]: [(result.ingredient, result.quantity)] for row, result in zip(rows, parsed)
+                 if result.confidence >= constants['INGREDIENT_PARSER_MIN_CONFIDENCE']}
+    return confident, [row for row in rows if row[2] not in confident]
+
+
+def normalize_rows(cursor, rows, batch_size, cache=ic.INGREDIENT_CACHE, executor=None):
+    """
+    Normalizes ingredient rows: the rule-based parser handles the lines it is confident about, and the rest goes
+    through the ingredient cache. Rows with the same normalized text are looked up and sent to the API once, cached
+    results are used without any API call, and only the distinct uncached lines are packed into API batches, or with
+    a batch size of 1 sent one request per line with the single-line prompt (normalize_line).
+    :param cursor: executes sql queries
+    :param rows: list of (ingredient, recipe_id, id) tuples
+    :param batch_size: int: maximum number of ingredients per API request, 1 for one request per line
+    :param cache: ic.IngredientCache object
+    :param executor: a concurrent.futures executor that sends the API batches concurrently, None to send them in turn
+    :return: tuple: dict row id -> list of (ingredient, quantity) tuples for every normalized row,
+             dict raw ingredient line -> list of (ingredient, quantity) tuples of the new API results
+    """
+    results, rows = parse_locally(rows)
+    parsed_locally = len(results)
+    rows_by_key = {}
+    for row in rows:
+        rows_by_key.setdefault(cache.key(row[0]), []).append(row)
+    cached = cache.get_many(cursor, list(rows_by_key)) if rows_by_key else {}
+    results.update({row[2]: cached[key] for key in cached for row in rows_by_key[key]})
+    pending = [key_rows[0] for key, key_rows in rows_by_key.items() if key not in cached]
+    logging.info("%s ingredients parsed locally, %s left: %s distinct, %s cached, %s sent to the API",
+                 parsed_locally, len(rows), len(rows_by_key), len(cached), len(pending))
+    mt.inc('ingredients_total', parsed_locally, source='parser')
+    mt.inc('ingredients_total', sum(len(rows_by_key[key]) for key in cached), source='cache')
+
+    cache_entries = {}
+    batches = pack_batches(pending, batch_size)
+    request = normalize_batch if batch_size > 1 else normalize_line
+    all_answers = executor.map(request, batches) if executor is not None else map(request, batches)
+    for batch, answers in zip(batches, all_answers):
+        for ingredient, _, row_id in batch:
+            if row_id in answers:
+                cache_entries[ingredient] = answers[row_id]
+                results.update({row[2]: answers[row_id] for row in rows_by_key[cache.key(ingredient)]})
+    mt.inc('ingredients_total', len(results) - parsed_locally - sum(len(rows_by_key[key]) for key in cached),
+           source='api')
+    return results, cache_entries
+
+
+def iter_unprocessed(cursor, chunk_size=constants['INGREDIENT_CHUNK_SIZE'], last_id=0):
+    """
+    Pages through the unprocessed ingredient rows in id order with keyset pagination (WHERE id > last id), which the
+    (processed, id) index serves without a scan, so only one chunk is held in memory at a time. Rows that stay
+    unprocessed are not revisited within the same pass.
+    :param cursor: executes sql queries
+    :param chunk_size: int: number of rows per chunk
+    :param last_id: int: start after this ingredient id
+    :return: generator: lists of (ingredient, recipe_id, id) tuples
+    """
+    while True:
+        cursor.execute("SELECT ingredient, recipe_id, id FROM ingredients WHERE processed = 0 AND id > %s "
+                       "ORDER BY id LIMIT %s", (last_id, chunk_size))
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][2]
+
+
 def api_query(ingredient, API):
     """
     Send a request to OpenAI's GPT-3 API to categorize a given ingredient into a two-key dictionary format.
     :param ingredient: str: A string of an ingredient and its amount in various units (unprocessed).
     :return: message_dict_str: 2 key dict:  string of categorized ingredient and its quantity in a 2 key dictionary.
+    :raise: openai.error.AuthenticationError: If the API key is rejected, or the error of a failed request.
     """
-    openai.api_key = API
+    configure_api(API)
 
     prompt = f"Categorize this string: {ingredient.strip()}" + constants['PROMPT']
+    if _settings['rate_limiter'] is not None:
+        _settings['rate_limiter'].acquire()
 
     try:
-        response = openai.Completion.create(
-            engine=constants['GPT_MODEL'],
-            prompt=prompt,
-            max_tokens=constants["MAX_TOKENS"],
-            n=constants["N_GPT_COMPLETIONS"],
-            stop=None,
-            temperature=constants["GPT_TEMP"]
-        )
+        with mt.timer('api_request_seconds', mode='single'):
+            response = openai.Completion.create(
+                engine=constants['GPT_MODEL'],
+                prompt=prompt,
+                max_tokens=constants["MAX_TOKENS"],
+                n=constants["N_GPT_COMPLETIONS"],
+                stop=None,
+                temperature=constants["GPT_TEMP"]
+            )
     except openai.error.AuthenticationError as e:
-        logging.error(f"An authentication error occurred while querying the API: {e}")
-        sys.exit(1)
-    except Exception as e:
-        logging.error(f"An error occurred while querying the API: {e}")
+        logging.error("An authentication error occurred while querying the API: %s", e)
+        raise
 
     ingredient_quant_dict = response.choices[constants["FIRST_RESPONSE"]].text
     ingredient_quant = ingredient_quant_dict[ingredient_quant_dict.index("{"):ingredient_quant_dict.rindex("}") + 1]
-    logging.info(f"Processing: '{ingredient}' ")
+    logging.info("Processing: '%s' ", ingredient)
     return ingredient_quant
 
 
-def insert_api_data(connection, cursor, ingredient_quant, recipe_id):
+def parse_line_answer(ingredient_quant):
     """
-    This function receives the recipe_id and output from the API response, and inputs the ingredient and quantity values
-    into the ingredients_clean table for that recipe id.
-    :param connection: connects to sql
-    :param cursor: executes sql queries
+    This function receives the output from the API response to a single line and reads the ingredient and quantity
+    values out of it. Invalid items are dropped, like in parse_batch_response.
     :param ingredient_quant: A two-key dictionary with keys 'quantity' and 'ingredient', or a tuple of such dictionaries.
-    :param recipe_id: The ID of the recipe in the 'recipes' table.
+    :return: list of (ingredient, quantity) tuples
+    :raise: Exception: If the answer could not be parsed.
     """
     # split the modified ingredient string into a tuple of substrings
     if ingredient_quant.count('{') > 1:
         ingredient_quant = ingredient_quant.replace('},', '} @')
         ingredient_quant = tuple(ingredient_quant.split('@'))
+    else:
+        ingredient_quant = (ingredient_quant,)
+
+    # Convert the string representation of each ingredient dictionary to a Python object
+    results = [clean_result(ast.literal_eval(ingredient_str.strip())) for ingredient_str in ingredient_quant]
+    return [result for result in results if result is not None]
 
+
+def try_api_query(ingredient, API):
+    """
+    Runs api_query, logging a failed request instead of raising it. An authentication error is raised, since no
+    other line can succeed either.
+    :param ingredient: str: an unprocessed ingredient line
+    :param API: str: the OpenAI API key
+    :return: the answer of api_query, or None if the request failed
+    """
+    try:
+        return api_query(ingredient, API)
+    except openai.error.AuthenticationError:
+        raise
+    except Exception as ex:
+        logging.error("Error processing %s: %s", ingredient, ex)
+        return None
+
+
+def normalize_line(batch):
+    """
+    Normalizes a batch of one ingredient row with its own request and the single-line prompt (api_query), the
+    request normalize_rows sends for a batch size of 1.
+    :param batch: list of one (ingredient, recipe_id, id) tuple
+    :return: dict: row id -> list of (ingredient, quantity) tuples, empty if the request or its answer failed
+    :raise: openai.error.AuthenticationError: If the API key is rejected.
+    """
+    (ingredient, _, row_id), = batch
+    answer = try_api_query(ingredient, openai.api_key)
+    if answer is None:
+        return {}
     try:
-        ingredient_dict = None
-        # Convert the string representation of the ingredient dictionary or tuple to a Python object
-        if isinstance(ingredient_quant, str):
-            ingredient_quant = ast.literal_eval(ingredient_quant)
-            # insert processed ingredient/quantity into table
-            cursor.execute(f"INSERT INTO ingredients_clean (recipe_id, ingredient, quantity) VALUES (%s, %s, %s)",
-                           (int(recipe_id), ingredient_quant['ingredient'], ingredient_quant['quantity']))
-            connection.commit()
-            logging.info(
-                f"Clean data inserted: ingredient: {ingredient_quant['ingredient']} | "
-                f"quantity: {ingredient_quant['quantity']}")
-
-        # If ingredient is a tuple of dicts, loop through the tuple and insert each dictionary as a separate row
-        elif isinstance(ingredient_quant, tuple):
-            for ingredient_str in ingredient_quant:
-                ingredient_dict = ast.literal_eval(ingredient_str)
-                # insert processed ingredient/quantity into table
-                cursor.execute(f"INSERT INTO ingredients_clean ("
-                               f"recipe_id, ingredient, quantity) VALUES (%s, %s, %s)",
-                               (int(recipe_id), ingredient_dict['ingredient'], ingredient_dict['quantity']))
-                connection.commit()
-                logging.info(f"Clean data inserted: ingredient: ingredient: {ingredient_dict['ingredient']} | "
-                             f"quantity: {ingredient_dict['quantity']}")
+        results = parse_line_answer(answer)
     except Exception as ex:
-        logging.error(f"An error occurred while trying to insert '{ingredient_dict}' : {ex}")
+        logging.error("Error processing %s: %s", answer, ex)
+        return {}
+    if not results:
+        logging.error("Could not process '%s'", ingredient)
+        return {}
+    return {row_id: results}
 
 
-def apply_api(connection, cursor, API):
+def apply_api(connection, cursor, API, batch_size=constants['GPT_BATCH_SIZE']):
     """
     This function applies the processing of the api_query to each row of the unprocessed ingredients table.
-    It marks each ingredient with a boolean, to avoid processing the same ingredient twice.
+    It marks each ingredient with a boolean, to avoid processing the same ingredient twice. The rows are read in
+    chunks of INGREDIENT_CHUNK_SIZE (see iter_unprocessed) and each chunk is written in one transaction. The rows go
+    through the local parser and the ingredient cache, and the remaining ones are sent up to batch_size per request,
+    or one by one with a batch_size of 1 (see normalize_rows).
     :param connection: connects to sql
     :param cursor: executes sql queries
+    :param batch_size: int: maximum number of ingredients per API request
     :return: None
     """
-    # Select unprocessed rows of 'ingredient' and 'recipe_id' columns from the specified table
-    cursor.execute(f"SELECT ingredient, recipe_id, id FROM ingredients WHERE processed = 0")
-    rows = cursor.fetchall()
-
-    # Loop through each row and apply the 'api_query' function to the 'ingredient' column
-    for row in rows:
-        ingredient = row[0]
-        recipe_id = row[1]
-        id_for_processed_check = row[2]
-        try:
-            ingredients_quantity_dict = api_query(ingredient, API)
-            insert_api_data(connection, cursor, ingredients_quantity_dict, recipe_id)
-            # Update the 'processed' column to indicate that the row has been processed
-            cursor.execute(f"UPDATE ingredients SET processed = 1 WHERE id = %s", (id_for_processed_check,))
-            connection.commit()
-        except Exception as ex:
-            logging.error(f"Error processing {ingredients_quantity_dict}: {ex}")
-
+    configure_api(API)
+    for rows in iter_unprocessed(cursor):
+        results, cache_entries = normalize_rows(cursor, rows, batch_size)
+        with mt.timer('ingredient_write_seconds'):
+            write_results(connection, cursor, rows, results, cache_entries)
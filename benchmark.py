@@ -0,0 +1,621 @@
+"""
+Offline benchmarks for the scraper. They run against the saved allrecipes pages and the labeled ingredient lines in
+the fixtures directory, so no network or database access is needed.
+The suite benchmark runs every stage of the scraper and writes a JSON report that can be compared with the report of
+another commit; its SQLite stage writes to a scratch file, and its MySQL stage needs a local MySQL server
+(BENCHMARK_DB in constants.json) and is skipped without one.
+Usage: python benchmark.py {extraction,extract-modes,parsers,ingredient-parser,suite} [--repeat N]
+       python benchmark.py suite [--runs N] [--output report.json] [--compare baseline.json] [--threshold 0.3]
+       python benchmark.py <benchmark> --archive pages.archive, to run on the pages archived by the scraper
+"""
+from bs4 import BeautifulSoup
+import argparse
+import fnmatch
+import glob
+import importlib.util
+import json
+import math
+import os
+import resource
+import statistics
+import tempfile
+import sys
+import time
+import tracemalloc
+import database_creation as db
+import dump_data as dd
+import ingredient_parser as ip
+import html_archive as ha
+import json_ld as ld
+import parsers as ps
+import storage_sinks as sk
+import scrape_links as s
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+FIELDS = ['title', 'ingredients', 'details', 'reviews', 'rating', 'nutrition', 'published', 'category', 'link',
+          'instructions']
+
+
+def load_scraper():
+    """
+    Imports All-recipe-web-scraper.py as a module (its file name is not a valid module name). The module is
+    registered in sys.modules so its functions can be pickled for worker processes.
+    :return: module object
+    """
+    if 'scraper' in sys.modules:
+        return sys.modules['scraper']
+    spec = importlib.util.spec_from_file_location('scraper', 'All-recipe-web-scraper.py')
+    scraper = importlib.util.module_from_spec(spec)
+    sys.modules['scraper'] = scraper
+    spec.loader.exec_module(scraper)
+    return scraper
+
+
+_corpus = {'archive': None}
+
+
+def archive_page_name(url):
+    """
+    Names an archived page like the fixture files, so the benchmarks tell recipe pages from index pages.
+    :param url: str: the page url
+    :return: str: e.g. 'recipe_banana-banana-bread.html'
+    """
+    kind = 'recipe' if '/recipe/' in url else 'index'
+    return f"{kind}_{url.rstrip('/').rsplit('/', 1)[-1]}.html"
+
+
+def load_pages(pattern):
+    """
+    Reads the fixture pages matching a glob pattern inside the fixtures directory, or with --archive the latest copy
+    of every archived page whose name (see archive_page_name) matches it.
+    :param pattern: str: glob pattern, e.g. 'recipe_*.html'
+    :return: list: (file name, html) tuples
+    """
+    if _corpus['archive'] is not None:
+        archive = ha.HtmlArchive(_corpus['archive'])
+        try:
+            pages = [(archive_page_name(url), archive.get(url).html) for url in archive.urls()]
+        finally:
+            archive.close()
+        return [(name, html) for name, html in pages if fnmatch.fnmatch(name, pattern)]
+    pages = []
+    for path in sorted(glob.glob(os.path.join(constants['FIXTURES_DIR'], pattern))):
+        with open(path, encoding='utf-8') as page:
+            pages.append((os.path.basename(path), page.read()))
+    return pages
+
+
+def all_fields_args():
+    """
+    Builds the command line arguments namespace the scraper gets with --all.
+    :return: argparse.Namespace object
+    """
+    return argparse.Namespace(**{field: True for field in FIELDS})
+
+
+def legacy_scrape_data(scraper, soup, args, link):
+    """
+    The scrape_data implementation from before the single-pass extraction engine: one full-tree find per field,
+    and the ingredients scraped twice. Kept here as the baseline of the extraction benchmark.
+    :param scraper: the scraper module
+    :param soup: BeautifulSoup object
+    :param args: the arguments called from the command line
+    :param link: website link
+    :return: scraped_data or None
+    """
+    ingredients = scraper.get_ingredients(soup)
+    if not len(ingredients):
+        return None
+    function_map = {
+        'title': scraper.get_title,
+        'ingredients': scraper.get_ingredients,
+        'details': scraper.get_recipe_details,
+        'reviews': scraper.get_num_reviews,
+        'rating': scraper.get_rating,
+        'nutrition': scraper.get_nutrition_facts,
+        'published': scraper.get_date_published,
+        'category': scraper.get_categories,
+        'link': lambda _: str(link),
+        'instructions': scraper.get_recipe_instructions
+    }
+    scraped_data_with_nulls = {key: func(soup) for key, func in function_map.items() if getattr(args, key)}
+    return {k: v for k, v in scraped_data_with_nulls.items() if v is not None}
+
+
+def time_extraction(extract, pages, repeat):
+    """
+    Times an extraction function on freshly parsed soups of every page. Parsing is not part of the measurement.
+    :param extract: callable(soup, link) returning the scraped data
+    :param pages: list of (file name, html) tuples
+    :param repeat: int: number of passes over the pages
+    :return: tuple: list of per-page times in seconds, dict of the results of the last pass by file name
+    """
+    timings = []
+    results = {}
+    for _ in range(repeat):
+        for name, html in pages:
+            soup = BeautifulSoup(html, features="html.parser")
+            start = time.perf_counter()
+            results[name] = extract(soup, name)
+            timings.append(time.perf_counter() - start)
+    return timings, results
+
+
+DURATIONS = ['15 mins', '1 hour 10 mins', '2 hours', '1 day 2 hours 5 mins', '45 mins', '3 hrs 20 mins']
+
+
+def summarize(timings):
+    """
+    Summarizes per-page timings.
+    :param timings: list of times in seconds
+    :return: dict: mean and median time in milliseconds
+    """
+    return {'mean_ms': statistics.mean(timings) * 1000, 'p50_ms': statistics.median(timings) * 1000}
+
+
+def percentile(values, fraction):
+    """
+    :param values: list of numbers, e.g. times in seconds
+    :param fraction: float: e.g. 0.99
+    :return: float: the nearest-rank percentile
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def reference_seconds():
+    """
+    Times a fixed pure-Python loop, best of 3. The suite divides its timings by this reference, measured next to
+    them, which takes out most of the changes in machine speed (CPU frequency, other processes) between runs.
+    :return: float: seconds
+    """
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        total = 0
+        for number in range(20000):
+            total += number
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def stage_report(timings, references, items_per_call=1):
+    """
+    Builds the report of one suite stage.
+    :param timings: list of per-call times in seconds
+    :param references: list of the reference_seconds() measured next to each timing
+    :param items_per_call: int: number of items (pages, rows...) handled by each call
+    :return: dict: calls, items per second, mean, p50 and p99 latency per call, the p50 latency relative to the
+             reference loop (compared by compare_reports), and the peak RSS of the process so far
+    """
+    relative = [timing / reference for timing, reference in zip(timings, references)]
+    return {
+        'calls': len(timings),
+        'items_per_sec': len(timings) * items_per_call / sum(timings) if sum(timings) else None,
+        'mean_ms': statistics.mean(timings) * 1000,
+        'p50_ms': percentile(timings, 0.5) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'p50_relative': percentile(relative, 0.5),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def time_calls(func, items, repeat, min_sample=constants['BENCHMARK_MIN_SAMPLE_SECS']):
+    """
+    Times func on every item, repeat times, after an unmeasured warm-up pass. The warm-up also sizes the samples: an
+    item whose call is shorter than min_sample is called in a loop that lasts about min_sample, and the sample is the
+    mean time per call, so microsecond calls are not lost in the timer's resolution.
+    :param func: callable(item)
+    :param items: list of items
+    :param repeat: int: number of passes over the items
+    :param min_sample: float: minimum duration of one timed sample in seconds
+    :return: tuple: list of per-call times in seconds, list of the reference_seconds() of each pass (one per
+             timing), list of the results of the last pass
+    """
+    loops = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        loops.append(max(1, math.ceil(min_sample / max(time.perf_counter() - start, 1e-9))))
+    timings = []
+    references = []
+    results = []
+    for _ in range(repeat):
+        results = []
+        reference = reference_seconds()
+        for item, count in zip(items, loops):
+            start = time.perf_counter()
+            for _ in range(count):
+                result = func(item)
+            timings.append((time.perf_counter() - start) / count)
+            results.append(result)
+        references += [(reference + reference_seconds()) / 2] * len(items)
+    return timings, references, results
+
+
+def bench_extraction(repeat):
+    """
+    Compares the per-page extraction time of the legacy per-field getters with the single-pass engine in
+    scrape_data, and checks that both return the same records.
+    :param repeat: int: number of passes over the fixture pages
+    :return: dict: report
+    """
+    scraper = load_scraper()
+    pages = load_pages('*.html')
+    args = all_fields_args()
+    legacy_times, legacy_results = time_extraction(
+        lambda soup, link: legacy_scrape_data(scraper, soup, args, link), pages, repeat)
+    single_pass_times, single_pass_results = time_extraction(
+        lambda soup, link: scraper.scrape_data(soup, args, link), pages, repeat)
+    legacy = summarize(legacy_times)
+    single_pass = summarize(single_pass_times)
+    return {
+        'pages': len(pages),
+        'repeat': repeat,
+        'legacy_getters': legacy,
+        'single_pass': single_pass,
+        'speedup': legacy['mean_ms'] / single_pass['mean_ms'],
+        'identical_records': legacy_results == single_pass_results,
+    }
+
+
+def bench_extract_modes(repeat):
+    """
+    Compares the per-page time of scrape_html (parsing included) in dom and json-ld extraction mode.
+    :param repeat: int: number of passes over the fixture pages
+    :return: dict: report
+    """
+    scraper = load_scraper()
+    pages = load_pages('*.html')
+    report = {'pages': len(pages), 'repeat': repeat}
+    for mode in ['dom', 'json-ld']:
+        args = all_fields_args()
+        args.extract_mode = mode
+        timings = []
+        for _ in range(repeat):
+            for name, html in pages:
+                start = time.perf_counter()
+                scraper.scrape_html(html, args, name)
+                timings.append(time.perf_counter() - start)
+        report[mode] = summarize(timings)
+    report['speedup'] = report['dom']['mean_ms'] / report['json-ld']['mean_ms']
+    return report
+
+
+def parse_and_extract(scraper, html, args, name):
+    """
+    Parses one fixture page with the configured backend and runs the extraction on it: the recipe fields for recipe
+    pages, the links for index pages.
+    :param scraper: the scraper module
+    :param html: str: the raw page
+    :param args: the arguments called from the command line
+    :param name: str: file name of the fixture
+    :return: the extracted record
+    """
+    if name.startswith('index_'):
+        return s.parse_index_links(html) + s.parse_recipe_links(html)
+    return scraper.scrape_data(ps.make_document(html), args, name)
+
+
+def bench_parsers(repeat):
+    """
+    Measures parse + extract time and peak Python memory allocation per page for every installed parser backend,
+    and checks that each backend extracts the same records as html.parser.
+    :param repeat: int: number of passes over the fixture pages
+    :return: dict: report
+    """
+    scraper = load_scraper()
+    pages = load_pages('*.html')
+    args = all_fields_args()
+    report = {'pages': len(pages), 'repeat': repeat}
+    baseline = None
+    for backend in ps.BACKENDS:
+        try:
+            ps.make_document('<html></html>', backend)
+        except Exception as e:
+            report[backend] = {'unavailable': str(e)}
+            continue
+        ps.configure_backend(backend)
+        timings = []
+        peaks = []
+        records = {}
+        for _ in range(repeat):
+            for name, html in pages:
+                start = time.perf_counter()
+                records[name] = parse_and_extract(scraper, html, args, name)
+                timings.append(time.perf_counter() - start)
+        for name, html in pages:
+            tracemalloc.start()
+            parse_and_extract(scraper, html, args, name)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        baseline = records if baseline is None else baseline
+        report[backend] = dict(summarize(timings), python_peak_kb=statistics.mean(peaks) / 1024,
+                               identical_records=records == baseline)
+    return report
+
+
+def quantity_matches(parsed, expected):
+    """
+    Checks a parsed quantity against its label, within INGREDIENT_QUANTITY_TOLERANCE (relative).
+    :param parsed: float or None
+    :param expected: float or None
+    :return: True or False
+    """
+    if parsed is None or expected is None:
+        return parsed is None and expected is None
+    return abs(parsed - expected) <= constants['INGREDIENT_QUANTITY_TOLERANCE'] * expected
+
+
+def bench_ingredient_parser(repeat):
+    """
+    Measures the throughput of the rule-based ingredient parser and its accuracy against the labeled ingredient
+    lines: the share of lines it is confident about (the rest would be sent to the API), and how many of those get
+    the right ingredient name and quantity.
+    :param repeat: int: number of passes over the labeled lines
+    :return: dict: report
+    """
+    with open(os.path.join(constants['FIXTURES_DIR'], 'ingredients_labeled.json'), encoding='utf-8') as labeled:
+        labels = json.load(labeled)
+    lines = [label['text'] for label in labels]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parsed = [ip.parse_ingredient(line) for line in lines]
+    elapsed = time.perf_counter() - start
+    confident = [(result, label) for result, label in zip(parsed, labels)
+                 if result.confidence >= constants['INGREDIENT_PARSER_MIN_CONFIDENCE']]
+    names = sum(result.ingredient == label['ingredient'] for result, label in confident)
+    quantities = sum(quantity_matches(result.quantity, label['quantity']) for result, label in confident)
+    both = sum(result.ingredient == label['ingredient'] and quantity_matches(result.quantity, label['quantity'])
+               for result, label in confident)
+    return {
+        'lines': len(lines),
+        'repeat': repeat,
+        'lines_per_sec': len(lines) * repeat / elapsed,
+        'parsed_locally': len(confident) / len(lines),
+        'name_accuracy': names / len(confident) if confident else None,
+        'quantity_accuracy': quantities / len(confident) if confident else None,
+        'exact_accuracy': both / len(confident) if confident else None,
+    }
+
+
+def connect_benchmark_db():
+    """
+    Connects to the local MySQL server of the database stage and creates a scratch database with the recipe tables.
+    :return: pymysql connection, or None if there is no server (or no pymysql)
+    """
+    settings = constants['BENCHMARK_DB']
+    try:
+        import pymysql
+        connection = pymysql.connect(host=settings['HOST'], port=settings['PORT'], user=settings['USER'],
+                                     password=settings['PASSWORD'], connect_timeout=2)
+    except Exception:
+        return None
+    cursor = connection.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS {settings['DATABASE']}")
+    cursor.execute(f"CREATE DATABASE {settings['DATABASE']}")
+    cursor.execute(f"USE {settings['DATABASE']}")
+    for create_table in [db.create_recipes_table, db.create_ingredients_table, db.create_ingredients_clean_table,
+                         db.create_recipe_details_table, db.create_nutrition_facts_table, db.create_categories_table,
+                         db.create_instructions_table, db.create_categories_recipes_table,
+                         db.create_ingredient_cache_table]:
+        create_table(cursor)
+    connection.commit()
+    cursor.close()
+    return connection
+
+
+def bench_db_write(records, repeat):
+    """
+    Times dump_data.write_batch against the local MySQL server, in batches of WRITE_BATCH_SIZE recipes. Every pass
+    writes the fixture records under new titles and links, so each batch inserts new recipes.
+    :param records: list of scraped_data dictionaries
+    :param repeat: int: number of passes over the records
+    :return: dict: stage report, or the reason the stage was skipped
+    """
+    connection = connect_benchmark_db()
+    if connection is None:
+        return {'unavailable': 'no local MySQL server (BENCHMARK_DB in constants.json)'}
+    recipes = benchmark_recipes(records, repeat * constants['WRITE_BATCH_SIZE'])
+    batches = [recipes[start:start + constants['WRITE_BATCH_SIZE']]
+               for start in range(0, len(recipes), constants['WRITE_BATCH_SIZE'])]
+    category_cache = dd.LookupCache('categories', 'category')
+    cursor = connection.cursor()
+    timings = []
+    references = []
+    try:
+        for batch in batches:
+            references.append(reference_seconds())
+            start = time.perf_counter()
+            dd.write_batch(cursor, batch, category_cache)
+            connection.commit()
+            timings.append(time.perf_counter() - start)
+        cursor.execute(f"DROP DATABASE {constants['BENCHMARK_DB']['DATABASE']}")
+    finally:
+        cursor.close()
+        connection.close()
+    return dict(stage_report(timings, references, constants['WRITE_BATCH_SIZE']), recipes=len(recipes))
+
+
+def benchmark_recipes(records, count):
+    """
+    :param records: list of scraped_data dictionaries
+    :param count: int: number of recipes
+    :return: list: count copies of the records under new titles and links, so each one is a new recipe
+    """
+    copies = count // max(len(records), 1) + 1
+    return [dict(record, title=f"{record['title']} #{copy}", link=f"{record['link']}?copy={copy}")
+            for copy in range(copies) for record in records][:count]
+
+
+def bench_sqlite_write(records, repeat):
+    """
+    Times the SQLite storage sink on a scratch file, in batches of WRITE_BATCH_SIZE recipes.
+    :param records: list of scraped_data dictionaries
+    :param repeat: int: number of batches
+    :return: dict: stage report
+    """
+    recipes = benchmark_recipes(records, repeat * constants['WRITE_BATCH_SIZE'])
+    timings = []
+    references = []
+    with tempfile.TemporaryDirectory() as directory:
+        sink = sk.SQLiteSink(os.path.join(directory, 'benchmark.sqlite'), batch_size=constants['WRITE_BATCH_SIZE'])
+        for start in range(0, len(recipes), constants['WRITE_BATCH_SIZE']):
+            batch = recipes[start:start + constants['WRITE_BATCH_SIZE']]
+            references.append(reference_seconds())
+            begin = time.perf_counter()
+            sink.write_batch(batch)
+            timings.append(time.perf_counter() - begin)
+        sink.close()
+    return dict(stage_report(timings, references, constants['WRITE_BATCH_SIZE']), recipes=len(recipes))
+
+
+def suite_stages(repeat):
+    """
+    Runs every stage of the scraper on the fixture corpus once: html parsing, each field getter, convert_to_minutes,
+    the single-pass and JSON-LD extraction, the index page link extraction, the ingredient parser, and the write path
+    of the SQLite sink and of the MySQL database.
+    :param repeat: int: number of passes over the fixtures
+    :return: tuple: dict with one stage report per stage, number of pages
+    """
+    scraper = load_scraper()
+    pages = load_pages('*.html')
+    recipe_pages = [(name, html) for name, html in pages if name.startswith('recipe_')]
+    index_pages = [html for name, html in pages if name.startswith('index_')]
+    args = all_fields_args()
+    stages = {}
+
+    timings, references, _ = time_calls(lambda page: ps.make_document(page[1]), pages, repeat)
+    stages['parse'] = stage_report(timings, references)
+
+    getters = {'get_title': scraper.get_title, 'get_ingredients': scraper.get_ingredients,
+               'get_recipe_details': scraper.get_recipe_details, 'get_num_reviews': scraper.get_num_reviews,
+               'get_rating': scraper.get_rating, 'get_nutrition_facts': scraper.get_nutrition_facts,
+               'get_date_published': scraper.get_date_published, 'get_categories': scraper.get_categories,
+               'get_recipe_instructions': scraper.get_recipe_instructions}
+    soups = [ps.make_document(html) for _, html in recipe_pages]
+    for name, getter in getters.items():
+        timings, references, _ = time_calls(getter, soups, repeat)
+        stages[name] = stage_report(timings, references)
+
+    timings, references, _ = time_calls(scraper.convert_to_minutes, DURATIONS, repeat)
+    stages['convert_to_minutes'] = stage_report(timings, references)
+    timings, references, records = time_calls(
+        lambda page: scraper.scrape_data(ps.make_document(page[1]), args, page[0]), recipe_pages, repeat)
+    stages['scrape_data'] = stage_report(timings, references)
+    timings, references, _ = time_calls(lambda page: ld.extract_recipe(page[1], page[0]), recipe_pages, repeat)
+    stages['json_ld'] = stage_report(timings, references)
+    timings, references, _ = time_calls(lambda html: s.parse_index_links(html) + s.parse_recipe_links(html),
+                                        index_pages, repeat)
+    stages['index_links'] = stage_report(timings, references)
+    ingredients = [ingredient for record in records for ingredient in record['ingredients']]
+    timings, references, _ = time_calls(ip.parse_ingredient, ingredients, repeat)
+    stages['ingredient_parser'] = stage_report(timings, references)
+    stages['sqlite_write'] = bench_sqlite_write(records, repeat)
+    stages['db_write'] = bench_db_write(records, repeat)
+    return stages, len(pages)
+
+
+def median_stages(runs):
+    """
+    Merges the stage reports of several suite runs: the median of every number (the peak RSS is the maximum).
+    :param runs: list of dicts with one stage report per stage, from suite_stages
+    :return: dict: one stage report per stage
+    """
+    merged = {}
+    for stage, first in runs[0].items():
+        reports = [run[stage] for run in runs]
+        merged[stage] = {key: (max if key == 'peak_rss_kb' else statistics.median)([report[key] for report in reports])
+                         if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+                         for key, value in first.items()}
+    return merged
+
+
+def bench_suite(repeat, runs=constants['BENCHMARK_RUNS']):
+    """
+    Runs the suite runs times and reports the median of each stage, which evens out a run that was slowed down as a
+    whole (e.g. by another process).
+    :param repeat: int: number of passes over the fixtures in each run
+    :param runs: int: number of suite runs
+    :return: dict: report with one entry per stage
+    """
+    results = [suite_stages(repeat) for _ in range(runs)]
+    return {'pages': results[0][1], 'repeat': repeat, 'runs': runs,
+            'stages': median_stages([stages for stages, _ in results])}
+
+
+def compare_reports(report, baseline, threshold, min_delta_ms=constants['BENCHMARK_MIN_DELTA_MS']):
+    """
+    Compares a suite report with the report of another commit. A stage regressed if its p50 latency relative to the
+    reference loop grew by more than the threshold, and its p50 latency in milliseconds also grew by more than
+    min_delta_ms. The mean, and so the throughput, is only reported: a few slow calls move it too much to gate on.
+    :param report: dict: the current suite report
+    :param baseline: dict: the suite report to compare with
+    :param threshold: float: relative slowdown that counts as a regression, e.g. 0.3 for 30%
+    :param min_delta_ms: float: absolute slowdown in milliseconds that a regression must also exceed
+    :return: tuple: dict stage -> relative change of the p50 latency (in ms and relative to the reference loop) and
+             of the throughput, list of regressed stages
+    """
+    changes = {}
+    regressions = []
+    for stage, current in report['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        if not previous or 'p50_ms' not in current or 'p50_ms' not in previous:
+            continue
+        p50_change = current['p50_ms'] / previous['p50_ms'] - 1 if previous['p50_ms'] else 0.0
+        throughput_change = (current['items_per_sec'] / previous['items_per_sec'] - 1
+                             if previous['items_per_sec'] else 0.0)
+        changes[stage] = {'p50_change': p50_change, 'throughput_change': throughput_change}
+        if 'p50_relative' not in previous:
+            continue
+        changes[stage]['p50_relative_change'] = current['p50_relative'] / previous['p50_relative'] - 1
+        if changes[stage]['p50_relative_change'] > threshold and current['p50_ms'] - previous['p50_ms'] > min_delta_ms:
+            regressions.append(stage)
+    return changes, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline scraper benchmarks')
+    parser.add_argument('benchmark', choices=['extraction', 'extract-modes', 'parsers', 'ingredient-parser', 'suite'],
+                        help='Benchmark to run')
+    parser.add_argument('--repeat', type=int, default=constants['BENCHMARK_REPEAT'],
+                        help='Number of passes over the fixture pages')
+    parser.add_argument('--runs', type=int, default=constants['BENCHMARK_RUNS'],
+                        help='Number of suite runs, each stage reports the median of the runs')
+    parser.add_argument('--min-delta-ms', type=float, default=constants['BENCHMARK_MIN_DELTA_MS'],
+                        help='Absolute slowdown per call (ms) a suite stage must also exceed to count as a regression')
+    parser.add_argument('--archive', help='Run on the pages of this html archive instead of the fixtures')
+    parser.add_argument('--output', help='Also write the report to this JSON file')
+    parser.add_argument('--compare', help='Suite report (JSON file) of another commit to compare with')
+    parser.add_argument('--threshold', type=float, default=constants['BENCHMARK_REGRESSION_THRESHOLD'],
+                        help='Relative slowdown of a suite stage that counts as a regression')
+    args = parser.parse_args()
+    _corpus['archive'] = args.archive
+    if args.benchmark == 'extraction':
+        report = bench_extraction(args.repeat)
+    elif args.benchmark == 'extract-modes':
+        report = bench_extract_modes(args.repeat)
+    elif args.benchmark == 'ingredient-parser':
+        report = bench_ingredient_parser(args.repeat)
+    elif args.benchmark == 'suite':
+        report = bench_suite(args.repeat, args.runs)
+    else:
+        report = bench_parsers(args.repeat)
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=4)
+    if args.compare:
+        with open(args.compare) as baseline:
+            changes, regressions = compare_reports(report, json.load(baseline), args.threshold,
+                                                  args.min_delta_ms)
+        print(json.dumps({'changes': changes, 'regressions': regressions}, indent=4))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+This .py file loads the staging files of the tsv sink (storage_sinks.StagingSink) into the MySQL database with
+LOAD DATA LOCAL INFILE, MySQL's bulk loader, which is much faster than INSERT statements for a full backfill.
+The staged recipe ids count from 1, so each load shifts them past the largest id in the recipes table; run it while
+no other writer inserts recipes. The load borrows a LOAD DATA LOCAL INFILE connection from the shared pool
+(sql_connection.pooled_connection). Foreign key checks are off during the load, and the secondary indexes in
+DEFERRED_INDEXES are dropped before it and rebuilt after it on the tables that start empty; rebuilding an index on a
+table that already holds rows sorts those rows again, which costs more than the load saves. The other secondary
+indexes stay: the unique keys on recipes and categories are what skips the duplicates, and the recipe_id and
+category_id indexes belong to the foreign keys, which cannot exist without them. Recipes that are already stored
+(same link or title) are skipped by the unique keys, and the child rows staged for them are deleted afterwards. The
+loaded files are renamed with a .loaded suffix, so they are never loaded twice.
+Usage: python bulk_load.py [--staging-dir DIR]
+"""
+import argparse
+import json
+import logging
+import os
+import time
+import command_line as ar
+import database_creation as db
+import sql_connection as sq
+import storage_sinks as sk
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+LOAD_OPTIONS = "CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'"
+CHILD_TABLES = ['recipe_details', 'nutrition_facts', 'ingredients', 'instructions', 'categories_recipes']
+# table -> {index name: function that adds the index}, the secondary indexes the load does not need
+DEFERRED_INDEXES = {'ingredients': {'idx_ingredients_processed': db.add_ingredients_processed_index}}
+
+
+def load_statements(table, path, offset):
+    """
+    Builds the statements that load one staging file. Staged recipe ids are shifted by offset. The category links
+    are staged by category name, so they go through a temporary table and are joined with the categories table.
+    :param table: str: staging file name, one of sk.STAGING_FILES
+    :param path: str: path of the staging file
+    :param offset: int: the largest recipe id in the database before the load
+    :return: list of (sql, parameters, counted) tuples, counted is True for the statement that fills the table
+    """
+    if table == 'recipes':
+        return [(f"LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE recipes {LOAD_OPTIONS} "
+                 f"(@id, link, title, @title_hash, num_reviews, rating, date_published) "
+                 f"SET id = @id + %s, title_hash = UNHEX(@title_hash)", (path, offset), True)]
+    if table == 'categories_recipes':
+        return [("CREATE TEMPORARY TABLE staging_categories_recipes (category VARCHAR(300), recipe_id INT)", (),
+                 False),
+                (f"LOAD DATA LOCAL INFILE %s INTO TABLE staging_categories_recipes {LOAD_OPTIONS} "
+                 f"(category, @recipe_id) SET recipe_id = @recipe_id + %s", (path, offset), False),
+                ("INSERT IGNORE INTO categories (category) SELECT DISTINCT category FROM staging_categories_recipes",
+                 (), False),
+                ("INSERT INTO categories_recipes (category_id, recipe_id) SELECT categories.id, staged.recipe_id "
+                 "FROM staging_categories_recipes staged JOIN categories ON categories.category = staged.category",
+                 (), True),
+                ("DROP TEMPORARY TABLE staging_categories_recipes", (), False)]
+    columns = sk.STAGING_FILES[table]
+    ignore = 'IGNORE ' if table == 'nutrition_facts' else ''
+    return [(f"LOAD DATA LOCAL INFILE %s {ignore}INTO TABLE {table} {LOAD_OPTIONS} "
+             f"(@recipe_id, {', '.join(columns[1:])}) SET recipe_id = @recipe_id + %s", (path, offset), True)]
+
+
+def delete_orphans(cursor, offset):
+    """
+    Deletes the loaded child rows whose recipe was skipped as a duplicate, i.e. rows with a shifted recipe id that is
+    not in the recipes table.
+    :param cursor: Cursor object used to execute the query.
+    :param offset: int: the largest recipe id in the database before the load
+    :return: int: number of deleted rows
+    """
+    deleted = 0
+    for table in CHILD_TABLES:
+        deleted += cursor.execute(f"DELETE child FROM {table} child LEFT JOIN recipes ON recipes.id = child.recipe_id "
+                                  f"WHERE child.recipe_id > %s AND recipes.id IS NULL", (offset,))
+    return deleted
+
+
+def drop_deferred_indexes(cursor, tables):
+    """
+    Drops the DEFERRED_INDEXES of the tables that are empty, so the load does not maintain them row by row.
+    :param cursor: Cursor object used to execute the query.
+    :param tables: list: the tables that will be loaded
+    :return: list: (table, index name, function that adds the index) tuples of the dropped indexes
+    """
+    dropped = []
+    for table in tables:
+        indexes = DEFERRED_INDEXES.get(table, {})
+        if not indexes:
+            continue
+        cursor.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} LIMIT 1) rows_left")
+        if cursor.fetchone()[0]:
+            continue
+        for index, add_index in indexes.items():
+            if db.index_exists(cursor, table, index):
+                cursor.execute(f"ALTER TABLE {table} DROP INDEX {index}")
+                dropped.append((table, index, add_index))
+    return dropped
+
+
+def rebuild_indexes(cursor, dropped):
+    """
+    Adds back the indexes dropped by drop_deferred_indexes, logging how long each took.
+    :param cursor: Cursor object used to execute the query.
+    :param dropped: list: as returned by drop_deferred_indexes
+    """
+    for table, index, add_index in dropped:
+        start = time.perf_counter()
+        add_index(cursor)
+        logging.info('Rebuilt the %s index of %s in %.1fs', index, table, time.perf_counter() - start)
+
+
+def load_staging(staging_dir=constants['SINK_PATHS']['tsv'], database=constants['DATABASE_NAME']):
+    """
+    Loads every staging file of the directory, one transaction per table, and logs the rows per second of each.
+    :param staging_dir: str: the staging directory of the tsv sink
+    :param database: str: database name
+    :return: dict: table -> {'rows': loaded rows, 'seconds': load time, 'rows_per_sec': rate}
+    """
+    paths = {table: os.path.join(staging_dir, f'{table}.tsv') for table in sk.STAGING_FILES}
+    if not os.path.exists(paths['recipes']):
+        logging.info('Nothing staged in %s', staging_dir)
+        return {}
+    report = {}
+    with sq.pooled_connection(database, local_infile=True) as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM recipes")
+            offset = cursor.fetchone()[0]
+            dropped = drop_deferred_indexes(cursor, [table for table, path in paths.items() if os.path.exists(path)])
+            cursor.execute("SET foreign_key_checks = 0")
+            try:
+                for table, path in paths.items():
+                    if not os.path.exists(path):
+                        continue
+                    start = time.perf_counter()
+                    rows = 0
+                    for sql, parameters, counted in load_statements(table, os.path.abspath(path), offset):
+                        affected = cursor.execute(sql, parameters)
+                        rows += affected if counted else 0
+                    connection.commit()
+                    seconds = time.perf_counter() - start
+                    report[table] = {'rows': rows, 'seconds': seconds,
+                                     'rows_per_sec': rows / seconds if seconds else None}
+                    logging.info('Loaded %s rows into %s in %.1fs (%.0f rows/sec)', rows, table, seconds,
+                                 report[table]['rows_per_sec'] or 0)
+                deleted = delete_orphans(cursor, offset)
+                connection.commit()
+                if deleted:
+                    logging.info('Deleted %s staged rows of recipes that were already stored', deleted)
+            finally:
+                # the session goes back to the pool, so the checks are turned on again whatever happened
+                cursor.execute("SET foreign_key_checks = 1")
+                rebuild_indexes(cursor, dropped)
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+    for path in paths.values():
+        if os.path.exists(path):
+            os.replace(path, f'{path}.loaded-{time.strftime("%Y%m%d-%H%M%S")}')
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk load the staged recipes of the tsv sink into MySQL')
+    parser.add_argument('--staging-dir', default=constants['SINK_PATHS']['tsv'],
+                        help='Staging directory written by --sink tsv')
+    args = parser.parse_args()
+    ar.logging_setter()
+    db.create_db_if_nonexist()
+    db.build_database()
+    print(json.dumps(load_staging(args.staging_dir), indent=4))
+    sq.close_pools()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@ import logging
 import argparse
 import sys
 import json
+import math
+import log_setup
 
 
 with open('constants.json') as f:
@@ -18,6 +20,54 @@ def has_other_args(args):
                 args.published, args.category, args.link, args.instructions])
 
 
+def positive_int(value):
+    """
+    Argparse type for options that take a count, such as --workers and --sample.
+    :param value: str: the raw command line value
+    :return: int: the parsed value
+    :raise: argparse.ArgumentTypeError: If the value is not a positive integer.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not an integer')
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} must be at least 1')
+    return number
+
+
+def positive_float(value):
+    """
+    Argparse type for rates, such as --api-rate.
+    :param value: str: the raw command line value
+    :return: float: the parsed value
+    :raise: argparse.ArgumentTypeError: If the value is not a finite number above 0.
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not a number')
+    if not math.isfinite(number) or number <= 0:
+        raise argparse.ArgumentTypeError(f'{value} must be a finite number above 0')
+    return number
+
+
+def non_negative_int(value):
+    """
+    Argparse type for counts where 0 switches a feature off, such as --parse-processes.
+    :param value: str: the raw command line value
+    :return: int: the parsed value
+    :raise: argparse.ArgumentTypeError: If the value is not an integer of at least 0.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not an integer')
+    if number < 0:
+        raise argparse.ArgumentTypeError(f'{value} must not be negative')
+    return number
+
+
 def setup_argparse():
     """
     Set up argparse arguments for the scraper.
@@ -35,6 +85,48 @@ def setup_argparse():
     parser.add_argument('--link', action='store_true', help='Get the link to the recipe')
     parser.add_argument('--instructions', action='store_true', help='Get the instructions of the recipe')
     parser.add_argument('--all', action='store_true', help='Scrape all available data')
+    parser.add_argument('--workers', type=positive_int, default=constants['WORKERS'],
+                        help='Number of recipe pages fetched concurrently')
+    parser.add_argument('--parse-processes', type=non_negative_int, default=constants['PARSE_PROCESSES'],
+                        help='Number of processes that parse the fetched pages, 0 to parse in the fetch threads')
+    parser.add_argument('--batch-size', type=positive_int, default=constants['WRITE_BATCH_SIZE'],
+                        help='Number of recipes written to the database per transaction')
+    parser.add_argument('--gpt-batch-size', type=positive_int, default=constants['GPT_BATCH_SIZE'],
+                        help='Number of ingredients normalized per ChatGPT API request, 1 to send them one by one')
+    parser.add_argument('--normalize-workers', type=positive_int, default=constants['NORMALIZE_WORKERS'],
+                        help='Number of ChatGPT API requests sent concurrently by the normalization stage')
+    parser.add_argument('--api-rate', type=positive_float, default=constants['NORMALIZE_RATE_LIMIT'],
+                        help='Maximum number of ChatGPT API requests per second')
+    parser.add_argument('--sample', type=positive_int, default=None,
+                        help='Scrape a random sample of this many recipe links instead of every link')
+    parser.add_argument('--extract-mode', choices=['dom', 'json-ld'], default=constants['EXTRACT_MODE'],
+                        help='Scrape the page html (dom) or the embedded schema.org JSON-LD, falling back to the '
+                             'page html for missing fields (json-ld)')
+    parser.add_argument('--parser', choices=['html.parser', 'lxml', 'selectolax'],
+                        default=constants['PARSER_BACKEND'], help='HTML parser backend')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always download pages instead of using the on-disk response cache')
+    parser.add_argument('--no-archive', action='store_true',
+                        help='Do not keep the raw html of the downloaded pages in the html archive')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Scrape every link, including the recipes that are already stored in the database')
+    parser.add_argument('--new-crawl', action='store_true',
+                        help='Discard the recorded crawl frontier and crawl the index pages again instead of resuming')
+    parser.add_argument('--delete-duplicate-recipes', action='store_true',
+                        help='Let the database migration delete recipes that duplicate the link or title of an older '
+                             'recipe, with their child rows, so the unique keys on recipes can be added')
+    parser.add_argument('--sink', choices=['mysql', 'sqlite', 'jsonl', 'parquet', 'tsv'], default=constants['SINK'],
+                        help='Where the recipes are stored: the MySQL database, or a local SQLite, JSONL or Parquet '
+                             'file or TSV staging files (see bulk_load.py) to load into MySQL later')
+    parser.add_argument('--sink-path', default=None,
+                        help='File (directory for parquet and tsv) of a local sink, instead of its SINK_PATHS default')
+    parser.add_argument('--backfill', action='store_true',
+                        help='Stage the recipes in TSV files (--sink tsv) and bulk load them into MySQL with LOAD DATA '
+                             'at the end of the crawl')
+    parser.add_argument('--metrics-port', type=non_negative_int, default=None,
+                        help='Record metrics and serve them in the Prometheus text format on this port (/metrics)')
+    parser.add_argument('--metrics-file', default=None,
+                        help='Record metrics and write a JSON snapshot of them to this file periodically')
 
     return parser
 
@@ -53,11 +145,6 @@ def validate_args(parser):
         message = 'No argument was passed'
         exit_gracefully(message, parser)
 
-    # Check if too many arguments were passed
-    elif len(sys.argv) > constants['MAX_ARGS']:
-        message = 'Too many arguments'
-        exit_gracefully(message, parser)
-
     # Check if unrecognized arguments were passed
     if unknown_args:
         message = f'Unrecognized arguments: {unknown_args}'
@@ -68,6 +155,9 @@ def validate_args(parser):
         message = '--all argument should not be used with other arguments'
         exit_gracefully(message, parser)
 
+    if args_setter.backfill:
+        args_setter.sink = 'tsv'
+
     # If user chooses to scrape all available data
     if args_setter.all:
         args_setter.title = args_setter.ingredients = args_setter.details = args_setter.reviews = args_setter.rating \
@@ -100,11 +190,8 @@ def argparse_setter():
 
 def logging_setter():
     """
-    Set up logging configuration
+    Set up logging configuration: LOG_FORMAT records written to LOG_FILE and the terminal, from a background thread
+    if LOG_ASYNC is set (see log_setup.py).
     :return: logging configuration
     """
-    logging.basicConfig(
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        level=logging.INFO,
-        handlers=[logging.FileHandler("logging_info.log", mode='w+'), logging.StreamHandler()]
-    )
+    return log_setup.configure()
@@ -0,0 +1,57 @@
+from concurrent.futures import wait, FIRST_COMPLETED
+import threading
+import time
+
+
+def bounded_imap_unordered(executor, func, items, max_in_flight, *args):
+    """
+    Submits func(item, *args) to the executor for each item, keeping at most max_in_flight calls running at once,
+    and yields the results in completion order. Items are pulled lazily, so the input may be a generator.
+    :param executor: a concurrent.futures executor
+    :param func: callable that is run on each item
+    :param items: iterable of items to process
+    :param max_in_flight: maximum number of submitted but not yet consumed calls
+    :param args: extra positional arguments passed to func
+    :return: generator of (item, future) tuples, the future is done and may hold an exception
+    """
+    items = iter(items)
+    in_flight = {}
+    exhausted = False
+    while True:
+        while not exhausted and len(in_flight) < max_in_flight:
+            try:
+                item = next(items)
+            except StopIteration:
+                exhausted = True
+                break
+            in_flight[executor.submit(func, item, *args)] = item
+        if not in_flight:
+            return
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield in_flight.pop(future), future
+
+
+class RateLimiter:
+    """
+    Spaces out calls from any number of threads to at most rate per second.
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: float: maximum number of calls per second, 0 for no limit
+        """
+        self.interval = 1 / rate if rate else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until the calling thread may make its call.
+        """
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
@@ -1,4 +1,10 @@
 import sql_connection as sq
+import dump_data as dd
+import logging
+
+RECIPE_CHILD_TABLES = ['ingredients', 'ingredients_clean', 'recipe_details', 'nutrition_facts', 'instructions',
+                       'categories_recipes']
+MIGRATION_CHUNK = 1000
 
 
 def create_recipes_table(cursor):
@@ -11,9 +17,12 @@ def create_recipes_table(cursor):
             id INT PRIMARY KEY AUTO_INCREMENT NOT NULL,
             link VARCHAR(200),
             title VARCHAR(200),
+            title_hash BINARY(16) NULL,
             num_reviews INT NULL,
             rating INT NULL,
-            date_published DATETIME NULL
+            date_published DATETIME NULL,
+            UNIQUE KEY uq_recipes_link (link),
+            UNIQUE KEY uq_recipes_title_hash (title_hash)
         )""")
 
 
@@ -29,7 +38,8 @@ def create_ingredients_table(cursor):
             ingredient VARCHAR(500),
             PRIMARY KEY (id),
             FOREIGN KEY (recipe_id) REFERENCES recipes(id),
-            processed BOOLEAN DEFAULT 0
+            processed BOOLEAN DEFAULT 0,
+            INDEX idx_ingredients_processed (processed, id)
         )""")
 
 
@@ -88,7 +98,8 @@ def create_categories_table(cursor):
         CREATE TABLE IF NOT EXISTS categories (
             id INT NOT NULL AUTO_INCREMENT,
             category VARCHAR(300) NULL,
-            PRIMARY KEY (id)
+            PRIMARY KEY (id),
+            UNIQUE KEY uq_categories_category (category)
         )""")
 
 
@@ -122,40 +133,195 @@ def create_categories_recipes_table(cursor):
         )""")
 
 
-def build_database():
+def create_ingredient_cache_table(cursor):
+    """
+    Create the ingredient_cache table in the database, which memoizes the ChatGPT ingredient normalization.
+    :param cursor: Cursor object used to execute the query.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingredient_cache (
+            cache_key BINARY(16) PRIMARY KEY,
+            model VARCHAR(100),
+            prompt_version CHAR(8),
+            ingredient VARCHAR(500),
+            result TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
+
+
+def index_exists(cursor, table, index):
+    """
+    Checks if an index exists on a table of the current database.
+    :param cursor: Cursor object used to execute the query.
+    :param table: str: table name
+    :param index: str: index name
+    :return: True or False
+    """
+    cursor.execute("SELECT COUNT(*) FROM information_schema.statistics "
+                   "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s", (table, index))
+    return cursor.fetchone()[0] > 0
+
+
+def column_exists(cursor, table, column):
+    """
+    Checks if a column exists on a table of the current database.
+    :param cursor: Cursor object used to execute the query.
+    :param table: str: table name
+    :param column: str: column name
+    :return: True or False
+    """
+    cursor.execute("SELECT COUNT(*) FROM information_schema.columns "
+                   "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s", (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def backfill_title_hashes(cursor):
+    """
+    Fills recipes.title_hash for the rows written before the column existed. The hash is computed in Python with
+    dd.title_hash, so old and new rows are normalized the same way.
+    :param cursor: Cursor object used to execute the query.
+    """
+    last_id = 0
+    while True:
+        cursor.execute("SELECT id, title FROM recipes WHERE id > %s AND title_hash IS NULL AND title IS NOT NULL "
+                       "ORDER BY id LIMIT %s", (last_id, MIGRATION_CHUNK))
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        cursor.executemany("UPDATE recipes SET title_hash = %s WHERE id = %s",
+                           [(dd.title_hash(title), recipe_id) for recipe_id, title in rows])
+        last_id = rows[-1][0]
+
+
+def delete_duplicate_recipes(cursor, delete_duplicates=False):
+    """
+    Deletes the recipes that share a link or a title hash with an older recipe, together with their child rows
+    (normalized ingredients included), so the unique keys can be added. The oldest recipe of each duplicate group is
+    kept. Deleting is an explicit migration step: without delete_duplicates, finding duplicates is an error.
+    :param cursor: Cursor object used to execute the query.
+    :param delete_duplicates: bool: delete the duplicates instead of failing
+    :raise: RuntimeError: If there are duplicate recipes and delete_duplicates is False.
+    """
+    cursor.execute("SELECT id, link, title_hash FROM recipes ORDER BY id")
+    seen_links, seen_hashes, duplicates = set(), set(), []
+    for recipe_id, link, hashed_title in cursor.fetchall():
+        if (link is not None and link in seen_links) or (hashed_title is not None and hashed_title in seen_hashes):
+            duplicates.append(recipe_id)
+            continue
+        seen_links.add(link)
+        seen_hashes.add(hashed_title)
+    if not duplicates:
+        return
+    if not delete_duplicates:
+        raise RuntimeError(f'{len(duplicates)} recipes duplicate the link or title of an older recipe, so the unique '
+                           f'keys on recipes cannot be added. Back up the database, then run the scraper once with '
+                           f'--delete-duplicate-recipes to delete them and their child rows.')
+    logging.warning('Deleting %s duplicate recipes and their child rows: ids %s', len(duplicates), duplicates)
+    for start in range(0, len(duplicates), MIGRATION_CHUNK):
+        chunk = duplicates[start:start + MIGRATION_CHUNK]
+        for table in RECIPE_CHILD_TABLES:
+            cursor.execute(f"DELETE FROM {table} WHERE recipe_id IN ({dd.in_placeholders(chunk)})", chunk)
+        cursor.execute(f"DELETE FROM recipes WHERE id IN ({dd.in_placeholders(chunk)})", chunk)
+
+
+def add_recipes_unique_keys(cursor, delete_duplicates=False):
+    """
+    Adds the title_hash column and the unique keys on recipes.link and recipes.title_hash to databases created
+    before they existed: the column is added and backfilled, duplicate recipes are deleted if delete_duplicates is
+    set (see delete_duplicate_recipes), then the keys are added.
+    :param cursor: Cursor object used to execute the query.
+    :param delete_duplicates: bool: delete duplicate recipes instead of failing
+    """
+    if index_exists(cursor, 'recipes', 'uq_recipes_link') and index_exists(cursor, 'recipes', 'uq_recipes_title_hash'):
+        return
+    if not column_exists(cursor, 'recipes', 'title_hash'):
+        cursor.execute("ALTER TABLE recipes ADD COLUMN title_hash BINARY(16) NULL AFTER title")
+    backfill_title_hashes(cursor)
+    delete_duplicate_recipes(cursor, delete_duplicates)
+    if not index_exists(cursor, 'recipes', 'uq_recipes_link'):
+        cursor.execute("ALTER TABLE recipes ADD UNIQUE KEY uq_recipes_link (link)")
+    if not index_exists(cursor, 'recipes', 'uq_recipes_title_hash'):
+        cursor.execute("ALTER TABLE recipes ADD UNIQUE KEY uq_recipes_title_hash (title_hash)")
+
+
+def add_categories_unique_key(cursor):
+    """
+    Adds the unique key on categories.category to databases created before it existed. Duplicate categories are
+    merged first: their categories_recipes rows are pointed at the lowest id of the category, and the other rows are
+    deleted.
+    :param cursor: Cursor object used to execute the query.
+    """
+    if index_exists(cursor, 'categories', 'uq_categories_category'):
+        return
+    cursor.execute("""
+        UPDATE categories_recipes cr
+        JOIN categories c ON c.id = cr.category_id
+        JOIN (SELECT category, MIN(id) AS keep_id FROM categories GROUP BY category) k ON k.category = c.category
+        SET cr.category_id = k.keep_id
+        WHERE cr.category_id <> k.keep_id""")
+    cursor.execute("""
+        DELETE c FROM categories c
+        JOIN (SELECT category, MIN(id) AS keep_id FROM categories GROUP BY category) k ON k.category = c.category
+        WHERE c.id <> k.keep_id""")
+    cursor.execute("ALTER TABLE categories ADD UNIQUE KEY uq_categories_category (category)")
+
+
+def add_ingredients_processed_index(cursor):
+    """
+    Adds the (processed, id) index that the chunked normalization pages through to databases created before it
+    existed.
+    :param cursor: Cursor object used to execute the query.
+    """
+    if not index_exists(cursor, 'ingredients', 'idx_ingredients_processed'):
+        cursor.execute("ALTER TABLE ingredients ADD INDEX idx_ingredients_processed (processed, id)")
+
+
+def migrate_database(cursor, delete_duplicates=False):
+    """
+    Brings the tables of an existing database up to the current schema.
+    :param cursor: Cursor object used to execute the query.
+    :param delete_duplicates: bool: delete duplicate recipes instead of failing, see delete_duplicate_recipes
+    """
+    add_recipes_unique_keys(cursor, delete_duplicates)
+    add_categories_unique_key(cursor)
+    add_ingredients_processed_index(cursor)
+
+
+def build_database(delete_duplicates=False):
     """
     Create tables for the recipes database.
+    :param delete_duplicates: bool: let the migration delete duplicate recipes, see delete_duplicate_recipes
     :return: None
     """
-    connection = sq.sql_connector("dar_maya")
-    cursor = connection.cursor()
+    with sq.pooled_connection("dar_maya") as connection:
+        cursor = connection.cursor()
 
-    cursor.execute('USE dar_maya')
+        cursor.execute('USE dar_maya')
 
-    create_recipes_table(cursor)
-    create_ingredients_table(cursor)
-    create_ingredients_clean_table(cursor)
-    create_recipe_details_table(cursor)
-    create_nutrition_facts_table(cursor)
-    create_categories_table(cursor)
-    create_instructions_table(cursor)
-    create_categories_recipes_table(cursor)
+        create_recipes_table(cursor)
+        create_ingredients_table(cursor)
+        create_ingredients_clean_table(cursor)
+        create_recipe_details_table(cursor)
+        create_nutrition_facts_table(cursor)
+        create_categories_table(cursor)
+        create_instructions_table(cursor)
+        create_categories_recipes_table(cursor)
+        create_ingredient_cache_table(cursor)
+        migrate_database(cursor, delete_duplicates)
 
-    # commit changes and close the connection
-    connection.commit()
-    cursor.close()
-    connection.close()
+        # commit changes and give the connection back to the pool
+        connection.commit()
+        cursor.close()
 
 
 def create_db_if_nonexist():
     """Create a new dar_maya database if it doesn't already exist.
     :return: None
     """
-    connection = sq.sql_connector_initial()
-    cursor = connection.cursor()
-    cursor.execute('CREATE DATABASE IF NOT EXISTS dar_maya')
-    cursor.execute('USE dar_maya')
-    # commit changes and close the connection
-    connection.commit()
-    connection.close()
+    with sq.pooled_connection(None) as connection:
+        cursor = connection.cursor()
+        cursor.execute('CREATE DATABASE IF NOT EXISTS dar_maya')
+        # commit changes and give the connection back to the pool
+        connection.commit()
+        cursor.close()
 
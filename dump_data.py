@@ -1,138 +1,356 @@
+import metrics as mt
 import sql_connection as sq
+import hashlib
 import logging
+import json
+import threading
+import time
 
+with open('constants.json') as f:
+    constants = json.load(f)
 
-def is_new_recipe(cursor, title):
+DETAILS_KEYS = ['Prep Time:', 'Cook Time:', 'Total Time:', 'Servings:']
+NUTRITION_KEYS = ['Calories', 'Fat', 'Carbs', 'Protein']
+
+
+def in_placeholders(values):
     """
-    This function checks if the recipe title already exists in the database or not. If the recipe title does not
-    exist yet in the database, function returns True. If the title already exists in the database, or this an error,
-    function returns False.
-    :param cursor: Cursor object used to execute the query.
-    :param title: recipe title, unique
-    :return: True or False
+    Builds the placeholder list for an IN (...) clause.
+    :param values: the values that will be bound to the placeholders
+    :return: str: e.g. '%s, %s, %s'
+    """
+    return ', '.join(['%s'] * len(values))
+
+
+def title_hash(title):
     """
-    check_sql = "SELECT COUNT(*) FROM recipes WHERE title = %s"
-    check_values = (title,)
-    try:
-        cursor.execute(check_sql, check_values)
-        result = cursor.fetchone()[0]
-        return result == 0
-    except Exception as ex:
-        logging.error(f'SQL Error: is_new_recipe function: {ex}')
-        return False
+    Hashes a recipe title for the unique key on recipes.title_hash. Titles are normalized first (case and runs of
+    whitespace are ignored), so 'Banana  Bread' and 'banana bread' are the same recipe.
+    :param title: str: the recipe title
+    :return: bytes: 16 byte digest, or None if there is no title
+    """
+    if title is None:
+        return None
+    return hashlib.md5(' '.join(title.lower().split()).encode('utf-8')).digest()
 
 
-def insert_recipe_data(cursor, scraped_data):
+def insert_recipe_data(cursor, recipes):
     """
-    Insert recipe data into the recipes table if the title does not already exist.
+    Insert the recipe rows of a batch into the recipes table, one upsert per row. Duplicates are skipped by the unique
+    keys on link and title_hash, whether the recipe is already in the database, earlier in the batch or was inserted
+    by a concurrent writer. A new row counts one affected row and its id is the row's lastrowid; on a duplicate,
+    ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id) leaves the row unchanged and counts none, the same upsert that
+    LookupCache.resolve uses.
     :param cursor: Cursor object used to execute the query.
-    :param scraped_data: A dictionary containing information about a recipe.
-    :return: True if the data is inserted, False if the title already exists.
+    :param recipes: list of scraped_data dictionaries, each with a link or a title (see RecipeWriter.add)
+    :return: list: (recipe id, scraped_data) tuples of the recipes that were inserted
     """
-    sql = "INSERT INTO recipes (id, link, title, num_reviews, rating, date_published) VALUES (NULL, %s, %s, %s, " \
-          "%s, %s) "
-    values = (
-        scraped_data.get('link'), scraped_data.get('title'), scraped_data.get('reviews'),
-        scraped_data.get('rating'),
-        scraped_data.get('published'))
-    try:
-        cursor.execute(sql, values)
-    except Exception as ex:
-        logging.error(f'SQL Error: insert_recipe_data function: {ex}')
+    sql = "INSERT INTO recipes (link, title, title_hash, num_reviews, rating, date_published) " \
+          "VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)"
+    inserted = []
+    for recipe in recipes:
+        if cursor.execute(sql, (recipe.get('link'), recipe.get('title'), title_hash(recipe.get('title')),
+                                recipe.get('reviews'), recipe.get('rating'), recipe.get('published'))) == 1:
+            inserted.append((cursor.lastrowid, recipe))
+    return inserted
 
 
-def insert_recipe_details(cursor, recipe_id, details):
+def insert_recipe_details(cursor, rows):
     """
     Insert recipe details into the recipe_details table.
     :param cursor: Cursor object used to execute the query.
-    :param recipe_id: The ID of the recipe.
-    :param details: A dictionary containing the recipe details.
+    :param rows: list of (recipe_id, details dictionary) tuples
     """
     sql = "INSERT INTO recipe_details (recipe_id, prep_time_mins, cook_time_mins, total_time_mins, servings) " \
           "VALUES (%s, %s, %s, %s, %s)"
-    values = (recipe_id, details.get('Prep Time:'), details.get('Cook Time:'), details.get('Total Time:'),
-              details.get('Servings:'))
-    try:
-        cursor.execute(sql, values)
-    except Exception as ex:
-        logging.error(f'SQL Error: insert_recipe_details function: {ex}')
+    values = [(recipe_id, details.get('Prep Time:'), details.get('Cook Time:'), details.get('Total Time:'),
+               details.get('Servings:')) for recipe_id, details in rows]
+    cursor.executemany(sql, values)
 
 
-def insert_nutrition_facts(cursor, recipe_id, nutrition):
+def insert_nutrition_facts(cursor, rows):
     """
     Insert nutrition facts into the nutrition_facts table.
     :param cursor: Cursor object used to execute the query.
-    :param recipe_id: The ID of the recipe.
-    :param nutrition: A dictionary containing the nutrition facts.
+    :param rows: list of (recipe_id, nutrition dictionary) tuples
     """
     sql = "INSERT IGNORE INTO nutrition_facts (recipe_id, calories, fat_g, carbs_g, protein_g) " \
           "VALUES (%s, %s, %s, %s, %s)"
-    values = (
-        recipe_id, nutrition.get('Calories'), nutrition.get('Fat'), nutrition.get('Carbs'), nutrition.get('Protein'))
-    try:
-        cursor.execute(sql, values)
-    except Exception as ex:
-        logging.error(f'SQL Error: insert_nutrition_facts function: {ex}')
+    values = [(recipe_id, nutrition.get('Calories'), nutrition.get('Fat'), nutrition.get('Carbs'),
+               nutrition.get('Protein')) for recipe_id, nutrition in rows]
+    cursor.executemany(sql, values)
 
 
-def insert_categories(cursor, recipe_id, categories):
+class LookupCache:
+    """
+    Write-through cache of a small lookup table that maps a unique value column to an auto-increment id, e.g.
+    categories. The table is preloaded once, so resolving a known value is a dict hit. Unknown values are upserted
+    with INSERT ... ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id), which returns the id whether this writer or a
+    concurrent one inserted the row. The value column must have a unique key.
     """
-    Insert categories into the categories table and the categories_recipes table.
+
+    def __init__(self, table, column):
+        """
+        :param table: str: name of the lookup table
+        :param column: str: name of the unique value column
+        """
+        self.table = table
+        self.column = column
+        self.ids = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def preload(self, cursor):
+        """
+        Loads the whole table into the cache, once.
+        :param cursor: Cursor object used to execute the query.
+        """
+        with self.lock:
+            if self.loaded:
+                return
+            cursor.execute(f"SELECT {self.column}, id FROM {self.table}")
+            self.ids.update(cursor.fetchall())
+            self.loaded = True
+
+    def resolve(self, cursor, values):
+        """
+        Returns the ids of the values, inserting the ones missing from the table. New ids are returned separately and
+        only enter the cache through remember, after the caller committed, so a rolled back insert is never cached.
+        :param cursor: Cursor object used to execute the query.
+        :param values: iterable of values
+        :return: tuple: dict value -> id for all values, dict value -> id for the values that were not cached
+        """
+        ids = {}
+        with self.lock:
+            for value in values:
+                if value in self.ids:
+                    ids[value] = self.ids[value]
+        new_ids = {}
+        sql = f"INSERT INTO {self.table} ({self.column}) VALUES (%s) ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)"
+        for value in values:
+            if value not in ids and value not in new_ids:
+                cursor.execute(sql, (value,))
+                new_ids[value] = cursor.lastrowid
+        ids.update(new_ids)
+        return ids, new_ids
+
+    def remember(self, new_ids):
+        """
+        Adds committed ids to the cache.
+        :param new_ids: dict value -> id, as returned by resolve
+        """
+        with self.lock:
+            self.ids.update(new_ids)
+
+
+CATEGORY_CACHE = LookupCache('categories', 'category')
+
+
+def insert_categories(cursor, rows, category_cache=CATEGORY_CACHE):
+    """
+    Insert categories into the categories table and the categories_recipes table. Category ids come from the
+    category cache, so only categories never seen before reach the categories table.
     :param cursor: Cursor object used to execute the query.
-    :param recipe_id: The ID of the recipe.
-    :param categories: A list of categories.
-    """
-    for category in categories:  # Check if category already exists in the categories table
-        sql = "SELECT id FROM categories WHERE category=%s"
-        cursor.execute(sql, (category,))
-        result = cursor.fetchone()
-
-        if not result:  # If category doesn't exist, insert it into the categories table
-            sql = "INSERT INTO categories (category) VALUES (%s)"
-            values = (category,)
-            cursor.execute(sql, values)
-            category_id = cursor.lastrowid
-        else:  # If category already exists, use its ID from the categories table
-            category_id = result[0]
-
-        sql = "INSERT INTO categories_recipes (category_id, recipe_id) VALUES (%s, %s)"
-        values = (category_id, recipe_id)
-        try:
-            cursor.execute(sql, values)
-        except Exception as ex:
-            logging.error(f'SQL Error: insert_categories function: {ex}')
+    :param rows: list of (recipe_id, list of categories) tuples
+    :param category_cache: LookupCache of the categories table
+    :return: dict: category -> id of the categories that were not cached yet
+    """
+    categories = list({category for _, recipe_categories in rows for category in recipe_categories})
+    category_ids, new_ids = category_cache.resolve(cursor, categories)
 
+    sql = "INSERT INTO categories_recipes (category_id, recipe_id) VALUES (%s, %s)"
+    values = [(category_ids[category], recipe_id) for recipe_id, recipe_categories in rows
+              for category in recipe_categories]
+    cursor.executemany(sql, values)
+    return new_ids
 
-def insert_ingredients(cursor, recipe_id, ingredients):
+
+def insert_ingredients(cursor, rows):
     """
     Insert ingredients into the ingredients table.
     :param cursor: Cursor object used to execute the query.
-    :param recipe_id: The ID of the recipe.
-    :param ingredients: A list of ingredients.
+    :param rows: list of (recipe_id, list of ingredients) tuples
     """
-    for ingredient in ingredients:
-        sql = "INSERT INTO ingredients (recipe_id, ingredient) VALUES (%s, %s)"
-        values = (recipe_id, ingredient)
-        try:
-            cursor.execute(sql, values)
-        except Exception as ex:
-            logging.error(f'SQL Error: insert_ingredients function: {ex}')
+    sql = "INSERT INTO ingredients (recipe_id, ingredient) VALUES (%s, %s)"
+    values = [(recipe_id, ingredient) for recipe_id, ingredients in rows for ingredient in ingredients]
+    cursor.executemany(sql, values)
 
 
-def insert_instructions(cursor, recipe_id, instructions):
+def insert_instructions(cursor, rows):
     """
     Insert instructions into the instructions table.
     :param cursor: Cursor object used to execute the query.
-    :param recipe_id: The ID of the recipe.
-    :param instructions: A dictionary containing the instructions.
+    :param rows: list of (recipe_id, instructions dictionary) tuples
+    """
+    sql = "INSERT INTO instructions (recipe_id, step, description) VALUES (%s, %s, %s)"
+    values = [(recipe_id, step, description) for recipe_id, instructions in rows
+              for step, description in instructions.items()]
+    cursor.executemany(sql, values)
+
+
+def write_batch(cursor, recipes, category_cache=CATEGORY_CACHE):
+    """
+    Writes a batch of recipes and all their child rows: one upsert per recipe row, then one multi-row INSERT per
+    child table.
+    :param cursor: Cursor object used to execute the query.
+    :param recipes: list of scraped_data dictionaries
+    :param category_cache: LookupCache of the categories table
+    :return: tuple: list of the recipes that were inserted, dict of the category ids that were not cached yet
+    """
+    with mt.timer('db_insert_seconds', table='recipes'):
+        with_ids = insert_recipe_data(cursor, recipes)
+    if not with_ids:
+        return [], {}
+
+    details = [(recipe_id, check_keys(recipe['details'], DETAILS_KEYS))
+               for recipe_id, recipe in with_ids if recipe.get('details')]
+    nutrition = [(recipe_id, check_keys(recipe['nutrition'], NUTRITION_KEYS))
+                 for recipe_id, recipe in with_ids if recipe.get('nutrition')]
+    categories = [(recipe_id, recipe['category']) for recipe_id, recipe in with_ids if recipe.get('category')]
+    ingredients = [(recipe_id, recipe['ingredients']) for recipe_id, recipe in with_ids if recipe.get('ingredients')]
+    instructions = [(recipe_id, recipe['instructions'])
+                    for recipe_id, recipe in with_ids if recipe.get('instructions')]
+    if details:
+        with mt.timer('db_insert_seconds', table='recipe_details'):
+            insert_recipe_details(cursor, details)
+    if nutrition:
+        with mt.timer('db_insert_seconds', table='nutrition_facts'):
+            insert_nutrition_facts(cursor, nutrition)
+    new_category_ids = {}
+    if categories:
+        with mt.timer('db_insert_seconds', table='categories'):
+            new_category_ids = insert_categories(cursor, categories, category_cache)
+    if ingredients:
+        with mt.timer('db_insert_seconds', table='ingredients'):
+            insert_ingredients(cursor, ingredients)
+    if instructions:
+        with mt.timer('db_insert_seconds', table='instructions'):
+            insert_instructions(cursor, instructions)
+    return [recipe for _, recipe in with_ids], new_category_ids
+
+
+class RecipeWriter:
+    """
+    Long-lived database writer. Scraped recipes are buffered and flushed in batches, each batch in a single
+    transaction, when batch_size recipes are waiting or flush_interval seconds passed since the last flush.
     """
-    for step, description in instructions.items():
-        sql = "INSERT INTO instructions (recipe_id, step, description) VALUES (%s, %s, %s)"
-        values = (recipe_id, step, description)
+
+    def __init__(self, batch_size=constants['WRITE_BATCH_SIZE'], flush_interval=constants['WRITE_FLUSH_SECS'],
+                 category_cache=CATEGORY_CACHE):
+        """
+        :param batch_size: number of buffered recipes that triggers a flush
+        :param flush_interval: number of seconds after which buffered recipes are flushed
+        :param category_cache: LookupCache of the categories table, shared by all writers by default
+        """
+        self.category_cache = category_cache
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_connection(self):
+        """
+        Returns the writer's connection, borrowing it from the shared pool on first use and preloading the category
+        cache with it. The pool pings it before handing it out, and it is pinged again (reconnecting if the server
+        dropped it) before later batches.
+        :return: A connection object.
+        """
+        if self.connection is None:
+            self.connection = sq.get_pool().acquire()
+            cursor = self.connection.cursor()
+            try:
+                self.category_cache.preload(cursor)
+                self.connection.commit()  # end the read snapshot, so the first batch sees current data
+            finally:
+                cursor.close()
+        else:
+            self.connection.ping(reconnect=True)
+        return self.connection
+
+    def add(self, scraped_data):
+        """
+        Buffers a scraped recipe and flushes the buffer if it is full or due. A recipe with neither a link nor a title
+        has no unique key to deduplicate it by, so it is rejected instead.
+        :param scraped_data: A dictionary containing information about a recipe.
+        :return: list: the rejected recipe, or the recipes a flush could not write, see flush()
+        """
+        if scraped_data.get('link') is None and scraped_data.get('title') is None:
+            mt.inc('db_rejected_recipes_total')
+            logging.error('SQL Error: a recipe with neither a link nor a title cannot be deduplicated, not writing it')
+            return [scraped_data]
+        self.buffer.append(scraped_data)
+        if len(self.buffer) >= self.batch_size:
+            return self.flush()
+        return self.flush_if_due()
+
+    def flush_if_due(self):
+        """
+        Flushes the buffer if flush_interval seconds passed since the last flush.
+        :return: list: the recipes the flush could not write, see flush()
+        """
+        if self.buffer and time.monotonic() - self.last_flush >= self.flush_interval:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        Writes the buffered recipes in one transaction. If the batch fails, it is rolled back and its recipes are
+        retried one transaction each, so a single bad recipe does not lose the whole batch.
+        :return: list: the recipes that could not be written
+        """
+        batch, self.buffer = self.buffer, []
+        self.last_flush = time.monotonic()
+        if not batch or self.commit_batch(batch):
+            return []
+        if len(batch) == 1:
+            return batch
+        return [recipe for recipe in batch if not self.commit_batch([recipe])]
+
+    def commit_batch(self, batch):
+        """
+        Writes and commits a batch of recipes, rolling back on error.
+        :param batch: list of scraped_data dictionaries
+        :return: True if the batch was committed, False otherwise
+        """
         try:
-            cursor.execute(sql, values)
+            connection = self.get_connection()
         except Exception as ex:
-            logging.error(f'SQL Error: insert_instructions function: {ex}')
+            mt.inc('db_batch_failures_total')
+            logging.error('SQL Error: no connection to write a batch of %s recipes: %s', len(batch), ex)
+            return False
+        cursor = connection.cursor()
+        try:
+            with mt.timer('db_batch_seconds'):
+                inserted, new_category_ids = write_batch(cursor, batch, self.category_cache)
+                connection.commit()
+        except Exception as ex:
+            connection.rollback()
+            mt.inc('db_batch_failures_total')
+            logging.error('SQL Error: could not write a batch of %s recipes: %s', len(batch), ex)
+            return False
+        finally:
+            cursor.close()
+        self.category_cache.remember(new_category_ids)
+        mt.inc('recipes_written_total', len(inserted))
+        for recipe in inserted:
+            logging.info('Recipe: %s was Inserted to the Recipes database.', recipe["title"])
+        return True
+
+    def close(self):
+        """
+        Flushes the remaining recipes and gives the connection back to the pool.
+        """
+        self.flush()
+        if self.connection is not None:
+            sq.get_pool().release(self.connection)
+            self.connection = None
 
 
 def write_to_database(scraped_data):
@@ -141,26 +359,8 @@ def write_to_database(scraped_data):
     :param scraped_data: A dictionary containing information about a recipe.
     :return: None
     """
-    connection = sq.sql_connector()
-    cursor = connection.cursor()
-
-    if is_new_recipe(cursor, scraped_data['title']):
-        insert_recipe_data(cursor, scraped_data)
-        recipe_id = cursor.lastrowid
-        if scraped_data['details']:
-            details = check_keys(scraped_data['details'], ['Prep Time:', 'Cook Time:', 'Total Time:', 'Servings:'])
-            insert_recipe_details(cursor, recipe_id, details)
-        if scraped_data['nutrition']:
-            nutrition = check_keys(scraped_data['nutrition'], ['Calories', 'Fat', 'Carbs', 'Protein'])
-            insert_nutrition_facts(cursor, recipe_id, nutrition)
-        if scraped_data['category']:
-            insert_categories(cursor, recipe_id, scraped_data['category'])
-        if scraped_data['ingredients']:
-            insert_ingredients(cursor, recipe_id, scraped_data['ingredients'])
-        if scraped_data['instructions']:
-            insert_instructions(cursor, recipe_id, scraped_data['instructions'])
-        connection.commit()
-    connection.close()
+    with RecipeWriter() as writer:
+        writer.add(scraped_data)
 
 
 def check_keys(dict_to_check, keys_to_check):
@@ -0,0 +1,206 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+PENDING = 'pending'
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+FAILED = 'failed'
+DEAD = 'dead'
+
+
+class Frontier:
+    """
+    Durable crawl frontier stored in a local SQLite file. Every recipe link found on the index pages is recorded with
+    its state (pending, in_flight, done, failed or dead), its number of failed attempts and timestamps, so a crawl
+    that crashed or was killed resumes where it stopped instead of starting over. Failed links are retried with
+    exponential backoff and parked in the dead state after max_attempts failures.
+    Links are marked done in memory and written at checkpoints; the caller completes a recipe link only once its
+    recipe was written. A link that was being processed when the crawl stopped is pending again on the next run.
+    """
+
+    def __init__(self, path=constants['FRONTIER_PATH'], max_attempts=constants['FRONTIER_MAX_ATTEMPTS'],
+                 checkpoint_interval=constants['FRONTIER_CHECKPOINT_SECS']):
+        """
+        Opens (and creates if needed) the frontier file and puts the links that were in flight when the previous
+        run stopped back in the pending state.
+        :param path: str: path of the SQLite frontier file
+        :param max_attempts: int: number of failed attempts after which a link is dead
+        :param checkpoint_interval: int: number of seconds between checkpoints
+        """
+        self.max_attempts = max_attempts
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.monotonic()
+        self.done = []
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS links (
+                url TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                added_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                last_error TEXT NULL
+            )""")
+        self.connection.execute('CREATE INDEX IF NOT EXISTS idx_state ON links (state, next_attempt)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.connection.execute('UPDATE links SET state = ? WHERE state = ?', (PENDING, IN_FLIGHT))
+
+    def is_seeded(self):
+        """
+        Checks if the links of all the index pages were already recorded by an earlier run.
+        :return: True or False
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'seeded'").fetchone()
+        return row is not None
+
+    def is_finished(self):
+        """
+        Checks if the recorded crawl is complete: seeded, and no link is left to process or retry.
+        :return: True or False
+        """
+        return self.is_seeded() and not any(self.counts().get(state) for state in [PENDING, IN_FLIGHT, FAILED])
+
+    def reset(self):
+        """
+        Forgets the recorded crawl, so the next run crawls the index pages again.
+        """
+        with self.lock:
+            self.done = []
+            self.connection.execute('DELETE FROM links')
+            self.connection.execute('DELETE FROM meta')
+
+    def seed(self, links):
+        """
+        Records the links of a new crawl and yields the ones that were not recorded yet, already claimed (in_flight).
+        Links recorded by an interrupted earlier seeding keep their state and are handed out by claim. The crawl is
+        marked as seeded once the links are exhausted.
+        :param links: iterable: urls, e.g. from scrape_links.get_all_links
+        :return: generator: urls
+        """
+        for link in links:
+            now = time.time()
+            with self.lock:
+                cursor = self.connection.execute(
+                    'INSERT OR IGNORE INTO links (url, state, added_at, updated_at) VALUES (?, ?, ?, ?)',
+                    (link, IN_FLIGHT, now, now))
+            if cursor.rowcount:
+                yield link
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('seeded', ?)", (str(time.time()),))
+
+    def claim(self, limit=constants['FRONTIER_CLAIM_BATCH']):
+        """
+        Moves up to limit links that are pending, or failed and due for a retry, to the in_flight state.
+        :param limit: int: maximum number of links to claim
+        :return: list: urls
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self.connection.execute(
+                    'SELECT url FROM links WHERE state = ? OR (state = ? AND next_attempt <= ?) LIMIT ?',
+                    (PENDING, FAILED, now, limit)).fetchall()
+                self.connection.executemany('UPDATE links SET state = ?, updated_at = ? WHERE url = ?',
+                                            [(IN_FLIGHT, now, url) for url, in rows])
+                self.connection.execute('COMMIT')
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+        return [url for url, in rows]
+
+    def stream(self, links=None):
+        """
+        Yields the links to process in this round: the new links of the crawl if links is given, then every link
+        that is pending or due for a retry, claimed in batches.
+        :param links: iterable of urls to seed the crawl with, or None to only resume the recorded links
+        :return: generator: urls
+        """
+        if links is not None:
+            yield from self.seed(links)
+        while True:
+            claimed = self.claim()
+            if not claimed:
+                return
+            yield from claimed
+
+    def complete(self, link):
+        """
+        Marks a link as done at the next checkpoint.
+        :param link: str: url
+        """
+        with self.lock:
+            self.done.append(link)
+
+    def fail(self, link, error, retry=True):
+        """
+        Records a failed attempt: the link is retried after an exponential backoff with full jitter, or parked in
+        the dead state once it failed max_attempts times.
+        :param link: str: url
+        :param error: the exception or message describing the failure
+        :param retry: False to park the link in the dead state right away, e.g. after a 404
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute('SELECT attempts FROM links WHERE url = ?', (link,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            state = DEAD if attempts >= self.max_attempts or not retry else FAILED
+            ceiling = min(constants['FRONTIER_BACKOFF_MAX'], constants['FRONTIER_BACKOFF_BASE'] * 2 ** (attempts - 1))
+            self.connection.execute(
+                'UPDATE links SET state = ?, attempts = ?, next_attempt = ?, updated_at = ?, last_error = ? '
+                'WHERE url = ?', (state, attempts, now + random.uniform(0, ceiling), now, str(error), link))
+
+    def checkpoint_due(self):
+        """
+        :return: True if checkpoint_interval seconds passed since the last checkpoint
+        """
+        return time.monotonic() - self.last_checkpoint >= self.checkpoint_interval
+
+    def checkpoint(self):
+        """
+        Writes the links completed since the last checkpoint in one transaction.
+        """
+        self.last_checkpoint = time.monotonic()
+        now = time.time()
+        with self.lock:
+            done, self.done = self.done, []
+            if not done:
+                return
+            self.connection.execute('BEGIN')
+            self.connection.executemany('UPDATE links SET state = ?, updated_at = ? WHERE url = ?',
+                                        [(DONE, now, url) for url in done])
+            self.connection.execute('COMMIT')
+
+    def next_retry_at(self):
+        """
+        :return: float: the time.time() at which the next failed link is due for a retry, None if there is none
+        """
+        with self.lock:
+            return self.connection.execute('SELECT MIN(next_attempt) FROM links WHERE state = ?',
+                                           (FAILED,)).fetchone()[0]
+
+    def counts(self):
+        """
+        :return: dict: state -> number of links
+        """
+        with self.lock:
+            return dict(self.connection.execute('SELECT state, COUNT(*) FROM links GROUP BY state').fetchall())
+
+    def close(self):
+        """
+        Takes a last checkpoint and closes the frontier file.
+        """
+        self.checkpoint()
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,187 @@
+"""
+This .py file keeps the raw html of every downloaded page in an append-only archive, so fixing a selector only means
+re-extracting the archived pages instead of downloading them again. Each page is stored as one record, compressed on
+its own (gzip, or zstd if the zstandard package is installed), in a single data file:
+    header (magic, codec, fetch time, url length, body length) | url | compressed body
+A separate SQLite index maps (url, fetch time) to the record offset. Reads go through an mmap of the data file, so
+a lookup is one index query and one slice, and scan() walks the records in file order without the index.
+"""
+import gzip
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+MAGIC = b'HAR1'
+HEADER = struct.Struct('<4sBdII')
+GZIP, ZSTD = 0, 1
+CODECS = {'gzip': GZIP, 'zstd': ZSTD}
+
+ArchivedPage = namedtuple('ArchivedPage', ['url', 'fetched_at', 'html'])
+
+
+def compress(body, codec):
+    """
+    :param body: bytes: the page
+    :param codec: int: GZIP or ZSTD
+    :return: bytes: compressed page
+    """
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=constants['ARCHIVE_ZSTD_LEVEL']).compress(body)
+    return gzip.compress(body, compresslevel=constants['ARCHIVE_GZIP_LEVEL'], mtime=0)
+
+
+def decompress(payload, codec):
+    """
+    :param payload: bytes: compressed page
+    :param codec: int: GZIP or ZSTD
+    :return: bytes: the page
+    :raise: ImportError: If the record is zstd compressed and zstandard is not installed.
+    """
+    if codec == ZSTD:
+        if zstandard is None:
+            raise ImportError('Reading zstd archive records needs the zstandard package')
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return gzip.decompress(payload)
+
+
+class HtmlArchive:
+    """
+    Append-only archive of fetched pages with an offset index. Safe to use from several threads. A record is written
+    to the data file before its index entry, and on open the data file is cut back to the end of the last indexed
+    record, so a crash never leaves a partial record behind.
+    """
+
+    def __init__(self, path=constants['ARCHIVE_PATH'], codec=constants['ARCHIVE_CODEC']):
+        """
+        Opens (and creates if needed) the data file and its index, path + '.index'.
+        :param path: str: path of the data file
+        :param codec: str: 'gzip' or 'zstd', falls back to gzip if zstandard is not installed
+        """
+        self.codec = CODECS[codec] if codec != 'zstd' or zstandard is not None else GZIP
+        self.lock = threading.Lock()
+        self.index = sqlite3.connect(path + '.index', check_same_thread=False, isolation_level=None)
+        self.index.execute('PRAGMA journal_mode=WAL')
+        self.index.execute('PRAGMA synchronous=NORMAL')
+        self.index.execute("""
+            CREATE TABLE IF NOT EXISTS records (
+                url TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                PRIMARY KEY (url, fetched_at)
+            )""")
+        end = self.index.execute('SELECT COALESCE(MAX(offset + length), 0) FROM records').fetchone()[0]
+        self.file = open(path, 'a+b')
+        if self.file.seek(0, os.SEEK_END) > end:
+            self.file.truncate(end)
+        self.map = None
+
+    def append(self, url, html, fetched_at=None):
+        """
+        Appends a page to the archive.
+        :param url: str: the page url
+        :param html: str: the raw page
+        :param fetched_at: float: fetch time (epoch seconds), now by default
+        """
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        url_bytes = url.encode('utf-8')
+        payload = compress(html.encode('utf-8'), self.codec)
+        record = HEADER.pack(MAGIC, self.codec, fetched_at, len(url_bytes), len(payload)) + url_bytes + payload
+        with self.lock:
+            offset = self.file.seek(0, os.SEEK_END)
+            self.file.write(record)
+            self.file.flush()
+            self.index.execute('INSERT OR REPLACE INTO records (url, fetched_at, offset, length) VALUES (?, ?, ?, ?)',
+                               (url, fetched_at, offset, len(record)))
+
+    def view(self, end):
+        """
+        Returns an mmap of the data file that covers the first end bytes, mapping the file again if it grew. An older
+        map is not closed here, since other threads may still read from it; it is unmapped once they drop it.
+        Must be called with the lock held.
+        :param end: int: offset the map must reach
+        :return: mmap object
+        """
+        if self.map is None or len(self.map) < end:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    def read_record(self, data, offset):
+        """
+        Decodes the record at offset.
+        :param data: mmap object of the data file
+        :param offset: int: record offset
+        :return: tuple: (ArchivedPage, offset of the next record)
+        """
+        magic, codec, fetched_at, url_length, body_length = HEADER.unpack_from(data, offset)
+        if magic != MAGIC:
+            raise ValueError(f'No archive record at offset {offset}')
+        start = offset + HEADER.size
+        url = data[start:start + url_length].decode('utf-8')
+        payload = data[start + url_length:start + url_length + body_length]
+        html = decompress(payload, codec).decode('utf-8')
+        return ArchivedPage(url, fetched_at, html), start + url_length + body_length
+
+    def get(self, url, fetched_before=None):
+        """
+        Reads the latest archived copy of a page.
+        :param url: str: the page url
+        :param fetched_before: float: only consider copies fetched before this time (epoch seconds)
+        :return: ArchivedPage or None if the page is not archived
+        """
+        with self.lock:
+            row = self.index.execute('SELECT offset, length FROM records WHERE url = ? AND fetched_at < ? '
+                                     'ORDER BY fetched_at DESC LIMIT 1',
+                                     (url, float('inf') if fetched_before is None else fetched_before)).fetchone()
+            if row is None:
+                return None
+            offset, length = row
+            data = self.view(offset + length)
+        return self.read_record(data, offset)[0]
+
+    def urls(self):
+        """
+        :return: list: every archived url, once
+        """
+        with self.lock:
+            return [url for url, in self.index.execute('SELECT DISTINCT url FROM records ORDER BY url')]
+
+    def scan(self):
+        """
+        Reads every record in file order.
+        :return: generator of ArchivedPage
+        """
+        with self.lock:
+            end = self.file.seek(0, os.SEEK_END)
+            if not end:
+                return
+            data = self.view(end)
+        offset = 0
+        while offset < end:
+            page, offset = self.read_record(data, offset)
+            yield page
+
+    def __len__(self):
+        with self.lock:
+            return self.index.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            self.file.close()
+            self.index.close()
@@ -0,0 +1,239 @@
+import requests
+import logging
+import json
+import random
+import threading
+import time
+import metrics as mt
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from html_archive import HtmlArchive
+from response_cache import ResponseCache
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+# urllib3 only decodes brotli responses when the brotli package is installed, so only advertise it then
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class NotRetryableError(requests.exceptions.HTTPError):
+    """
+    Raised by send() for an error status that is not worth retrying (e.g. 404), at any later time either. The status
+    is only kept in the message, so the error pickles to and from the parse worker processes.
+    """
+
+
+_thread_local = threading.local()
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+_cache_settings = {'enabled': constants['CACHE_ENABLED'], 'cache': None}
+_cache_lock = threading.Lock()
+_archive_settings = {'enabled': constants['ARCHIVE_ENABLED'], 'archive': None}
+
+
+def configure_cache(enabled):
+    """
+    Turns the on-disk response cache on or off, e.g. from the --no-cache command line argument.
+    :param enabled: bool: True to serve and store responses through the cache
+    """
+    _cache_settings['enabled'] = enabled
+
+
+def get_cache():
+    """
+    Returns the shared response cache, opening it on first use.
+    :return: ResponseCache object or None if caching is disabled
+    """
+    if not _cache_settings['enabled']:
+        return None
+    with _cache_lock:
+        if _cache_settings['cache'] is None:
+            _cache_settings['cache'] = ResponseCache(constants['CACHE_PATH'], constants['CACHE_MAX_BYTES'],
+                                                     constants['CACHE_MAX_AGE_SECS'])
+        return _cache_settings['cache']
+
+
+def configure_archive(enabled):
+    """
+    Turns the raw html archive on or off, e.g. from the --no-archive command line argument.
+    :param enabled: bool: True to archive every downloaded page
+    """
+    _archive_settings['enabled'] = enabled
+
+
+def get_archive():
+    """
+    Returns the shared html archive, opening it on first use.
+    :return: HtmlArchive object or None if archiving is disabled
+    """
+    if not _archive_settings['enabled']:
+        return None
+    with _cache_lock:
+        if _archive_settings['archive'] is None:
+            _archive_settings['archive'] = HtmlArchive(constants['ARCHIVE_PATH'], constants['ARCHIVE_CODEC'])
+        return _archive_settings['archive']
+
+
+def archive_page(link, html):
+    """
+    Adds a downloaded page to the html archive, if it is enabled.
+    :param link: str: the URL
+    :param html: str: the decoded response body
+    """
+    archive = get_archive()
+    if archive is not None:
+        archive.append(link, html)
+
+
+def get_session():
+    """
+    Returns the requests session of the calling thread, creating it on first use. Each thread keeps its own
+    session so connections are reused (keep-alive) without sharing a session object between threads.
+    :return: requests.Session object
+    """
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=constants['HTTP_POOL_CONNECTIONS'],
+                              pool_maxsize=constants['HTTP_POOL_MAXSIZE'])
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({'Accept-Encoding': ACCEPT_ENCODING})
+        _thread_local.session = session
+    return session
+
+
+def get_host_slot(host):
+    """
+    Returns the semaphore limiting the number of concurrent connections to a host. Limits are read from
+    HOST_CONNECTION_LIMITS in constants.json, other hosts get DEFAULT_HOST_CONNECTION_LIMIT.
+    :param host: str: the host name
+    :return: threading.BoundedSemaphore object
+    """
+    with _host_slots_lock:
+        if host not in _host_slots:
+            limit = constants['HOST_CONNECTION_LIMITS'].get(host, constants['DEFAULT_HOST_CONNECTION_LIMIT'])
+            _host_slots[host] = threading.BoundedSemaphore(limit)
+        return _host_slots[host]
+
+
+@contextmanager
+def host_slot(link):
+    """
+    Context manager that holds one of the connection slots of the link's host while a request is running.
+    :param link: str: the URL being requested
+    """
+    slot = get_host_slot(urlsplit(link).netloc)
+    with slot:
+        yield
+
+
+def backoff_delay(attempt, response=None):
+    """
+    Returns how long to sleep before the next retry, using exponential backoff with full jitter. A Retry-After
+    header sent with a 429 or 503 response is honoured if it asks for a longer wait.
+    :param attempt: int: the number of the attempt that just failed, starting at 0
+    :param response: requests.Response object of the failed attempt or None
+    :return: float: delay in seconds
+    """
+    ceiling = min(constants['HTTP_BACKOFF_MAX'], constants['HTTP_BACKOFF_BASE'] * 2 ** attempt)
+    delay = random.uniform(0, ceiling)
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(int(retry_after), constants['HTTP_BACKOFF_MAX']))
+    return delay
+
+
+def send(link, headers=None):
+    """
+    Sends a GET request through the calling thread's pooled session, retrying connection errors, timeouts and
+    5xx/429 responses with jittered exponential backoff.
+    :param link: str: the URL to fetch
+    :param headers: dict of extra request headers or None
+    :return: requests.Response object
+    :raise: requests.exceptions.RequestException: If the request still fails after all retries, NotRetryableError if
+    the server answers with a status that is not worth retrying (e.g. 404).
+    """
+    session = get_session()
+    timeout = (constants['HTTP_CONNECT_TIMEOUT'], constants['HTTP_READ_TIMEOUT'])
+    retries = constants['HTTP_RETRIES']
+    for attempt in range(retries + 1):
+        response = None
+        try:
+            with host_slot(link):
+                response = session.get(link, headers=headers, timeout=timeout)
+            if response.status_code in RETRY_STATUSES:
+                raise requests.exceptions.HTTPError(f'{response.status_code} status for {link}', response=response)
+            if response.status_code >= 400:
+                raise NotRetryableError(f'{response.status_code} status for {link}', response=response)
+            return response
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.HTTPError) as e:
+            retryable = response is None or response.status_code in RETRY_STATUSES
+            if not retryable or attempt == retries:
+                raise
+            delay = backoff_delay(attempt, response)
+            logging.warning('Retrying %s in %.1fs after attempt %s failed: %s', link, delay, attempt + 1, e)
+            time.sleep(delay)
+
+
+def conditional_headers(entry):
+    """
+    Builds the validator headers for revalidating a cached response.
+    :param entry: CachedResponse
+    :return: dict: If-None-Match / If-Modified-Since headers
+    """
+    headers = {}
+    if entry.etag:
+        headers['If-None-Match'] = entry.etag
+    if entry.last_modified:
+        headers['If-Modified-Since'] = entry.last_modified
+    return headers
+
+
+def fetch(link):
+    """
+    Fetches the text of the given URL through the shared HTTP client layer. Fresh cached responses are served from
+    disk, stale ones are revalidated with a conditional GET and served from disk on 304 Not Modified, or when the
+    revalidation fails on a network error or a retryable status. Every page that is actually downloaded is added to
+    the html archive.
+    :param link: str: the URL to fetch
+    :return: str: the decoded response body
+    :raise: requests.exceptions.RequestException: If the request fails after all retries and nothing is cached,
+    NotRetryableError if the server answered with a status that is not worth retrying (e.g. 404), cached or not.
+    """
+    cache = get_cache()
+    if cache is None:
+        text = send(link).text
+        archive_page(link, text)
+        return text
+    entry = cache.get(link)
+    if entry is not None and cache.is_fresh(entry):
+        mt.inc('http_cache_total', result='hit')
+        return entry.body
+    try:
+        response = send(link, headers=conditional_headers(entry) if entry is not None else None)
+    except NotRetryableError:
+        raise  # the page is gone, a stale copy would be scraped again on every run
+    except requests.exceptions.RequestException as e:
+        if entry is None:
+            raise
+        mt.inc('http_cache_total', result='stale')
+        logging.warning('Serving stale cached copy of %s after fetch error: %s', link, e)
+        return entry.body
+    if response.status_code == 304 and entry is not None:
+        mt.inc('http_cache_total', result='revalidated')
+        cache.touch(link)
+        return entry.body
+    mt.inc('http_cache_total', result='miss')
+    archive_page(link, response.text)
+    cache.put(link, response.text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    return response.text
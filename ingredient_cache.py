@@ -0,0 +1,109 @@
+"""
+This .py file memoizes the ChatGPT ingredient normalization. Results are stored in the ingredient_cache table under a
+key made of the model, the prompt version and the normalized ingredient text, so an ingredient line that was already
+normalized (in any recipe, in this or an earlier run) is never sent to the API again. Changing GPT_MODEL or the
+batch prompt changes the key, so stale results are not reused. An in-process LRU sits in front of the table.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+import dump_data as dd
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+LOOKUP_CHUNK = 1000
+PROMPT_VERSION = hashlib.md5(constants['BATCH_PROMPT'].encode('utf-8')).hexdigest()[:8]
+
+
+def normalize_text(ingredient):
+    """
+    Normalizes an ingredient line for the cache key: case and runs of whitespace are ignored.
+    :param ingredient: str: the raw ingredient line
+    :return: str: normalized text
+    """
+    return ' '.join(ingredient.lower().split())
+
+
+class IngredientCache:
+    """
+    Two-level cache of normalized ingredients: a thread-safe in-process LRU of up to max_entries results in front of
+    the persistent ingredient_cache table. Results are lists of (ingredient, quantity) tuples.
+    """
+
+    def __init__(self, model=constants['GPT_MODEL'], prompt_version=PROMPT_VERSION,
+                 max_entries=constants['INGREDIENT_LRU_SIZE']):
+        """
+        :param model: str: model name, part of the cache key
+        :param prompt_version: str: prompt version, part of the cache key
+        :param max_entries: int: capacity of the in-process LRU
+        """
+        self.model = model
+        self.prompt_version = prompt_version
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, ingredient):
+        """
+        :param ingredient: str: the raw ingredient line
+        :return: bytes: 16 byte cache key
+        """
+        text = f'{self.model}\n{self.prompt_version}\n{normalize_text(ingredient)}'
+        return hashlib.md5(text.encode('utf-8')).digest()
+
+    def remember(self, key, result):
+        """
+        Adds a result to the LRU, evicting the least recently used entries beyond max_entries. Must be called with
+        the lock held.
+        """
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get_many(self, cursor, keys):
+        """
+        Looks up cache keys in the LRU, then the missing ones in the ingredient_cache table, LOOKUP_CHUNK keys per
+        query.
+        :param cursor: Cursor object used to execute the query.
+        :param keys: list of cache keys
+        :return: dict: key -> list of (ingredient, quantity) tuples, for the keys that are cached
+        """
+        results = {}
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    results[key] = self.entries[key]
+        missing = [key for key in keys if key not in results]
+        for start in range(0, len(missing), LOOKUP_CHUNK):
+            chunk = missing[start:start + LOOKUP_CHUNK]
+            cursor.execute(f"SELECT cache_key, result FROM ingredient_cache "
+                           f"WHERE cache_key IN ({dd.in_placeholders(chunk)})", chunk)
+            stored = {key: [tuple(pair) for pair in json.loads(result)] for key, result in cursor.fetchall()}
+            with self.lock:
+                for key, result in stored.items():
+                    self.remember(key, result)
+            results.update(stored)
+        return results
+
+    def put_many(self, cursor, entries):
+        """
+        Stores new results in the ingredient_cache table (in the caller's transaction) and in the LRU.
+        :param cursor: Cursor object used to execute the query.
+        :param entries: dict: raw ingredient line -> list of (ingredient, quantity) tuples
+        """
+        if not entries:
+            return
+        values = [(self.key(ingredient), self.model, self.prompt_version, normalize_text(ingredient)[:500],
+                   json.dumps(result)) for ingredient, result in entries.items()]
+        cursor.executemany("INSERT IGNORE INTO ingredient_cache (cache_key, model, prompt_version, ingredient, result) "
+                           "VALUES (%s, %s, %s, %s, %s)", values)
+        with self.lock:
+            for (key, *_), result in zip(values, entries.values()):
+                self.remember(key, result)
+
+
+INGREDIENT_CACHE = IngredientCache()
@@ -0,0 +1,177 @@
+"""
+This .py file is a rule-based ingredient parser, the fast path of the ingredient normalization. It reads the leading
+quantity (integers, decimals, fractions, unicode vulgar fractions and ranges), the unit and the ingredient name of an
+ingredient line, and converts mass and volume units to grams, using a density table for volumes. Every result comes
+with a confidence; ChatGPT_API only sends the lines below INGREDIENT_PARSER_MIN_CONFIDENCE to the API.
+"""
+import json
+import re
+from collections import namedtuple
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+ParsedIngredient = namedtuple('ParsedIngredient', ['ingredient', 'quantity', 'confidence'])
+
+UNICODE_FRACTIONS = {'½': '1/2', '⅓': '1/3', '⅔': '2/3', '¼': '1/4', '¾': '3/4', '⅕': '1/5', '⅖': '2/5', '⅗': '3/5',
+                     '⅘': '4/5', '⅙': '1/6', '⅚': '5/6', '⅛': '1/8', '⅜': '3/8', '⅝': '5/8', '⅞': '7/8'}
+UNICODE_FRACTION_PATTERN = re.compile(r'(\d*)\s*([' + ''.join(UNICODE_FRACTIONS) + '])')
+NUMBER = r'(\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?)'
+QUANTITY_PATTERN = re.compile(rf'^{NUMBER}(?:\s*(?:-|–|to)\s*{NUMBER})?\s*')
+SIZE_PATTERN = re.compile(rf'^\(\s*{NUMBER}\s*(?:-\s*)?([a-z. ]+?)\s*\)\s*')
+WORD_PATTERN = re.compile(r"[a-z][a-z'\-]*")
+
+GRAMS_PER_UNIT = {'g': 1, 'gram': 1, 'grams': 1, 'kg': 1000, 'kilogram': 1000, 'kilograms': 1000,
+                  'oz': 28.35, 'ounce': 28.35, 'ounces': 28.35, 'lb': 453.59, 'lbs': 453.59, 'pound': 453.59,
+                  'pounds': 453.59}
+ML_PER_UNIT = {'cup': 236.59, 'cups': 236.59, 'tablespoon': 14.79, 'tablespoons': 14.79, 'tbsp': 14.79,
+               'tbs': 14.79, 'teaspoon': 4.93, 'teaspoons': 4.93, 'tsp': 4.93, 'pint': 473.18, 'pints': 473.18,
+               'quart': 946.35, 'quarts': 946.35, 'fluid ounce': 29.57, 'fluid ounces': 29.57, 'fl oz': 29.57,
+               'ml': 1, 'milliliter': 1, 'milliliters': 1, 'l': 1000, 'liter': 1000, 'liters': 1000}
+COUNT_UNITS = {'clove', 'cloves', 'slice', 'slices', 'can', 'cans', 'package', 'packages', 'piece', 'pieces',
+               'stalk', 'stalks', 'sprig', 'sprigs', 'head', 'heads', 'bunch', 'bunches', 'jar', 'jars', 'container',
+               'containers', 'envelope', 'envelopes', 'loaf', 'loaves', 'fillet', 'fillets', 'stick', 'sticks',
+               'bag', 'bags', 'box', 'boxes'}
+VAGUE_UNITS = {'pinch', 'pinches', 'dash', 'dashes', 'handful', 'handfuls', 'splash'}
+# grams per milliliter, matched against the whole ingredient name or its last words, the head noun (longest first)
+DENSITIES = {'all-purpose flour': 0.53, 'flour': 0.53, 'white sugar': 0.85, 'sugar': 0.85, 'brown sugar': 0.93,
+             "confectioners' sugar": 0.51, 'powdered sugar': 0.51, 'butter': 0.96, 'milk': 1.03, 'buttermilk': 1.03,
+             'cream': 1.01, 'sour cream': 1.02, 'yogurt': 1.03, 'water': 1.0, 'oil': 0.92, 'salt': 1.22,
+             'kosher salt': 0.6, 'baking soda': 0.97, 'baking powder': 0.81, 'honey': 1.42, 'maple syrup': 1.32,
+             'molasses': 1.4, 'vanilla extract': 0.88, 'cocoa powder': 0.42, 'oats': 0.38, 'rice': 0.78,
+             'chocolate chips': 0.72, 'cheese': 0.47, 'parmesan cheese': 0.42, 'walnuts': 0.5, 'pecans': 0.46,
+             'raisins': 0.68, 'cornstarch': 0.54, 'cinnamon': 0.53, 'ketchup': 1.15, 'mayonnaise': 0.95,
+             'tomato sauce': 1.03, 'broth': 1.0, 'stock': 1.0, 'wine': 0.99, 'vinegar': 1.01, 'juice': 1.03,
+             'peanut butter': 1.08, 'bread crumbs': 0.46, 'onion': 0.68, 'celery': 0.51, 'soy sauce': 1.15}
+DENSITY_NAMES = sorted(DENSITIES, key=len, reverse=True)
+# preparation words dropped from the name; words that name a different product ('hot' sauce, 'whole' milk, 'lean'
+# beef, 'dried' or 'crushed' tomatoes) stay in it
+DESCRIPTORS = {'chopped', 'diced', 'minced', 'sliced', 'shredded', 'grated', 'melted', 'softened', 'fresh',
+               'freshly', 'large', 'medium', 'small', 'finely', 'coarsely', 'thinly', 'packed', 'lightly', 'firmly',
+               'beaten', 'sifted', 'divided', 'cubed', 'peeled', 'cold', 'warm', 'uncooked', 'cooked', 'boneless',
+               'skinless', 'frozen', 'thawed', 'drained', 'rinsed', 'halved', 'quartered', 'extra-virgin', 'extra',
+               'virgin', 'optional', 'heaping', 'level', 'ripe', 'of'}
+TRAILING_PHRASES = re.compile(r'\b(?:to taste|or more|or as needed|as needed|for garnish|at room temperature)\b.*$')
+
+
+def parse_number(text):
+    """
+    Parses '2', '2.5', '1/2' or '1 1/2'.
+    :param text: str: the number
+    :return: float
+    """
+    whole, _, fraction = text.strip().rpartition(' ')
+    if '/' in fraction:
+        numerator, denominator = fraction.split('/')
+        value = int(numerator) / int(denominator) if int(denominator) else 0.0
+    else:
+        value = float(fraction)
+    return value + (float(whole) if whole else 0.0)
+
+
+def clean_name(text):
+    """
+    Reduces the rest of an ingredient line to the ingredient name: parentheses, everything after the first comma,
+    phrases such as 'to taste' and preparation words are removed.
+    :param text: str: the ingredient line without its quantity and unit
+    :return: str: ingredient name
+    """
+    text = re.sub(r'\(.*?\)', ' ', text).split(',')[0].split(';')[0]
+    text = TRAILING_PHRASES.sub('', text)
+    words = [word for word in WORD_PATTERN.findall(text) if word not in DESCRIPTORS]
+    return ' '.join(words)
+
+
+def read_unit(text):
+    """
+    Reads the unit at the start of a text.
+    :param text: str: the ingredient line after its quantity
+    :return: tuple: (unit or None, rest of the text)
+    """
+    for unit in ('fluid ounces', 'fluid ounce', 'fl oz', 'fl. oz.'):
+        if text.startswith(unit + ' '):
+            return 'fluid ounce', text[len(unit):].strip()
+    word, _, rest = text.partition(' ')
+    word = word.rstrip('.')
+    if word in GRAMS_PER_UNIT or word in ML_PER_UNIT or word in COUNT_UNITS or word in VAGUE_UNITS:
+        return word, rest.strip()
+    return None, text
+
+
+def density_of(name):
+    """
+    Looks up the density of the whole name, or of its head noun: 'olive oil' has the density of oil, but
+    'oil-packed sun-dried tomatoes' has none, since oil only describes the tomatoes.
+    :param name: str: ingredient name
+    :return: float: grams per milliliter, or None if the ingredient is not in the density table
+    """
+    for known in DENSITY_NAMES:
+        if name == known or name.endswith(' ' + known):
+            return DENSITIES[known]
+    return None
+
+
+def parse_ingredient(line):
+    """
+    Parses an ingredient line into the ingredient name and its quantity: grams for mass and volume units, a count
+    for unitless and count units ('2 eggs', '3 cloves garlic'), None if there is no quantity.
+    The confidence is 1.0 for mass units, 0.9 for volumes of ingredients in the density table, 0.8 for counts, and
+    lower for volumes without a known density, vague units (pinch, dash), lines without a quantity and lines that
+    name several ingredients; ranges ('2 to 3 cups') are read as their midpoint at a lower confidence.
+    :param line: str: the raw ingredient line
+    :return: ParsedIngredient
+    """
+    text = UNICODE_FRACTION_PATTERN.sub(lambda m: f'{m.group(1)} {UNICODE_FRACTIONS[m.group(2)]}'.strip(),
+                                        line.replace('⁄', '/'))
+    text = ' '.join(text.lower().split())
+    match = QUANTITY_PATTERN.match(text)
+    if match is None:
+        name = clean_name(text)
+        return ParsedIngredient(name or 'N/A', None, 0.6 if name else 0.0)
+    low, high = match.groups()
+    quantity = parse_number(low) if high is None else (parse_number(low) + parse_number(high)) / 2
+    confidence = 1.0 if high is None else 0.9
+    text = text[match.end():]
+
+    size = SIZE_PATTERN.match(text)
+    if size is not None:
+        size_unit, _ = read_unit(size.group(2).strip() + ' ')
+        if size_unit in GRAMS_PER_UNIT:
+            quantity *= parse_number(size.group(1)) * GRAMS_PER_UNIT[size_unit]
+            text = text[size.end():]
+            unit, text = read_unit(text)
+            name = clean_name(text)
+            return ParsedIngredient(name or 'N/A', round(quantity, 2), confidence * (1.0 if name else 0.0))
+        text = text[size.end():]
+
+    unit, text = read_unit(text)
+    name = clean_name(text)
+    if not name:
+        return ParsedIngredient('N/A', None, 0.0)
+    if ' and ' in name or ' or ' in name:
+        confidence *= 0.6
+    if unit in GRAMS_PER_UNIT:
+        return ParsedIngredient(name, round(quantity * GRAMS_PER_UNIT[unit], 2), confidence)
+    if unit in ML_PER_UNIT:
+        density = density_of(name)
+        if density is None:
+            return ParsedIngredient(name, round(quantity * ML_PER_UNIT[unit], 2), confidence * 0.5)
+        return ParsedIngredient(name, round(quantity * ML_PER_UNIT[unit] * density, 2), confidence * 0.9)
+    if unit in VAGUE_UNITS:
+        return ParsedIngredient(name, None, confidence * 0.5)
+    return ParsedIngredient(name, round(quantity, 2), confidence * 0.8)
+
+
+def parse_many(lines):
+    """
+    Parses a batch of ingredient lines, parsing each distinct line once.
+    :param lines: iterable of str
+    :return: list: ParsedIngredient for every line, in order
+    """
+    parsed = {}
+    results = []
+    for line in lines:
+        if line not in parsed:
+            parsed[line] = parse_ingredient(line)
+        results.append(parsed[line])
+    return results
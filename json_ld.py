@@ -0,0 +1,208 @@
+"""
+This .py file reads the schema.org Recipe object that allrecipes pages embed in a <script type="application/ld+json">
+block, straight from the raw html without building a DOM, and maps it to the same keys and value formats as the
+getters in All-recipe-web-scraper.py. The title is the one exception: it is read from the page's <title> tag like
+the DOM getter does, so both extraction modes give a recipe the same title and title hash.
+"""
+import re
+import html as html_entities
+import json
+import logging
+import datetime
+
+LD_JSON_PATTERN = re.compile(r'<script[^>]*type=["\']application/ld\+json["\'][^>]*>(.*?)</script>',
+                             re.IGNORECASE | re.DOTALL)
+ISO_DURATION_PATTERN = re.compile(r'P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+TITLE_PATTERN = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+DETAILS_KEYS = {'prepTime': 'Prep Time:', 'cookTime': 'Cook Time:', 'totalTime': 'Total Time:'}
+NUTRITION_KEYS = {'calories': 'Calories', 'fatContent': 'Fat', 'carbohydrateContent': 'Carbs',
+                  'proteinContent': 'Protein'}
+
+
+def find_json_ld_objects(html):
+    """
+    Finds every JSON-LD block in the page and flattens lists and @graph containers into a list of objects.
+    :param html: str: the raw page
+    :return: list: dicts
+    """
+    objects = []
+    for block in LD_JSON_PATTERN.findall(html):
+        try:
+            data = json.loads(block)
+        except ValueError as e:
+            logging.error('Error decoding JSON-LD block: %s', e)
+            continue
+        pending = data if isinstance(data, list) else [data]
+        while pending:
+            item = pending.pop(0)
+            if isinstance(item, list):
+                pending.extend(item)
+            elif isinstance(item, dict):
+                objects.append(item)
+                pending.extend(item.get('@graph', []))
+    return objects
+
+
+def has_type(item, type_name):
+    """
+    Checks the @type of a JSON-LD object, which can be a string or a list of strings.
+    :param item: dict: JSON-LD object
+    :param type_name: str: e.g. 'Recipe'
+    :return: True or False
+    """
+    item_type = item.get('@type')
+    return type_name == item_type or (isinstance(item_type, list) and type_name in item_type)
+
+
+def iso_duration_to_minutes(value):
+    """
+    Converts an ISO 8601 duration (e.g. 'PT1H30M') to minutes, like convert_to_minutes does for the page text.
+    :param value: str: the duration
+    :return: int: total minutes or None if the value is not a duration
+    """
+    match = ISO_DURATION_PATTERN.match(value or '')
+    if not match or not any(match.groups()):
+        return None
+    days, hours, minutes, _ = (int(group) if group else 0 for group in match.groups())
+    return days * constants['HOURS'] * constants['MINS'] + hours * constants['MINS'] + minutes
+
+
+def first_number(value):
+    """
+    Returns the first number in a value such as '11 g' or '350 kcal'.
+    :param value: str or number
+    :return: int or None
+    """
+    match = NUMBER_PATTERN.search(str(value))
+    return round(float(match.group())) if match else None
+
+
+def to_float(value):
+    """
+    Converts a rating value such as '4.6' or 4.6 to a float.
+    :param value: str or number
+    :return: float or None
+    """
+    match = NUMBER_PATTERN.search(str(value)) if value is not None else None
+    return float(match.group()) if match else None
+
+
+def map_details(recipe):
+    """
+    Maps the prep/cook/total times and the yield to the recipe details dictionary.
+    :param recipe: dict: the Recipe object
+    :return: dict: recipe_details or None
+    """
+    details = {}
+    for key, label in DETAILS_KEYS.items():
+        minutes = iso_duration_to_minutes(recipe.get(key))
+        if minutes is not None:
+            details[label] = minutes
+    recipe_yield = recipe.get('recipeYield')
+    yields = recipe_yield if isinstance(recipe_yield, list) else [recipe_yield]
+    for value in yields:
+        if str(value).isdigit():
+            details[constants['SERVINGS']] = int(value)
+            break
+    return details or None
+
+
+def map_nutrition(recipe):
+    """
+    Maps the NutritionInformation object to the nutrition facts dictionary.
+    :param recipe: dict: the Recipe object
+    :return: dict: nutrition facts or None
+    """
+    nutrition = recipe.get('nutrition') or {}
+    facts = {label: first_number(nutrition[key]) for key, label in NUTRITION_KEYS.items() if key in nutrition}
+    return {label: amount for label, amount in facts.items() if amount is not None} or None
+
+
+def map_instructions(recipe):
+    """
+    Flattens recipeInstructions (strings, HowToStep and HowToSection objects) into numbered steps.
+    :param recipe: dict: the Recipe object
+    :return: dict: recipe instructions with numbered keys or None
+    """
+    steps = []
+    pending = list(recipe.get('recipeInstructions') or [])
+    while pending:
+        step = pending.pop(0)
+        if isinstance(step, str):
+            steps.append(step.strip())
+        elif isinstance(step, dict) and has_type(step, 'HowToSection'):
+            pending[0:0] = step.get('itemListElement', [])
+        elif isinstance(step, dict) and step.get('text'):
+            steps.append(step['text'].strip())
+    return {idx + 1: text for idx, text in enumerate(steps)} or None
+
+
+def map_published(recipe):
+    """
+    Maps datePublished to a datetime at midnight, as get_date_published returns it.
+    :param recipe: dict: the Recipe object
+    :return: datetime object or None
+    """
+    try:
+        return datetime.datetime.strptime(recipe['datePublished'][:10], '%Y-%m-%d')
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def map_title(html):
+    """
+    Reads the text of the page's title tag, the title the DOM getter (get_title) returns, rather than the Recipe's
+    name, which can differ from it.
+    :param html: str: the raw page
+    :return: str: recipe title or None
+    """
+    match = TITLE_PATTERN.search(html)
+    return html_entities.unescape(match.group(1)) if match else None
+
+
+def map_categories(objects):
+    """
+    Reads the category names from the BreadcrumbList object.
+    :param objects: list: all JSON-LD objects of the page
+    :return: list: categories or None
+    """
+    for item in objects:
+        if has_type(item, 'BreadcrumbList'):
+            elements = sorted(item.get('itemListElement', []), key=lambda element: element.get('position', 0))
+            names = [(element.get('item') or {}).get('name') or element.get('name') for element in elements]
+            return [name.strip() for name in names if name] or None
+    return None
+
+
+def extract_recipe(html, link):
+    """
+    Maps the page's schema.org Recipe object to the scraped_data keys. Fields the structured data does not have are
+    left out, so the caller can fall back to the DOM getters for them.
+    :param html: str: the raw page
+    :param link: website link of the page
+    :return: dict: scraped fields, or None if the page has no Recipe object with ingredients
+    """
+    objects = find_json_ld_objects(html)
+    recipe = next((item for item in objects if has_type(item, 'Recipe')), None)
+    if recipe is None or not recipe.get('recipeIngredient'):
+        return None
+    rating = recipe.get('aggregateRating') or {}
+    review_count = str(rating.get('ratingCount', ''))
+    fields = {
+        'title': map_title(html),
+        'ingredients': [ingredient.strip() for ingredient in recipe['recipeIngredient']],
+        'details': map_details(recipe),
+        'reviews': ''.join(char for char in review_count if char.isnumeric()) or None,
+        'rating': to_float(rating.get('ratingValue')),
+        'nutrition': map_nutrition(recipe),
+        'published': map_published(recipe),
+        'category': map_categories(objects),
+        'link': str(link),
+        'instructions': map_instructions(recipe),
+    }
+    return {key: value for key, value in fields.items() if value is not None}
@@ -0,0 +1,215 @@
+"""
+This .py file builds the logging configuration used by command_line.logging_setter. In async mode (LOG_ASYNC) the
+scraping threads only put records on a queue; a QueueListener thread formats them and writes them to the log file
+and the terminal, so no page waits for a disk or terminal write. Records are formatted only when they are written,
+which is why the hot paths log with lazy %-style arguments instead of f-strings.
+The log file rotates at LOG_MAX_BYTES, and rotated files are gzip compressed. Repetitive messages below WARNING are
+sampled: each message template is written at most LOG_SAMPLE_BURST times per LOG_SAMPLE_WINDOW_SECS seconds, and
+the next record written reports how many were suppressed. With LOG_FORMAT 'json' every record is one JSON line.
+Worker processes (--parse-processes) send their records to the parent over a multiprocessing queue, see
+configure_worker.
+"""
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
+import datetime
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+import time
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    The plain text format, noting how many records of the same message were suppressed by sampling.
+    """
+
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            text += f' ({record.suppressed} similar messages suppressed)'
+        return text
+
+
+def gzip_rotator(source, dest):
+    """
+    Rotator of the log file handler: compresses the rotated file.
+    :param source: str: the file being rotated
+    :param dest: str: the rotated file name (ending with .gz, see gzip_namer)
+    """
+    with open(source, 'rb') as log_file, gzip.open(dest, 'wb') as compressed:
+        shutil.copyfileobj(log_file, compressed)
+    os.remove(source)
+
+
+def gzip_namer(name):
+    return name + '.gz'
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Rate limits repetitive records below WARNING, keyed by logger and message template (the unformatted msg, or the
+    template kept by WorkerQueueHandler), so every 'Not a recipe: %s' line counts as the same message. Warnings and
+    errors always pass.
+    """
+
+    def __init__(self, burst=constants['LOG_SAMPLE_BURST'], window=constants['LOG_SAMPLE_WINDOW_SECS']):
+        """
+        :param burst: int: records of a template written per window, 0 to disable sampling
+        :param window: float: window length in seconds
+        """
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.burst or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, getattr(record, 'template', record.msg))
+        now = time.monotonic()
+        with self.lock:
+            start, count, suppressed = self.windows.get(key, (now, 0, 0))
+            if now - start >= self.window:
+                start, count = now, 0
+            if count >= self.burst:
+                self.windows[key] = (start, count, suppressed + 1)
+                return False
+            self.windows[key] = (start, count + 1, 0)
+        record.suppressed = suppressed
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that puts the record on the queue as it is. The stock prepare() formats the message in the
+    logging thread, which is the work the queue is meant to move off the hot path; the listener formats it instead.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class WorkerQueueHandler(QueueHandler):
+    """
+    QueueHandler of the worker processes. The stock prepare() formats the message, so the record pickles whatever its
+    arguments are; the template is kept for the sampling in the parent process.
+    """
+
+    def prepare(self, record):
+        template = str(record.msg)
+        record = super().prepare(record)
+        record.template = template
+        return record
+
+
+class ForwardingHandler(logging.Handler):
+    """
+    Handler of the parent's worker log listener: hands each record to the parent's logger of the same name, so it
+    goes through the same sampling, queue and handlers as the parent's own records.
+    """
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def build_handlers(log_file, log_format):
+    """
+    :param log_file: str: path of the log file
+    :param log_format: str: 'text' or 'json'
+    :return: list: the rotating file handler and the terminal handler
+    """
+    formatter = JsonFormatter() if log_format == 'json' else TextFormatter(TEXT_FORMAT)
+    file_handler = RotatingFileHandler(log_file, maxBytes=constants['LOG_MAX_BYTES'],
+                                       backupCount=constants['LOG_BACKUP_COUNT'], encoding='utf-8', delay=True)
+    file_handler.rotator = gzip_rotator
+    file_handler.namer = gzip_namer
+    if os.path.exists(log_file) and os.path.getsize(log_file):
+        file_handler.doRollover()  # every run starts a new file, the previous one is kept compressed
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+    return [file_handler, stream_handler]
+
+
+def configure(log_file=constants['LOG_FILE'], log_format=constants['LOG_FORMAT'], asynchronous=constants['LOG_ASYNC'],
+              level=logging.INFO):
+    """
+    Configures the root logger: sampling, then (in async mode) the queue, then the file and terminal handlers.
+    :param log_file: str: path of the log file
+    :param log_format: str: 'text' or 'json'
+    :param asynchronous: bool: write the records from a QueueListener thread
+    :param level: the root logger level
+    :return: the started QueueListener, or None in synchronous mode
+    """
+    handlers = build_handlers(log_file, log_format)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(level)
+    listener = None
+    if asynchronous:
+        front = DeferredQueueHandler(queue.SimpleQueue())
+        listener = QueueListener(front.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)  # drains the queue before the process exits
+        handlers = [front]
+    for handler in handlers:
+        handler.addFilter(SamplingFilter())
+        root.addHandler(handler)
+    return listener
+
+
+def start_worker_listener():
+    """
+    Starts the thread that receives the records of the worker processes, see configure_worker.
+    :return: tuple: the multiprocessing queue to hand to the workers, the started QueueListener to stop() once the
+    workers exited
+    """
+    log_queue = multiprocessing.Queue()
+    listener = QueueListener(log_queue, ForwardingHandler())
+    listener.start()
+    return log_queue, listener
+
+
+def configure_worker(log_queue):
+    """
+    Configures the root logger of a worker process. Forked workers inherit the parent's handlers but not its
+    QueueListener thread, so their records would pile up unwritten in the inherited in-process queue; the inherited
+    handlers are replaced by one that sends the records to the parent's worker listener.
+    :param log_queue: the queue returned by start_worker_listener
+    """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(WorkerQueueHandler(log_queue))
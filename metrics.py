@@ -0,0 +1,298 @@
+"""
+This .py file is a small in-process metrics registry for the scraper: counters, histograms of durations and timers
+(a context manager and a decorator). Metrics are off by default, and every call then costs a single flag check;
+configure(True) turns them on. The registry is exposed as Prometheus text (and JSON) over HTTP with serve(), or
+written to a JSON file every METRICS_SNAPSHOT_SECS seconds with start_snapshots().
+Metrics are recorded per process: with --parse-processes, the parse and extractor timings of the worker processes are
+not included.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+PREFIX = 'allrecipes_'
+BUCKETS = constants['METRICS_BUCKETS']
+
+_settings = {'enabled': False}
+_counters = {}
+_histograms = {}
+_lock = threading.Lock()
+
+
+def configure(enabled):
+    """
+    Turns the recording of metrics on or off.
+    :param enabled: bool
+    """
+    _settings['enabled'] = enabled
+
+
+def is_enabled():
+    return _settings['enabled']
+
+
+def metric_key(name, labels):
+    """
+    :param name: str: metric name
+    :param labels: dict: label name -> value
+    :return: tuple: hashable key of the metric and its labels
+    """
+    return name, tuple(sorted(labels.items()))
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values (seconds) over the BUCKETS upper bounds, with their count and sum.
+    """
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Records a value. Must be called with the registry lock held.
+        :param value: float
+        """
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.bucket_counts[index] += 1
+
+
+def inc(name, value=1, **labels):
+    """
+    Adds to a counter.
+    :param name: str: counter name
+    :param value: number to add
+    :param labels: label name -> value, e.g. outcome='recipe'
+    """
+    if not _settings['enabled']:
+        return
+    key = metric_key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """
+    Records a value in a histogram.
+    :param name: str: histogram name
+    :param value: float: the value, in seconds for timings
+    :param labels: label name -> value, e.g. field='title'
+    """
+    if not _settings['enabled']:
+        return
+    key = metric_key(name, labels)
+    with _lock:
+        if key not in _histograms:
+            _histograms[key] = Histogram()
+        _histograms[key].observe(value)
+
+
+class Timer:
+    """
+    Context manager that records the duration of its block in a histogram.
+    """
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class NullTimer:
+    """
+    Timer used while metrics are off.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def timer(name, **labels):
+    """
+    Times a block: with metrics.timer('fetch_seconds'): ...
+    :param name: str: histogram name
+    :param labels: label name -> value
+    :return: Timer object, or a shared no-op timer while metrics are off
+    """
+    return Timer(name, labels) if _settings['enabled'] else NULL_TIMER
+
+
+def timed(name, **labels):
+    """
+    Decorator that records the duration of every call of the decorated function.
+    :param name: str: histogram name
+    :param labels: label name -> value
+    :return: decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _settings['enabled']:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def reset():
+    """
+    Clears all recorded metrics.
+    """
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def snapshot():
+    """
+    :return: dict: counters and histograms, keyed by the metric name followed by its labels in braces
+    """
+    with _lock:
+        counters = {format_key(key): value for key, value in _counters.items()}
+        histograms = {format_key(key): {'count': histogram.count, 'sum': histogram.sum,
+                                        'buckets': dict(zip(map(str, BUCKETS), histogram.bucket_counts))}
+                      for key, histogram in _histograms.items()}
+    return {'time': time.time(), 'counters': counters, 'histograms': histograms}
+
+
+def escape_label_value(value):
+    """
+    Escapes a label value as the Prometheus text format requires: backslash, double quote and line feed.
+    :param value: the label value
+    :return: str
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    """
+    :param labels: iterable of (label name, value) tuples
+    :return: str: Prometheus label set, e.g. {field="title"}, or '' without labels
+    """
+    labels = list(labels)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + '}'
+
+
+def format_key(key):
+    name, labels = key
+    return name + format_labels(labels)
+
+
+def prometheus_text():
+    """
+    Renders the registry in the Prometheus text exposition format.
+    :return: str
+    """
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items(), key=lambda item: item[0])
+        for (name, labels), value in counters:
+            lines.append(f'{PREFIX}{name}{format_labels(labels)} {value}')
+        for (name, labels), histogram in histograms:
+            for bound, count in zip(BUCKETS, histogram.bucket_counts):
+                lines.append(f'{PREFIX}{name}_bucket{format_labels(labels + (("le", bound),))} {count}')
+            lines.append(f'{PREFIX}{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+            lines.append(f'{PREFIX}{name}_sum{format_labels(labels)} {histogram.sum}')
+            lines.append(f'{PREFIX}{name}_count{format_labels(labels)} {histogram.count}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves /metrics (Prometheus text) and /metrics.json (snapshot()).
+    """
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            payload, content_type = prometheus_text().encode(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            payload, content_type = json.dumps(snapshot()).encode(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port):
+    """
+    Turns metrics on and serves them over HTTP from a daemon thread.
+    :param port: int: port to listen on, 0 for any free port
+    :return: ThreadingHTTPServer object, call shutdown() on it when done
+    """
+    configure(True)
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info('Serving metrics on http://127.0.0.1:%s/metrics', server.server_port)
+    return server
+
+
+def write_snapshot(path):
+    """
+    Writes snapshot() to a JSON file, replacing it atomically so readers never see a partial file.
+    :param path: str: file path
+    """
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as snapshot_file:
+        json.dump(snapshot(), snapshot_file, indent=4)
+    os.replace(temp_path, path)
+
+
+def start_snapshots(path, interval=constants['METRICS_SNAPSHOT_SECS']):
+    """
+    Turns metrics on and writes a snapshot to path every interval seconds from a daemon thread. Call
+    write_snapshot(path) once more at the end of the run for the final numbers.
+    :param path: str: file path
+    :param interval: float: seconds between snapshots
+    :return: threading.Event that stops the thread when set
+    """
+    configure(True)
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                write_snapshot(path)
+            except OSError as e:
+                logging.error('Could not write the metrics snapshot %s: %s', path, e)
+
+    threading.Thread(target=run, name='metrics-snapshots', daemon=True).start()
+    return stop
@@ -0,0 +1,134 @@
+"""
+This .py file runs the ingredient normalization as a background stage. A coordinator thread polls the ingredients
+table for rows that are not processed yet, so rows committed by the crawl are normalized while the crawl goes on,
+and a pool of worker threads sends the API batches of each chunk concurrently, within a shared rate limit. With a
+batch size of 1, every ingredient line left by the parser and the cache is sent on its own request instead.
+Run it directly to normalize the backlog of an existing database without crawling:
+python normalizer.py [--workers N] [--api-rate R] [--gpt-batch-size N]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import logging
+import threading
+import ChatGPT_API as gpt
+import command_line as ar
+import metrics as mt
+import sql_connection as sq
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+
+class Normalizer:
+    """
+    Background ingredient normalization. start() launches the coordinator thread, which keeps reading new
+    unprocessed rows (keyset pagination from the last id it saw) every poll_interval seconds. finish() tells it the
+    crawl is over: it makes a last pass over all unprocessed rows from the start, which also catches rows committed
+    out of id order, and the call returns when that pass is done. stop() ends it after the current chunk instead,
+    leaving the remaining rows for the next run.
+    """
+
+    def __init__(self, API, workers=constants['NORMALIZE_WORKERS'], rate=constants['NORMALIZE_RATE_LIMIT'],
+                 batch_size=constants['GPT_BATCH_SIZE'], poll_interval=constants['NORMALIZE_POLL_SECS']):
+        """
+        :param API: str: the OpenAI API key
+        :param workers: int: number of API requests sent concurrently
+        :param rate: float: maximum number of API requests per second, 0 for no limit
+        :param batch_size: int: maximum number of ingredients per API request
+        :param poll_interval: float: seconds between polls for new rows
+        """
+        self.API = API
+        self.workers = workers
+        self.rate = rate
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.finishing = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='normalizer', daemon=True)
+        self.normalized = 0
+
+    def start(self):
+        self.thread.start()
+
+    def finish(self):
+        """
+        Lets the coordinator make its last pass and waits for it.
+        """
+        self.finishing.set()
+        self.thread.join()
+        logging.info('Normalization finished: %s ingredient rows processed', self.normalized)
+
+    def stop(self):
+        """
+        Stops the coordinator once its current chunk is written, without the last pass, and waits for it.
+        """
+        self.stopping.set()
+        self.finishing.set()
+        self.thread.join()
+        logging.info('Normalization stopped: %s ingredient rows processed', self.normalized)
+
+    def normalize_chunk(self, connection, cursor, rows, executor):
+        """
+        Normalizes and writes one chunk of rows: the parser and the ingredient cache first, then API batches of
+        batch_size or, with a batch size of 1, one request per line (see gpt.normalize_rows).
+        :param connection: connects to sql
+        :param cursor: executes sql queries
+        :param rows: list of (ingredient, recipe_id, id) tuples
+        :param executor: the worker pool
+        :return: int: number of rows normalized
+        """
+        results, cache_entries = gpt.normalize_rows(cursor, rows, self.batch_size, executor=executor)
+        with mt.timer('ingredient_write_seconds'):
+            gpt.write_results(connection, cursor, rows, results, cache_entries)
+        return len(results)
+
+    def run(self):
+        """
+        The coordinator loop. Each chunk is normalized (API batches in the worker pool) and written in one transaction.
+        """
+        gpt.configure_api(self.API)
+        gpt.configure_rate_limit(self.rate)
+        last_id = 0
+        try:
+            with sq.pooled_connection(constants['DATABASE_NAME']) as connection, \
+                    ThreadPoolExecutor(max_workers=self.workers) as executor:
+                cursor = connection.cursor()
+                while not self.stopping.is_set():
+                    last_pass = self.finishing.is_set()
+                    if last_pass:
+                        last_id = 0
+                    connection.ping(reconnect=True)
+                    connection.commit()  # end the read snapshot, so rows committed since the last poll are visible
+                    for rows in gpt.iter_unprocessed(cursor, last_id=last_id):
+                        self.normalized += self.normalize_chunk(connection, cursor, rows, executor)
+                        last_id = rows[-1][2]
+                        if self.stopping.is_set():
+                            break
+                    if last_pass:
+                        break
+                    self.finishing.wait(self.poll_interval)
+                cursor.close()
+        except Exception as e:
+            logging.error('The normalization stage stopped: %s', e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Normalize the unprocessed ingredients of the recipes database')
+    parser.add_argument('--workers', type=ar.positive_int, default=constants['NORMALIZE_WORKERS'],
+                        help='Number of ChatGPT API requests sent concurrently')
+    parser.add_argument('--api-rate', type=ar.positive_float, default=constants['NORMALIZE_RATE_LIMIT'],
+                        help='Maximum number of ChatGPT API requests per second')
+    parser.add_argument('--gpt-batch-size', type=ar.positive_int, default=constants['GPT_BATCH_SIZE'],
+                        help='Number of ingredients normalized per ChatGPT API request')
+    args = parser.parse_args()
+    API = input("Please enter API key")
+    ar.logging_setter()
+    normalizer = Normalizer(API, workers=args.workers, rate=args.api_rate, batch_size=args.gpt_batch_size)
+    normalizer.start()
+    normalizer.finish()
+    sq.close_pools()
+
+
+if __name__ == '__main__':
+    main()
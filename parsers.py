@@ -0,0 +1,156 @@
+"""
+This .py file makes the html parser backend a configurable component. The BeautifulSoup backends (html.parser, lxml)
+return a regular soup. The selectolax backend parses with the lexbor C parser and wraps the tree in SelectolaxNode,
+which exposes the small part of the BeautifulSoup interface the scraping functions use, so every backend runs
+through the same extractors.
+"""
+from bs4 import BeautifulSoup
+import json
+import metrics as mt
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+BACKENDS = ['html.parser', 'lxml', 'selectolax']
+
+_settings = {'backend': constants['PARSER_BACKEND']}
+
+
+def configure_backend(backend):
+    """
+    Sets the parser backend used by make_document, e.g. from the --parser command line argument.
+    :param backend: str: one of BACKENDS
+    """
+    _settings['backend'] = backend
+
+
+def make_document(html, backend=None):
+    """
+    Parses a page with the configured (or the given) backend.
+    :param html: str: the raw page
+    :param backend: str: one of BACKENDS, None for the configured backend
+    :return: BeautifulSoup object or SelectolaxNode wrapping the document
+    :raise: ImportError: If the selectolax backend is chosen but selectolax is not installed.
+    """
+    backend = backend or _settings['backend']
+    with mt.timer('parse_seconds', backend=backend):
+        if backend == 'selectolax':
+            if LexborHTMLParser is None:
+                raise ImportError('The selectolax parser backend needs the selectolax package')
+            return SelectolaxNode(LexborHTMLParser(html).root, is_document=True)
+        return BeautifulSoup(html, features=backend)
+
+
+def matches_selector(tag, attribute, value):
+    """
+    Checks a tag against an attribute selector with the same rules as soup.find: a class value containing spaces
+    must equal the whole class attribute, a single class name only has to be one of the tag's classes.
+    :param tag: the element to check
+    :param attribute: 'class', 'id' (or another attribute name), None to match any tag
+    :param value: the expected attribute value
+    :return: True or False
+    """
+    if attribute is None:
+        return True
+    if attribute != 'class':
+        return tag.get(attribute) == value
+    classes = tag.get('class') or []
+    if ' ' in value:
+        return ' '.join(classes) == value
+    return value in classes
+
+
+def matches(tag, name, attrs, class_):
+    """
+    Checks a tag against find/find_all style arguments.
+    :param tag: the element to check
+    :param name: str: tag name or None
+    :param attrs: dict: attribute name -> expected value, or None
+    :param class_: str: expected class value or None
+    :return: True or False
+    """
+    if name is not None and tag.name != name:
+        return False
+    if class_ is not None and not matches_selector(tag, 'class', class_):
+        return False
+    return all(matches_selector(tag, attribute, value) for attribute, value in (attrs or {}).items())
+
+
+class SelectolaxNode:
+    """
+    Wraps a selectolax node with the subset of the BeautifulSoup Tag interface used by the scraping functions:
+    name, get, [], text, string, title, descendants, find, find_all, find_next_sibling and extract.
+    """
+
+    def __init__(self, node, is_document=False):
+        self.node = node
+        self.is_document = is_document
+
+    @property
+    def name(self):
+        return self.node.tag
+
+    def get(self, attribute, default=None):
+        value = self.node.attributes.get(attribute)
+        if value is None:
+            return default
+        return value.split() if attribute == 'class' else value
+
+    def __getitem__(self, attribute):
+        value = self.get(attribute)
+        if value is None:
+            raise KeyError(attribute)
+        return value
+
+    @property
+    def text(self):
+        return self.node.text(deep=True)
+
+    @property
+    def string(self):
+        return self.node.text(deep=True)
+
+    @property
+    def title(self):
+        return self.find('title')
+
+    @property
+    def descendants(self):
+        """
+        Yields the element nodes below this node in document order (the document root itself included, like the
+        html tag is among the descendants of a soup).
+        """
+        nodes = self.node.traverse()
+        if not self.is_document:
+            next(nodes)
+        for node in nodes:
+            if node.is_element_node:
+                yield SelectolaxNode(node)
+
+    def find_all(self, name=None, attrs=None, class_=None):
+        return [tag for tag in self.descendants if matches(tag, name, attrs, class_)]
+
+    def find(self, name=None, attrs=None, class_=None):
+        for tag in self.descendants:
+            if matches(tag, name, attrs, class_):
+                return tag
+        return None
+
+    def find_next_sibling(self, name=None, attrs=None, class_=None):
+        sibling = self.node.next
+        while sibling is not None:
+            if sibling.is_element_node:
+                tag = SelectolaxNode(sibling)
+                if matches(tag, name, attrs, class_):
+                    return tag
+            sibling = sibling.next
+        return None
+
+    def extract(self):
+        self.node.remove()
+        return self
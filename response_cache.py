@@ -0,0 +1,113 @@
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag', 'last_modified', 'fetched_at'])
+
+
+class ResponseCache:
+    """
+    Persistent, size-bounded HTTP response cache stored in a local SQLite file. Entries are keyed by URL and keep
+    the compressed body together with the ETag and Last-Modified validators, so stale entries can be revalidated
+    with a conditional GET. When the cache grows past max_bytes the least recently used entries are evicted.
+    """
+
+    def __init__(self, path, max_bytes, max_age):
+        """
+        Opens (and creates if needed) the cache file.
+        :param path: str: path of the SQLite cache file
+        :param max_bytes: int: maximum total size of the stored (compressed) bodies
+        :param max_age: int: number of seconds an entry is served without revalidation
+        """
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                etag TEXT NULL,
+                last_modified TEXT NULL,
+                fetched_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL
+            )""")
+        self.connection.execute('CREATE INDEX IF NOT EXISTS idx_last_access ON responses (last_access)')
+        self.total_size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, url):
+        """
+        Looks up a cached response and marks it as recently used.
+        :param url: str: the requested URL
+        :return: CachedResponse or None if the URL is not cached
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT body, etag, last_modified, fetched_at FROM responses WHERE url = ?',
+                                          (url,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE responses SET last_access = ? WHERE url = ?', (time.time(), url))
+        body, etag, last_modified, fetched_at = row
+        return CachedResponse(zlib.decompress(body).decode('utf-8'), etag, last_modified, fetched_at)
+
+    def is_fresh(self, entry):
+        """
+        Checks if a cached response is young enough to be served without revalidation.
+        :param entry: CachedResponse
+        :return: True or False
+        """
+        return time.time() - entry.fetched_at < self.max_age
+
+    def put(self, url, body, etag, last_modified):
+        """
+        Stores a response, replacing any previous entry for the URL, and evicts old entries if over the size bound.
+        :param url: str: the requested URL
+        :param body: str: the response body
+        :param etag: str or None: the ETag response header
+        :param last_modified: str or None: the Last-Modified response header
+        """
+        compressed = zlib.compress(body.encode('utf-8'))
+        now = time.time()
+        with self.lock:
+            previous = self.connection.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    (url, compressed, etag, last_modified, now, now, len(compressed)))
+            self.total_size += len(compressed) - (previous[0] if previous else 0)
+            self.evict()
+
+    def touch(self, url):
+        """
+        Marks a cached response as just revalidated (the server answered 304 Not Modified).
+        :param url: str: the requested URL
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute('UPDATE responses SET fetched_at = ?, last_access = ? WHERE url = ?',
+                                    (now, now, url))
+
+    def evict(self):
+        """
+        Deletes least recently used entries until the cache is within max_bytes. Must be called with the lock held.
+        """
+        while self.total_size > self.max_bytes:
+            rows = self.connection.execute('SELECT url, size FROM responses ORDER BY last_access LIMIT 100').fetchall()
+            if not rows:
+                self.total_size = 0
+                return
+            for url, size in rows:
+                self.connection.execute('DELETE FROM responses WHERE url = ?', (url,))
+                self.total_size -= size
+                if self.total_size <= self.max_bytes:
+                    break
+
+    def close(self):
+        """
+        Closes the cache file.
+        """
+        with self.lock:
+            self.connection.close()
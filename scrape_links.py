@@ -1,8 +1,13 @@
 import requests
 import logging
 import json
-from bs4 import BeautifulSoup
 import random
+from concurrent.futures import ThreadPoolExecutor
+import concurrency as cc
+import http_client as http
+import metrics as mt
+import parsers as ps
+import url_filter as uf
 
 
 with open('constants.json') as f:
@@ -17,10 +22,19 @@ def get_index_links(main_index_link):
     """
     response = check_request_exception(main_index_link, get_index_links)
     if response:
-        soup = BeautifulSoup(response, features="html.parser")
-        a_tags = soup.find_all('a', class_=constants['INDEX_LINK_CLASS'])
-        index_links = [a_tag['href'] for a_tag in a_tags]
-        return index_links
+        return parse_index_links(response)
+
+
+def parse_index_links(response):
+    """
+    Pulls the highest level urls out of the html of the index page.
+    :param: str: html
+    :return: list: urls
+    """
+    soup = ps.make_document(response)
+    a_tags = soup.find_all('a', class_=constants['INDEX_LINK_CLASS'])
+    index_links = [a_tag['href'] for a_tag in a_tags]
+    return index_links
 
 
 def get_recipe_links(index_link):
@@ -31,43 +45,105 @@ def get_recipe_links(index_link):
     """
     response = check_request_exception(index_link, get_recipe_links)
     if response:
-        soup = BeautifulSoup(response, features="html.parser")
-        top_link_tags = soup.find_all('a', {
-            'class': constants['TOP_LINK_CLASS']})
-        top_links = [attr['href'] for attr in top_link_tags]
-        bottom_link_tags = soup.find_all('a', class_=constants['BOTTOM_LINK_CLASS'])
-        bottom_links = [attr['href'] for attr in bottom_link_tags]
-        recipe_links = top_links + bottom_links
-        return recipe_links
+        return parse_recipe_links(response)
+
+
+def parse_recipe_links(response):
+    """
+    Scrapes all the recipe urls out of the html of an index link page.
+    :param: str: html
+    :return: list: urls
+    """
+    soup = ps.make_document(response)
+    top_link_tags = soup.find_all('a', {
+        'class': constants['TOP_LINK_CLASS']})
+    top_links = [attr['href'] for attr in top_link_tags]
+    bottom_link_tags = soup.find_all('a', class_=constants['BOTTOM_LINK_CLASS'])
+    bottom_links = [attr['href'] for attr in bottom_link_tags]
+    recipe_links = top_links + bottom_links
+    return recipe_links
 
 
-def get_all_links(index_links):
+def stream_recipe_links(index_links, workers, capacity=constants['LINK_FILTER_CAPACITY']):
+    """
+    Fetches the index pages in parallel and yields every recipe url the first time it is seen. Index pages are only
+    fetched as the consumer asks for more links, so at most a bounded number of pages are held in memory. The links
+    already yielded are remembered in a fixed-size Bloom filter, so memory does not grow with the number of links;
+    a false positive drops a new link from this crawl, at BLOOM_FP_RATE up to capacity links and more often beyond.
+    :param: list: index links
+    :param: int: number of index pages fetched concurrently
+    :param: int: number of links the Bloom filter is sized for
+    :return: generator: urls
+    """
+    seen = uf.BloomFilter(capacity)
+    max_in_flight = workers * constants['IN_FLIGHT_PER_WORKER']
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for index_link, future in cc.bounded_imap_unordered(executor, get_recipe_links, index_links, max_in_flight):
+            try:
+                recipe_links = future.result() or []
+            except Exception as e:
+                logging.error('Error getting links from: %s: %s', index_link, e)
+                continue
+            logging.info('Links from: %s  retrieved', index_link)
+            for link in recipe_links:
+                if link not in seen:
+                    seen.add(link)
+                    yield link
+
+
+def reservoir_sample(links, sample_size):
+    """
+    Picks a uniform random sample of sample_size links from a stream of links without materializing the stream.
+    :param: iterable: urls
+    :param: int: number of links to keep
+    :return: list: urls in random order
+    """
+    sample = []
+    for seen_count, link in enumerate(links):
+        if seen_count < sample_size:
+            sample.append(link)
+        else:
+            replace_index = random.randint(0, seen_count)
+            if replace_index < sample_size:
+                sample[replace_index] = link
+    random.shuffle(sample)
+    return sample
+
+
+def get_all_links(index_links, workers=constants['WORKERS'], sample_size=None, known_links=None):
     """
     Receives a list of the urls from the index page and calls the get_recipe function on each of them
-    to scrape the recipe urls from all pages. Returns a list of all recipe links.
+    to scrape the recipe urls from all pages. Returns a generator that yields deduplicated recipe links as soon as
+    their index page is downloaded. If sample_size is given, returns a random sample of that many links instead.
+    Links found in known_links are dropped before sampling, so they are never fetched.
     :param: list: index links
-    :return: list: urls
+    :param: int: number of index pages fetched concurrently
+    :param: int or None: size of the random sample, None to stream every link
+    :param: BloomFilter or None: links already stored in the database, None to keep every link
+    :return: generator or list: urls
     """
-    links = []
-    for link in index_links:
-        links.extend(get_recipe_links(link))
-        logging.info(f'Links from: {link}  retrieved')
-    all_links = list(set(links))
-    # API key will limit access to links, shuffle to get a random sample
-    random.shuffle(all_links)
-    return all_links
+    links = stream_recipe_links(index_links, workers)
+    if known_links is not None:
+        links = uf.drop_known_links(links, known_links)
+    if sample_size is None:
+        return links
+    # API key will limit access to links, sample to get a random subset
+    return reservoir_sample(links, sample_size)
 
 
 def check_request_exception(link, func_name):
     """
-    Fetches the content of the given URL and handles exceptions using the given error message.
+    Fetches the content of the given URL through the pooled HTTP client, which retries transient errors, and handles
+    exceptions using the given error message.
     :param: str: the URL to fetch
     :param: str: the error message to log in case of an exception
     :return: str or False, the response text if the request is successful, False if an exception occurs
     """
     response_get = False
     try:
-        response_get = requests.get(link).text
+        with mt.timer('fetch_seconds'):
+            response_get = http.fetch(link)
     except requests.exceptions.RequestException as e:
-        logging.error(f"Problem getting link {link} in {func_name.__name__}. Error: {e}")
+        mt.inc('fetch_errors_total')
+        logging.error("Problem getting link %s in %s. Error: %s", link, func_name.__name__, e)
     return response_get
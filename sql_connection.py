@@ -1,6 +1,12 @@
 import pymysql
 import logging
 import json
+import collections
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from pymysql.constants import SERVER_STATUS
 
 with open('constants.json') as f:
     constants = json.load(f)
@@ -19,14 +25,15 @@ def sql_connector_initial():
         )
         return connection
     except Exception as ex:
-        logging.error(f'SQL Error: could not establish a connection to SQL: {ex}')
+        logging.error('SQL Error: could not establish a connection to SQL: %s', ex)
         raise
 
 
-def sql_connector(database=constants["DATABASE_NAME"]):
+def sql_connector(database=constants["DATABASE_NAME"], local_infile=False):
     """
     Connect to the MySQL database.
     :param database: The name of the database to connect to.
+    :param local_infile: Allow LOAD DATA LOCAL INFILE on this connection (see bulk_load.py).
     :return: A connection object.
     """
     try:
@@ -34,9 +41,197 @@ def sql_connector(database=constants["DATABASE_NAME"]):
             host=constants['HOST'],
             user=constants['USER'],
             password=constants['SQL PASSWORD'],
-            database=database
+            database=database,
+            local_infile=local_infile
         )
         return connection
     except Exception as ex:
-        logging.error(f'SQL Error: could not establish a connection to SQL: {ex}')
+        logging.error('SQL Error: could not establish a connection to SQL: %s', ex)
         raise
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of database connections. min_size connections are opened when the pool is built. Connections are
+    handed out most recently used first so the warm ones get reused, are pinged (and reconnected if the server
+    dropped them) when they sat idle for a while, and idle connections beyond min_size are closed after idle_timeout
+    seconds.
+    """
+
+    def __init__(self, connect, min_size, max_size, idle_timeout, ping_after):
+        """
+        :param connect: callable that opens a new connection
+        :param min_size: number of connections opened up front and kept open even when idle
+        :param max_size: maximum number of open connections, borrowers wait when all are in use
+        :param idle_timeout: seconds after which surplus idle connections are closed
+        :param ping_after: seconds of idleness after which a connection is pinged before it is handed out
+        """
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self.idle = collections.deque()
+        self.size = 0
+        self.condition = threading.Condition()
+        try:
+            for _ in range(min_size):
+                self.idle.append((connect(), time.monotonic()))
+                self.size += 1
+        except Exception:
+            self.close_all()
+            raise
+
+    def acquire(self, timeout=constants['POOL_ACQUIRE_TIMEOUT_SECS']):
+        """
+        Borrows a connection from the pool, opening a new one if none is idle and the pool is not full.
+        :param timeout: seconds to wait in total for a connection when the pool is exhausted
+        :return: A connection object.
+        :raise: TimeoutError: If no connection became available in time.
+        """
+        with self.condition:
+            self.close_expired()
+            # wait_for keeps one deadline across wakeups that found the connection already taken
+            if not self.condition.wait_for(lambda: self.idle or self.size < self.max_size, timeout):
+                raise TimeoutError('SQL Error: timed out waiting for a pooled connection')
+            if self.idle:
+                connection, idle_since = self.idle.pop()
+            else:
+                connection, idle_since = None, None
+                self.size += 1
+        if connection is None:
+            return self.open_connection()
+        if time.monotonic() - idle_since >= self.ping_after:
+            try:
+                connection.ping(reconnect=True)
+            except Exception as ex:
+                logging.error('SQL Error: pooled connection failed its health check: %s', ex)
+                self.discard(connection)
+                with self.condition:
+                    self.size += 1
+                return self.open_connection()
+        return connection
+
+    def open_connection(self):
+        """
+        Opens a new connection for a slot already counted in self.size, giving the slot back if that fails.
+        :return: A connection object.
+        """
+        try:
+            return self.connect()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, connection):
+        """
+        Returns a borrowed connection to the pool, rolling back a transaction the borrower left open.
+        :param connection: A connection object from acquire().
+        """
+        try:
+            if connection.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                connection.rollback()
+        except Exception as ex:
+            logging.error('SQL Error: dropping pooled connection that could not be reset: %s', ex)
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        """
+        Closes a borrowed connection that should not go back to the pool.
+        :param connection: A connection object from acquire().
+        """
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def close_expired(self):
+        """
+        Closes the idle connections above min_size that were idle for longer than idle_timeout. Must be called with
+        the condition held. The least recently used connections are at the left end of the deque.
+        """
+        now = time.monotonic()
+        while self.size > self.min_size and self.idle and now - self.idle[0][1] >= self.idle_timeout:
+            connection, _ = self.idle.popleft()
+            self.size -= 1
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that borrows a connection and gives it back when the block ends.
+        """
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close_all(self):
+        """
+        Closes every idle connection of the pool.
+        """
+        with self.condition:
+            while self.idle:
+                connection, _ = self.idle.pop()
+                self.size -= 1
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database=constants["DATABASE_NAME"], local_infile=False):
+    """
+    Returns the shared connection pool of a database, creating it on first use. Connections that allow LOAD DATA
+    LOCAL INFILE have a pool of their own, so the other pools never hand one out.
+    :param database: The name of the database, None for server-level connections without a default database.
+    :param local_infile: Pool of connections that allow LOAD DATA LOCAL INFILE (see bulk_load.py).
+    :return: ConnectionPool object
+    """
+    with _pools_lock:
+        if (database, local_infile) not in _pools:
+            if database is None:
+                connect = sql_connector_initial
+            else:
+                connect = functools.partial(sql_connector, database, local_infile=local_infile)
+            _pools[database, local_infile] = ConnectionPool(connect, constants['POOL_MIN_SIZE'],
+                                                            constants['POOL_MAX_SIZE'],
+                                                            constants['POOL_IDLE_TIMEOUT_SECS'],
+                                                            constants['POOL_PING_AFTER_SECS'])
+        return _pools[database, local_infile]
+
+
+def pooled_connection(database=constants["DATABASE_NAME"], local_infile=False):
+    """
+    Borrows a connection from the shared pool of a database, for use in a with statement.
+    :param database: The name of the database, None for server-level connections without a default database.
+    :param local_infile: Borrow a connection that allows LOAD DATA LOCAL INFILE.
+    :return: context manager yielding a connection object
+    """
+    return get_pool(database, local_infile).connection()
+
+
+def close_pools():
+    """
+    Closes the idle connections of every pool, at the end of the program.
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
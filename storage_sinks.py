@@ -0,0 +1,411 @@
+"""
+This .py file makes the storage of the scraped recipes a configurable component (--sink). Every sink buffers recipes
+and writes them in batches, with the interface of dump_data.RecipeWriter, which is the MySQL sink:
+- mysql: the MySQL database of database_creation, through dump_data.RecipeWriter.
+- sqlite: a local SQLite file (WAL mode) with the same tables, one transaction per batch.
+- jsonl: one JSON object per recipe, appended to a local file.
+- parquet: a columnar Parquet file per run, one row group per batch. Needs the pyarrow package.
+- tsv: per-table staging files for the MySQL bulk loader (see bulk_load.py), with recipe ids assigned client-side.
+The local sinks need no database server, so a crawl runs at full speed offline and is loaded into MySQL later.
+"""
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import time
+import dump_data as dd
+import metrics as mt
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+SINKS = ['mysql', 'sqlite', 'jsonl', 'parquet', 'tsv']
+
+SQLITE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS recipes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        link TEXT UNIQUE,
+        title TEXT,
+        title_hash BLOB UNIQUE,
+        num_reviews INTEGER NULL,
+        rating REAL NULL,
+        date_published TEXT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS ingredients (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        recipe_id INTEGER REFERENCES recipes(id),
+        ingredient TEXT,
+        processed INTEGER DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS recipe_details (
+        recipe_id INTEGER PRIMARY KEY REFERENCES recipes(id),
+        prep_time_mins INTEGER NULL,
+        cook_time_mins INTEGER NULL,
+        total_time_mins INTEGER NULL,
+        servings INTEGER NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS nutrition_facts (
+        recipe_id INTEGER PRIMARY KEY REFERENCES recipes(id),
+        calories INTEGER NULL,
+        fat_g INTEGER NULL,
+        carbs_g INTEGER NULL,
+        protein_g INTEGER NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS categories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        category TEXT UNIQUE
+    )""",
+    """CREATE TABLE IF NOT EXISTS instructions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        recipe_id INTEGER REFERENCES recipes(id),
+        step INTEGER NULL,
+        description TEXT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS categories_recipes (
+        category_id INTEGER REFERENCES categories(id),
+        recipe_id INTEGER REFERENCES recipes(id)
+    )""",
+]
+
+
+# staging file -> columns, in file order; see bulk_load.py for how each file is loaded
+STAGING_FILES = {
+    'recipes': ['id', 'link', 'title', 'title_hash', 'num_reviews', 'rating', 'date_published'],
+    'recipe_details': ['recipe_id', 'prep_time_mins', 'cook_time_mins', 'total_time_mins', 'servings'],
+    'nutrition_facts': ['recipe_id', 'calories', 'fat_g', 'carbs_g', 'protein_g'],
+    'ingredients': ['recipe_id', 'ingredient'],
+    'instructions': ['recipe_id', 'step', 'description'],
+    'categories_recipes': ['category', 'recipe_id'],
+}
+TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+
+def to_int(value):
+    """
+    :param value: a scraped number, possibly as text (e.g. the number of reviews)
+    :return: int or None if the value is missing or not a number
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_text(value):
+    """
+    :param value: a scraped value, e.g. the publish datetime
+    :return: the value, with datetimes as 'YYYY-MM-DD HH:MM:SS' text
+    """
+    return value.isoformat(sep=' ') if isinstance(value, datetime.datetime) else value
+
+
+class BufferedSink:
+    """
+    Base of the local sinks: recipes are buffered and written by write_batch when batch_size recipes are waiting or
+    flush_interval seconds passed since the last flush, like dump_data.RecipeWriter.
+    """
+    name = None
+
+    def __init__(self, batch_size=constants['WRITE_BATCH_SIZE'], flush_interval=constants['WRITE_FLUSH_SECS']):
+        """
+        :param batch_size: number of buffered recipes that triggers a flush
+        :param flush_interval: number of seconds after which buffered recipes are flushed
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, scraped_data):
+        """
+        Buffers a scraped recipe and flushes the buffer if it is full or due.
+        :param scraped_data: A dictionary containing information about a recipe.
+        :return: list: the recipes a flush could not write, see flush()
+        """
+        self.buffer.append(scraped_data)
+        if len(self.buffer) >= self.batch_size:
+            return self.flush()
+        return self.flush_if_due()
+
+    def flush_if_due(self):
+        """
+        Flushes the buffer if flush_interval seconds passed since the last flush.
+        :return: list: the recipes the flush could not write, see flush()
+        """
+        if self.buffer and time.monotonic() - self.last_flush >= self.flush_interval:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        Writes the buffered recipes. A batch that fails is logged and handed back instead of being dropped, so the
+        caller can retry the links of its recipes.
+        :return: list: the recipes that could not be written
+        """
+        batch, self.buffer = self.buffer, []
+        self.last_flush = time.monotonic()
+        if not batch:
+            return []
+        try:
+            with mt.timer('sink_flush_seconds', sink=self.name):
+                written = self.write_batch(batch)
+        except Exception as ex:
+            mt.inc('sink_batch_failures_total', sink=self.name)
+            logging.error('%s sink: could not write a batch of %s recipes: %s', self.name, len(batch), ex)
+            return batch
+        mt.inc('recipes_written_total', written)
+        return []
+
+    def write_batch(self, batch):
+        """
+        :param batch: list of scraped_data dictionaries
+        :return: int: number of recipes written
+        :raise: Exception: If the batch could not be written.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Flushes the remaining recipes and closes the sink's file.
+        """
+        self.flush()
+
+
+class SQLiteSink(BufferedSink):
+    """
+    Writes the recipes to a local SQLite file with the tables of database_creation. Recipes already in the file
+    (same link or title) are skipped, like the MySQL unique keys do.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path=constants['SINK_PATHS']['sqlite'], **kwargs):
+        """
+        :param path: str: path of the SQLite file
+        """
+        super().__init__(**kwargs)
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        for statement in SQLITE_SCHEMA:
+            self.connection.execute(statement)
+        self.category_ids = dict(self.connection.execute('SELECT category, id FROM categories'))
+
+    def write_batch(self, batch):
+        """
+        Writes a batch of recipes and their child rows in one transaction, rolling back and re-raising on error.
+        """
+        cursor = self.connection.cursor()
+        new_category_ids = {}
+        try:
+            cursor.execute('BEGIN')
+            inserted = []
+            for recipe in batch:
+                cursor.execute('INSERT OR IGNORE INTO recipes (link, title, title_hash, num_reviews, rating, '
+                               'date_published) VALUES (?, ?, ?, ?, ?, ?)',
+                               (recipe.get('link'), recipe.get('title'), dd.title_hash(recipe.get('title')),
+                                to_int(recipe.get('reviews')), recipe.get('rating'), to_text(recipe.get('published'))))
+                if cursor.rowcount == 1:
+                    inserted.append((cursor.lastrowid, recipe))
+            details = [(recipe_id, *(to_int(recipe['details'].get(key)) for key in dd.DETAILS_KEYS))
+                       for recipe_id, recipe in inserted if recipe.get('details')]
+            cursor.executemany('INSERT INTO recipe_details VALUES (?, ?, ?, ?, ?)', details)
+            nutrition = [(recipe_id, *(to_int(recipe['nutrition'].get(key)) for key in dd.NUTRITION_KEYS))
+                         for recipe_id, recipe in inserted if recipe.get('nutrition')]
+            cursor.executemany('INSERT OR IGNORE INTO nutrition_facts VALUES (?, ?, ?, ?, ?)', nutrition)
+            category_rows = []
+            for recipe_id, recipe in inserted:
+                for category in recipe.get('category') or []:
+                    if category not in self.category_ids and category not in new_category_ids:
+                        cursor.execute('INSERT OR IGNORE INTO categories (category) VALUES (?)', (category,))
+                        cursor.execute('SELECT id FROM categories WHERE category = ?', (category,))
+                        new_category_ids[category] = cursor.fetchone()[0]
+                    category_rows.append((self.category_ids.get(category) or new_category_ids[category], recipe_id))
+            cursor.executemany('INSERT INTO categories_recipes (category_id, recipe_id) VALUES (?, ?)', category_rows)
+            cursor.executemany('INSERT INTO ingredients (recipe_id, ingredient) VALUES (?, ?)',
+                               [(recipe_id, ingredient) for recipe_id, recipe in inserted
+                                for ingredient in recipe.get('ingredients') or []])
+            cursor.executemany('INSERT INTO instructions (recipe_id, step, description) VALUES (?, ?, ?)',
+                               [(recipe_id, step, description) for recipe_id, recipe in inserted
+                                for step, description in (recipe.get('instructions') or {}).items()])
+            cursor.execute('COMMIT')
+        except sqlite3.Error:
+            cursor.execute('ROLLBACK')
+            raise
+        finally:
+            cursor.close()
+        self.category_ids.update(new_category_ids)
+        return len(inserted)
+
+    def close(self):
+        super().close()
+        self.connection.close()
+
+
+class JsonlSink(BufferedSink):
+    """
+    Appends every recipe as one JSON line to a local file, written and flushed once per batch.
+    """
+    name = 'jsonl'
+
+    def __init__(self, path=constants['SINK_PATHS']['jsonl'], **kwargs):
+        """
+        :param path: str: path of the JSONL file
+        """
+        super().__init__(**kwargs)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write_batch(self, batch):
+        self.file.write(''.join(json.dumps(recipe, default=to_text, ensure_ascii=False) + '\n' for recipe in batch))
+        self.file.flush()
+        return len(batch)
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class ParquetSink(BufferedSink):
+    """
+    Writes the recipes to a new Parquet file in the sink directory, one row group per batch. The columns follow the
+    MySQL tables: the recipe fields, the details and nutrition columns, and lists for the ingredients, categories and
+    instruction steps.
+    """
+    name = 'parquet'
+
+    def __init__(self, path=constants['SINK_PATHS']['parquet'], **kwargs):
+        """
+        Creates the file part-<timestamp>.parquet in the directory path, so every run adds a file to the dataset.
+        :param path: str: path of the Parquet dataset directory
+        :raise: ImportError: If pyarrow is not installed.
+        """
+        if pyarrow is None:
+            raise ImportError('The parquet sink needs the pyarrow package')
+        super().__init__(**kwargs)
+        self.schema = pyarrow.schema([
+            ('link', pyarrow.string()), ('title', pyarrow.string()), ('num_reviews', pyarrow.int64()),
+            ('rating', pyarrow.float64()), ('date_published', pyarrow.timestamp('s')),
+            ('prep_time_mins', pyarrow.int64()), ('cook_time_mins', pyarrow.int64()),
+            ('total_time_mins', pyarrow.int64()), ('servings', pyarrow.int64()), ('calories', pyarrow.int64()),
+            ('fat_g', pyarrow.int64()), ('carbs_g', pyarrow.int64()), ('protein_g', pyarrow.int64()),
+            ('ingredients', pyarrow.list_(pyarrow.string())), ('categories', pyarrow.list_(pyarrow.string())),
+            ('instructions', pyarrow.list_(pyarrow.string())),
+        ])
+        os.makedirs(path, exist_ok=True)
+        self.path = os.path.join(path, f'part-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.parquet')
+        self.writer = parquet.ParquetWriter(self.path, self.schema, compression='zstd')
+
+    def write_batch(self, batch):
+        columns = {name: [] for name in self.schema.names}
+        for recipe in batch:
+            details = recipe.get('details') or {}
+            nutrition = recipe.get('nutrition') or {}
+            instructions = recipe.get('instructions') or {}
+            values = [recipe.get('link'), recipe.get('title'), to_int(recipe.get('reviews')), recipe.get('rating'),
+                      recipe.get('published')]
+            values += [to_int(details.get(key)) for key in dd.DETAILS_KEYS]
+            values += [to_int(nutrition.get(key)) for key in dd.NUTRITION_KEYS]
+            values += [recipe.get('ingredients'), recipe.get('category'),
+                       [instructions[step] for step in sorted(instructions)]]
+            for name, value in zip(self.schema.names, values):
+                columns[name].append(value)
+        self.writer.write_table(pyarrow.table(columns, schema=self.schema))
+        return len(batch)
+
+    def close(self):
+        super().close()
+        self.writer.close()
+
+
+def tsv_field(value):
+    """
+    Encodes a value for a LOAD DATA file with the default escaping: NULL is \\N, and backslashes, tabs, newlines,
+    carriage returns and NUL characters are backslash escaped.
+    :param value: the value
+    :return: str
+    """
+    if value is None:
+        return '\\N'
+    return str(to_text(value)).translate(TSV_ESCAPES)
+
+
+class StagingSink(BufferedSink):
+    """
+    Writes the recipes to one tab-separated staging file per table in a directory, ready for LOAD DATA. Recipe ids
+    are assigned here, counting from 1 in the staging directory, so the child rows are written with their recipe id
+    without a round trip; bulk_load.py shifts them past the ids already in the database when it loads the files.
+    Categories are staged by name and resolved to ids at load time.
+    """
+    name = 'tsv'
+
+    def __init__(self, path=constants['SINK_PATHS']['tsv'], **kwargs):
+        """
+        Opens the staging files for appending. The next recipe id follows the recipes already staged in the directory.
+        :param path: str: path of the staging directory
+        """
+        super().__init__(**kwargs)
+        os.makedirs(path, exist_ok=True)
+        recipes_path = os.path.join(path, 'recipes.tsv')
+        self.next_id = 1
+        if os.path.exists(recipes_path):
+            with open(recipes_path, encoding='utf-8') as recipes_file:
+                self.next_id += sum(1 for _ in recipes_file)
+        self.files = {table: open(os.path.join(path, f'{table}.tsv'), 'a', encoding='utf-8', newline='\n')
+                      for table in STAGING_FILES}
+
+    def write_batch(self, batch):
+        """
+        Writes a batch to the staging files. The recipes file is written first, so after a crash the next id (which
+        follows the staged recipes) never reuses the id of a staged child row.
+        """
+        rows = {table: [] for table in STAGING_FILES}
+        for recipe_id, recipe in enumerate(batch, start=self.next_id):
+            details = recipe.get('details') or {}
+            nutrition = recipe.get('nutrition') or {}
+            digest = dd.title_hash(recipe.get('title'))
+            rows['recipes'].append([recipe_id, recipe.get('link'), recipe.get('title'), digest and digest.hex(),
+                                    to_int(recipe.get('reviews')), recipe.get('rating'), recipe.get('published')])
+            if details:
+                rows['recipe_details'].append([recipe_id] + [to_int(details.get(key)) for key in dd.DETAILS_KEYS])
+            if nutrition:
+                rows['nutrition_facts'].append([recipe_id] + [to_int(nutrition.get(key)) for key in dd.NUTRITION_KEYS])
+            rows['ingredients'] += [[recipe_id, ingredient] for ingredient in recipe.get('ingredients') or []]
+            rows['instructions'] += [[recipe_id, step, description]
+                                     for step, description in (recipe.get('instructions') or {}).items()]
+            rows['categories_recipes'] += [[category, recipe_id] for category in recipe.get('category') or []]
+        for table in STAGING_FILES:
+            self.files[table].write(''.join('\t'.join(map(tsv_field, row)) + '\n' for row in rows[table]))
+            self.files[table].flush()
+        self.next_id += len(batch)
+        return len(batch)
+
+    def close(self):
+        super().close()
+        for staging_file in self.files.values():
+            staging_file.close()
+
+
+def open_sink(name, batch_size=constants['WRITE_BATCH_SIZE'], path=None):
+    """
+    Creates the sink chosen on the command line.
+    :param name: str: one of SINKS
+    :param batch_size: number of buffered recipes that triggers a flush
+    :param path: str: file (or directory for parquet and tsv) of a local sink, None for its SINK_PATHS default
+    :return: a sink object: add(), flush_if_due(), flush() and close(), usable as a context manager
+    """
+    if name == 'mysql':
+        return dd.RecipeWriter(batch_size=batch_size)
+    sink_class = {'sqlite': SQLiteSink, 'jsonl': JsonlSink, 'parquet': ParquetSink, 'tsv': StagingSink}[name]
+    return sink_class(path or constants['SINK_PATHS'][name], batch_size=batch_size)
@@ -0,0 +1,122 @@
+"""
+Local stand-in for the OpenAI completions endpoint, so the ingredient normalization in ChatGPT_API.py can be run and
+tested without network access or an API key. It answers batch prompts (BATCH_PROMPT) with a JSON array and single
+ingredient prompts (PROMPT) with a two-key dictionary, using a naive parse of the leading quantity and unit. It can
+also return malformed or incomplete answers, to exercise the re-splitting of failed batches.
+Usage: python stub_completion_server.py [--port N] [--fail-rate P] [--drop-rate P] [--latency SECS]
+Then set OPENAI_API_BASE in constants.json to http://127.0.0.1:<port>/v1
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import random
+import re
+import time
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+LINE_PATTERN = re.compile(r'^(\d+): (.*)$', re.MULTILINE)
+QUANTITY_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)(?:\s+(\d+)/(\d+)|/(\d+))?\s*(?:\(.*?\)\s*)?(\w+)?\s*(.*)$')
+GRAMS_PER_UNIT = {'cup': 240, 'cups': 240, 'ounce': 28.35, 'ounces': 28.35, 'tablespoon': 15, 'tablespoons': 15,
+                  'teaspoon': 5, 'teaspoons': 5, 'pound': 453.6, 'pounds': 453.6}
+
+
+def normalize(ingredient):
+    """
+    Splits an ingredient line into a quantity in grams (or a count if there is no known unit) and the name.
+    :param ingredient: str: e.g. '1 1/2 cups white sugar'
+    :return: dict: {'quantity': float or None, 'ingredient': str}
+    """
+    match = QUANTITY_PATTERN.match(ingredient)
+    if not match:
+        return {'quantity': None, 'ingredient': ingredient.strip() or 'N/A'}
+    whole, numerator, denominator, over, unit, rest = match.groups()
+    quantity = float(whole)
+    if numerator:
+        quantity += int(numerator) / int(denominator)
+    elif over:
+        quantity /= int(over)
+    if unit and unit.lower() in GRAMS_PER_UNIT:
+        return {'quantity': round(quantity * GRAMS_PER_UNIT[unit.lower()], 2), 'ingredient': rest.strip()}
+    name = f'{unit or ""} {rest}'.strip()
+    return {'quantity': quantity, 'ingredient': name or 'N/A'}
+
+
+def answer(prompt, fail_rate, drop_rate):
+    """
+    Builds the completion text for a prompt.
+    :param prompt: str: the prompt sent by ChatGPT_API
+    :param fail_rate: float: probability of a malformed answer
+    :param drop_rate: float: probability of leaving out each line of a batch
+    :return: str: completion text
+    """
+    if random.random() < fail_rate:
+        return 'Sorry, I cannot help with that.'
+    if prompt.startswith(constants['BATCH_PROMPT']):
+        items = [dict(normalize(text), id=int(row_id)) for row_id, text in LINE_PATTERN.findall(prompt)
+                 if random.random() >= drop_rate]
+        return '\n' + json.dumps(items)
+    ingredient = prompt[len('Categorize this string: '):].split(constants['PROMPT'])[0]
+    return '\n' + repr(normalize(ingredient))
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    """
+    Handles POST requests to .../completions (and .../engines/<engine>/completions) like the OpenAI API does.
+    """
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.endswith('/completions'):
+            self.send_error(404)
+            return
+        time.sleep(self.server.latency)
+        prompts = body.get('prompt', '')
+        prompts = prompts if isinstance(prompts, list) else [prompts]
+        choices = [{'text': answer(prompt, self.server.fail_rate, self.server.drop_rate), 'index': index,
+                    'logprobs': None, 'finish_reason': 'stop'} for index, prompt in enumerate(prompts)]
+        payload = json.dumps({'id': f'cmpl-stub-{time.time_ns()}', 'object': 'text_completion',
+                              'created': int(time.time()), 'model': body.get('model', constants['GPT_MODEL']),
+                              'choices': choices, 'usage': {}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(port=constants['STUB_SERVER_PORT'], fail_rate=0.0, drop_rate=0.0, latency=0.0):
+    """
+    Creates the stub server; call serve_forever() on it (e.g. in a thread) and shutdown() when done.
+    :param port: int: port to listen on, 0 for any free port
+    :param fail_rate: float: probability of a malformed answer
+    :param drop_rate: float: probability of leaving out each line of a batch
+    :param latency: float: seconds to wait before answering, to mimic the API round trip
+    :return: ThreadingHTTPServer object
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), CompletionHandler)
+    server.fail_rate = fail_rate
+    server.drop_rate = drop_rate
+    server.latency = latency
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stub of the OpenAI completions API')
+    parser.add_argument('--port', type=int, default=constants['STUB_SERVER_PORT'], help='Port to listen on')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Probability of a malformed answer')
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help='Probability of leaving out each ingredient of a batch answer')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering')
+    args = parser.parse_args()
+    server = make_server(args.port, args.fail_rate, args.drop_rate, args.latency)
+    print(f'Serving completions on http://127.0.0.1:{server.server_port}/v1')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+This .py file builds the pre-fetch filter of links that are already stored in the recipes table, so incremental runs
+skip them before paying for the download and the parsing. The stored links are loaded once at startup into a Bloom
+filter sized for BLOOM_FP_RATE and capped at BLOOM_MAX_BYTES. A false positive means a new recipe is skipped until a
+run with --refresh, which bypasses the filter.
+"""
+import hashlib
+import json
+import logging
+import math
+import pymysql
+import sql_connection as sq
+
+with open('constants.json') as f:
+    constants = json.load(f)
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter of strings. The bit positions of a string are derived from one blake2b digest with
+    double hashing, so adding and checking a link costs a single hash.
+    """
+
+    def __init__(self, capacity, fp_rate=constants['BLOOM_FP_RATE'], max_bytes=constants['BLOOM_MAX_BYTES']):
+        """
+        :param capacity: int: number of strings the filter is sized for
+        :param fp_rate: float: target false positive rate at capacity
+        :param max_bytes: int: upper bound of the bit array size; a filter that hits it has a higher false positive
+                          rate than fp_rate
+        """
+        capacity = max(capacity, 1)
+        wanted_bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        self.num_bits = max(min(wanted_bits, max_bytes * 8), 8)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.capacity = capacity
+
+    def positions(self, value):
+        """
+        Yields the bit positions of a string.
+        :param value: str
+        :return: generator: ints
+        """
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:], 'big') | 1
+        for i in range(self.num_hashes):
+            yield (first + i * second) % self.num_bits
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(value))
+
+    def expected_fp_rate(self):
+        """
+        :return: float: the false positive rate of the filter once it holds capacity strings
+        """
+        return (1 - math.exp(-self.num_hashes * self.capacity / self.num_bits)) ** self.num_hashes
+
+
+def load_known_links(database=constants['DATABASE_NAME']):
+    """
+    Loads every stored recipe link into a Bloom filter. The links are streamed with an unbuffered cursor, so the
+    result set is never held in memory as a whole.
+    :param database: str: name of the database
+    :return: BloomFilter, or None if no recipe is stored yet
+    """
+    with sq.pooled_connection(database) as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT COUNT(*) FROM recipes WHERE link IS NOT NULL")
+        count = cursor.fetchone()[0]
+        cursor.close()
+        if not count:
+            return None
+        known_links = BloomFilter(count)
+        cursor = connection.cursor(pymysql.cursors.SSCursor)
+        try:
+            cursor.execute("SELECT link FROM recipes WHERE link IS NOT NULL")
+            for (link,) in cursor:
+                known_links.add(link)
+        finally:
+            cursor.close()
+    logging.info('Loaded %s stored links into a %s KiB filter (expected false positive rate %.2f%%)', count,
+                 len(known_links.bits) // 1024, known_links.expected_fp_rate() * 100)
+    return known_links
+
+
+def drop_known_links(links, known_links):
+    """
+    Yields the links that are not in the known links filter, and logs how many were skipped once the stream ends.
+    :param links: iterable: urls
+    :param known_links: BloomFilter of the stored links
+    :return: generator: urls
+    """
+    skipped = 0
+    for link in links:
+        if link in known_links:
+            skipped += 1
+        else:
+            yield link
+    logging.info('Skipped %s links that are already stored', skipped)